@@ -0,0 +1,128 @@
+# mtg_ann.py
+# Approximate nearest-neighbour candidate generation (TruncatedSVD + IVF) for large card pools
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+
+class IVFIndex:
+    """
+    Inverted-file index over SVD-reduced TF-IDF embeddings
+
+    - TF-IDF rows are reduced to n_components dense dimensions with TruncatedSVD and
+      L2-normalised, so a dot product approximates the cosine similarity
+    - k-means splits the reduced vectors into n_lists clusters; each cluster keeps the
+      row ids of its members (the inverted lists)
+    - A query scores the n_probe nearest centroids and then only the rows in those lists
+      (more lists are scanned when filtering leaves fewer than the requested candidates)
+
+    Rows are stored sorted by list, so probing a list is a contiguous slice.
+    """
+
+    def __init__(self, components, centroids, vectors, list_offsets, row_ids, n_probe=8):
+        self.components = components
+        self.centroids = centroids
+        self.vectors = vectors
+        self.list_offsets = list_offsets
+        self.row_ids = row_ids
+        self.n_probe = n_probe
+
+    @classmethod
+    def build(cls, embeddings, n_components=128, n_lists=None, n_probe=8, random_state=0):
+        """
+        Build an index from a (sparse or dense) embedding matrix
+
+        Args:
+            embeddings: (n_cards, n_features) TF-IDF matrix
+            n_components: SVD dimensions (capped below the feature count)
+            n_lists: Number of IVF lists (default ~4 * sqrt(n_cards))
+            n_probe: Lists scanned per query
+            random_state: Seed for SVD and k-means
+
+        Returns:
+            IVFIndex
+        """
+        n_cards, n_features = embeddings.shape
+        n_components = max(1, min(n_components, n_features - 1, n_cards - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=random_state)
+        vectors = normalize(svd.fit_transform(embeddings)).astype(np.float32)
+
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(n_cards))
+        n_lists = max(1, min(n_lists, n_cards))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=random_state, n_init=3,
+                                 batch_size=max(1024, 4 * n_lists))
+        assignments = kmeans.fit_predict(vectors)
+        centroids = normalize(kmeans.cluster_centers_).astype(np.float32)
+
+        row_ids = np.argsort(assignments, kind='stable')
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        print(f"🧭 Built IVF index: {n_cards:,} cards, {n_components} SVD dims, {n_lists} lists")
+        return cls(svd.components_.astype(np.float32), centroids, vectors[row_ids], list_offsets,
+                   row_ids, n_probe=n_probe)
+
+    def project(self, targets):
+        """Reduce (n_queries, n_features) target embeddings to unit vectors in SVD space"""
+        reduced = np.atleast_2d(np.asarray(targets, dtype=np.float32)) @ self.components.T
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        return reduced / np.where(norms > 0, norms, 1)
+
+    def search(self, targets, n_candidates, allowed=None, n_probe=None):
+        """
+        Approximate top-n_candidates rows for each target
+
+        Args:
+            targets: (n_queries, n_features) target embeddings
+            n_candidates: Rows returned per query
+            allowed: Optional boolean mask over rows; other rows are never returned
+            n_probe: Lists scanned per query (default: the index setting)
+
+        Returns:
+            List of row id arrays (sorted ascending), one per target
+        """
+        queries = self.project(targets)
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        list_order = np.argsort(-(queries @ self.centroids.T), axis=1)
+        starts, sizes = self.list_offsets[:-1], np.diff(self.list_offsets)
+        if allowed is None:
+            allowed_sorted, allowed_sizes = None, sizes
+        else:
+            allowed_sorted = allowed[self.row_ids]
+            list_of_position = np.repeat(np.arange(len(sizes)), sizes)
+            allowed_sizes = np.bincount(list_of_position[allowed_sorted], minlength=len(sizes))
+
+        results = []
+        for query, lists in zip(queries, list_order):
+            # The n_probe nearest lists, plus further lists until n_candidates allowed rows are covered
+            covered = np.cumsum(allowed_sizes[lists])
+            n_lists = max(n_probe, int(np.searchsorted(covered, n_candidates)) + 1)
+            lists = lists[:n_lists]
+            lengths = sizes[lists]
+            # Concatenated position ranges of the probed lists
+            positions = np.repeat(starts[lists] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            if allowed_sorted is not None:
+                positions = positions[allowed_sorted[positions]]
+            if len(positions) > n_candidates:
+                scores = self.vectors[positions] @ query
+                positions = positions[np.argpartition(-scores, n_candidates - 1)[:n_candidates]]
+            results.append(np.sort(self.row_ids[positions]))
+        return results
+
+    def add(self, embeddings, first_row):
+        """
+        Append rows (numbered from first_row) to the index
+
+        New rows are projected with the existing SVD and assigned to their nearest list;
+        the centroids are not retrained.
+        """
+        vectors = self.project(embeddings.toarray() if hasattr(embeddings, 'toarray') else embeddings)
+        assignments = np.concatenate([np.repeat(np.arange(len(self.centroids)), np.diff(self.list_offsets)),
+                                      np.argmax(vectors @ self.centroids.T, axis=1)])
+        order = np.argsort(assignments, kind='stable')
+        row_ids = np.concatenate([self.row_ids, np.arange(first_row, first_row + len(vectors))])
+        self.row_ids = row_ids[order]
+        self.vectors = np.vstack([self.vectors, vectors.astype(np.float32)])[order]
+        np.cumsum(np.bincount(assignments, minlength=len(self.centroids)), out=self.list_offsets[1:])
@@ -0,0 +1,435 @@
+# mtg_benchmark.py
+# Benchmark suite and synthetic data generator for the MTG Commander Recommendation System
+#
+# Usage: python mtg_benchmark.py [--sizes 10000 100000 1000000] [--snapshot] [--output results.json]
+#                                [--import-budget 0.5] [--startup-budget 2.0]
+#
+# Each size gets its own synthetic data/processed tree under --work-dir. Every
+# measurement runs in a fresh worker process so cold start and peak RSS are not
+# polluted by earlier runs. With --snapshot, the app's own load path (snapshot plus
+# precomputed table, serving parameters) is also measured. Import time of the app
+# modules and snapshot/app startup time are checked against budgets; the exit status
+# is 1 if a budget is exceeded.
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Defaults do not depend on the working directory
+DEFAULT_WORK_DIR = os.path.join(REPO_DIR, 'data', 'benchmark')
+DEFAULT_OUTPUT = os.path.join(REPO_DIR, 'benchmark_results.json')
+
+# Modules a fresh Streamlit worker imports, timed in clean interpreters
+STARTUP_MODULES = ('mtg_recommendation_system', 'mtg_commander_app')
+IMPORT_BUDGET_S = 0.5      # Slowest import of STARTUP_MODULES
+STARTUP_BUDGET_S = 2.0     # Recommender import + snapshot load, per size
+# Heavy modules loaded during startup, reported per run (the app mode warms its precomputed
+# table, which loads duckdb and pandas, so their cost counts towards the startup budget)
+HEAVY_MODULES = ('pandas', 'duckdb', 'sklearn')
+
+# Oracle-text vocabulary; cards draw most words from one "theme" so similarity has structure
+ORACLE_WORDS = (
+    'flying haste trample vigilance lifelink deathtouch menace reach ward flash hexproof indestructible '
+    'draw card cards discard sacrifice destroy exile return graveyard battlefield hand library token tokens '
+    'create counter counters damage life gain lose opponent opponents player target creature creatures '
+    'artifact enchantment land lands spell spells instant sorcery mana add cast copy attack attacks block '
+    'blocks combat dies enters control untap tap search shuffle reveal top bottom equal power toughness '
+    'dragon elf goblin zombie human wizard soldier angel vampire treasure food clue scry mill proliferate '
+    'each whenever end turn upkeep beginning cost additional instead prevent double'
+).split()
+KEYWORDS = ('Flying', 'Haste', 'Trample', 'Vigilance', 'Lifelink', 'Deathtouch', 'Menace', 'Reach',
+            'Ward', 'Flash', 'Hexproof', 'Indestructible', 'First strike', 'Double strike', 'Treasure')
+SECONDARY_TYPES = ('Human', 'Elf', 'Goblin', 'Zombie', 'Dragon', 'Wizard', 'Soldier', 'Angel', 'Vampire',
+                   'Spirit', 'Knight', 'Shaman', 'Warrior', 'Cleric', 'Rogue', 'Beast', 'Elder', 'Druid')
+COLORS = 'WUBRG'
+
+
+def generate_synthetic_data(out_dir, n_cards=10000, n_commanders=None, recs_per_commander=60,
+                            n_themes=40, seed=0, consensus_fraction=None):
+    """
+    Write synthetic source files with the same schema as data/processed
+
+    Creates creatures_processed.csv, training_features.csv, commander_patterns.pkl and
+    tfidf_vectorizer.pkl (fitted like the real one) in out_dir. Commander patterns have the
+    keys of the real pickle, which has no consensus keywords/types, so by default the
+    keyword and type boosts never fire, as in production.
+
+    Args:
+        out_dir: Output directory
+        n_cards: Number of creature rows
+        n_commanders: Number of commanders (default: n_cards // 50, at least 10)
+        recs_per_commander: Mean training rows per commander
+        n_themes: Number of word/keyword/type themes cards and commanders are drawn from
+        seed: Random seed
+        consensus_fraction: Also write consensus_keywords/consensus_types (keywords and types
+            shared by at least this fraction of a commander's recommendations, e.g. 0.4) and
+            the fraction itself as consensus_fraction; None (default) writes neither
+
+    Returns:
+        Dictionary with row counts
+    """
+    # Kept out of module scope: --worker processes only need numpy and the recommender
+    import pandas as pd
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    n_commanders = n_commanders or max(10, n_cards // 50)
+    words = np.array(ORACLE_WORDS)
+
+    # Each theme prefers a subset of words, keywords, types and colors
+    theme_words = [rng.choice(len(words), 12, replace=False) for _ in range(n_themes)]
+    theme_keywords = [[str(k) for k in rng.choice(KEYWORDS, 2, replace=False)] for _ in range(n_themes)]
+    theme_types = [[str(t) for t in rng.choice(SECONDARY_TYPES, 2, replace=False)] for _ in range(n_themes)]
+    theme_colors = [''.join(c for c in COLORS if rng.random() < 0.35) for _ in range(n_themes)]
+
+    themes = rng.integers(0, n_themes, n_cards)
+    lengths = rng.integers(0, 40, n_cards)
+    picks = np.where(rng.random((n_cards, 40)) < 0.6,
+                     np.array(theme_words)[themes[:, None], rng.integers(0, 12, (n_cards, 40))],
+                     rng.integers(0, len(words), (n_cards, 40)))
+    texts = [' '.join(words[row[:length]]) for row, length in zip(picks, lengths.tolist())]
+
+    # 70% of cards take their theme's colors, the rest a random identity
+    random_masks = (rng.random((n_cards, 5)) < 0.2) @ (1 << np.arange(5))
+    theme_masks = np.array([sum(1 << COLORS.index(c) for c in colors) for colors in theme_colors])
+    masks = np.where(rng.random(n_cards) < 0.7, theme_masks[themes], random_masks)
+    identity_strings = [str([c for bit, c in enumerate(COLORS) if mask >> bit & 1]) for mask in range(32)]
+
+    n_theme_keywords = rng.integers(0, 3, n_cards).tolist()
+    extra_keywords = np.where(rng.random(n_cards) < 0.2, rng.integers(0, len(KEYWORDS), n_cards), -1).tolist()
+    n_theme_types = rng.integers(0, 3, n_cards).tolist()
+    keyword_lists, types = [], []
+    for theme, n_keywords, extra, n_types in zip(themes.tolist(), n_theme_keywords, extra_keywords, n_theme_types):
+        card_keywords = theme_keywords[theme][:n_keywords]
+        if extra >= 0 and KEYWORDS[extra] not in card_keywords:
+            card_keywords = card_keywords + [KEYWORDS[extra]]
+        keyword_lists.append(card_keywords)
+        types.append(' '.join(theme_types[theme][:n_types]) or None)
+
+    names = [f"Synthetic Creature {i}" for i in range(n_cards)]
+    # Separate generator, so prices do not shift the rest of the synthetic data
+    prices = np.random.default_rng([seed, 1]).lognormal(0.0, 1.5, n_cards).round(2)
+    creatures_df = pd.DataFrame({
+        'name': names,
+        'oracle_text_clean': texts,
+        'color_identity_parsed': [identity_strings[mask] for mask in masks.tolist()],
+        'keywords_parsed': [str(k) for k in keyword_lists],
+        'secondary_type': types,
+        'power_clean': rng.integers(0, 9, n_cards).astype(float),
+        'toughness_clean': rng.integers(0, 9, n_cards).astype(float)
+    })
+
+    # Commanders are creatures; their recommendations come mostly from their own theme
+    commander_rows = rng.choice(n_cards, min(n_commanders, n_cards), replace=False)
+    order = np.argsort(themes, kind='stable')
+    rows_by_theme = np.split(order, np.cumsum(np.bincount(themes, minlength=n_themes))[:-1])
+    commander_column, recommended_column, synergy_column = [], [], []
+    commander_patterns = {}
+    for commander_row in commander_rows.tolist():
+        commander_name = names[commander_row]
+        pool = rows_by_theme[themes[commander_row]]
+        n_recs = int(rng.integers(1, 2 * recs_per_commander))
+        n_on_theme = min(len(pool), int(n_recs * 0.7))
+        recs = np.unique(np.concatenate([rng.choice(pool, n_on_theme, replace=False),
+                                         rng.choice(n_cards, n_recs - n_on_theme, replace=False)]))
+        recs = recs[recs != commander_row].tolist()
+        synergy = rng.random(len(recs)).round(3)
+        commander_column.extend([commander_name] * len(recs))
+        recommended_column.extend(names[row] for row in recs)
+        synergy_column.extend(synergy.tolist())
+
+        keyword_counts = Counter(k for row in recs for k in keyword_lists[row])
+        type_counts = Counter(t for row in recs for t in (types[row] or '').split())
+        rec_prices = prices[recs]
+        patterns = {
+            'commander': commander_name,
+            'total_recommendations': len(recs),
+            'avg_synergy': float(synergy.mean()) if len(recs) else 0.0,
+            'keywords': keyword_counts.most_common(10),
+            'secondary_types': type_counts.most_common(10),
+            'avg_recommended_price': float(rec_prices.mean()) if len(recs) else 0.0,
+            'price_range': (float(rec_prices.min()), float(rec_prices.max())) if len(recs) else (0.0, 0.0)
+        }
+        if consensus_fraction is not None:
+            threshold = consensus_fraction * len(recs)
+            patterns.update(
+                consensus_fraction=consensus_fraction,
+                consensus_keywords=[(k, n) for k, n in keyword_counts.most_common() if n >= threshold],
+                consensus_types=[(t, n) for t, n in type_counts.most_common() if n >= threshold]
+            )
+        commander_patterns[commander_name] = patterns
+
+    features_df = pd.DataFrame({'commander': commander_column, 'recommended_creature': recommended_column,
+                                'synergy': synergy_column})
+    creatures_df.to_csv(os.path.join(out_dir, 'creatures_processed.csv'), index=False)
+    features_df.to_csv(os.path.join(out_dir, 'training_features.csv'), index=False)
+
+    tfidf = TfidfVectorizer(max_features=1000, min_df=2, max_df=0.8, ngram_range=(1, 2), stop_words='english')
+    tfidf.fit(creatures_df['oracle_text_clean'])
+    with open(os.path.join(out_dir, 'tfidf_vectorizer.pkl'), 'wb') as f:
+        pickle.dump(tfidf, f)
+    with open(os.path.join(out_dir, 'commander_patterns.pkl'), 'wb') as f:
+        pickle.dump(commander_patterns, f)
+
+    print(f"🧪 Synthetic data in {out_dir}: {n_cards:,} creatures, {len(commander_patterns):,} commanders, "
+          f"{len(features_df):,} training examples")
+    return {'n_cards': n_cards, 'n_commanders': len(commander_patterns), 'n_training_rows': len(features_df)}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(n_queries=200, batch_size=64, top_k=100, snapshot_dir=None, seed=0, data_dir=None,
+            precomputed_table=None, **system_params):
+    """
+    Measure the system built from data_dir in the current process
+
+    With precomputed_table, cold start includes attaching and warming the table (and the
+    duckdb and pandas imports) as mtg_commander_app.load_recommendation_system does. If the table does not exist yet,
+    it is built after the measurements for the next run.
+
+    Returns:
+        Dictionary with import and cold-start time, heavy modules loaded by startup,
+        per-query latency percentiles, batch throughput and peak RSS
+    """
+    start = time.perf_counter()
+    from mtg_recommendation_system import create_recommendation_system
+    import_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    system = create_recommendation_system(snapshot_dir=snapshot_dir, data_dir=data_dir, **system_params)
+    if precomputed_table is not None and os.path.exists(precomputed_table):
+        system.attach_precomputed_table(precomputed_table)
+        system.precomputed.warm()
+    if system.approximate:
+        system.build_ann_index()
+    # Repeated commanders must be scored again, not served from the result cache
+    system.max_cached_results = 0
+    cold_start_s = time.perf_counter() - start
+    rss_after_load = peak_rss_mb()
+    startup_modules = [module for module in HEAVY_MODULES if module in sys.modules]
+
+    rng = np.random.default_rng(seed)
+    commanders = np.array(system.get_commanders(), dtype=object)
+    queries = rng.choice(commanders, n_queries, replace=n_queries > len(commanders))
+
+    latencies = []
+    for commander_name in queries.tolist():
+        start = time.perf_counter()
+        system.get_recommendations(commander_name, top_k=top_k)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1e3
+
+    batch = rng.choice(commanders, batch_size, replace=batch_size > len(commanders)).tolist()
+    start = time.perf_counter()
+    system.get_recommendations_batch(batch, top_k=top_k)
+    batch_s = time.perf_counter() - start
+
+    if precomputed_table is not None and not os.path.exists(precomputed_table):
+        from mtg_precomputed import refresh_precomputed_table
+        refresh_precomputed_table(system, precomputed_table, top_n=top_k)
+
+    return {
+        'n_cards': len(system.card_store),
+        'n_commanders': len(commanders),
+        'n_training_rows': len(system.get_indexes()['recommended_codes']),
+        'import_s': import_s,
+        'cold_start_s': cold_start_s,
+        'startup_modules': startup_modules,
+        'query_first_ms': float(latencies[0]),
+        'query_p50_ms': float(np.percentile(latencies, 50)),
+        'query_p99_ms': float(np.percentile(latencies, 99)),
+        'query_mean_ms': float(latencies.mean()),
+        'batch_size': len(batch),
+        'batch_throughput_qps': len(batch) / batch_s,
+        'peak_rss_after_load_mb': rss_after_load,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def worker_env():
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+
+
+def run_worker(work_dir, options):
+    """Run measure() in a fresh interpreter with work_dir as the working directory"""
+    command = [sys.executable, os.path.abspath(__file__), '--worker', json.dumps(options)]
+    env = worker_env()
+    completed = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Benchmark worker failed:\n{completed.stderr}")
+    # The result is the last stdout line; everything before it is the system's progress output
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure_imports(modules=STARTUP_MODULES, repeats=3):
+    """
+    Import time of each module in a clean interpreter (median of repeats)
+
+    Returns:
+        Dictionary mapping module name to seconds
+    """
+    timings = {}
+    for module in modules:
+        code = (f"import time; start = time.perf_counter(); import {module}; "
+                f"print(time.perf_counter() - start)")
+        samples = []
+        for _ in range(repeats):
+            completed = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], env=worker_env(),
+                                       capture_output=True, text=True)
+            if completed.returncode != 0:
+                raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+            samples.append(float(completed.stdout.strip().splitlines()[-1]))
+        timings[module] = float(np.median(samples))
+    return timings
+
+
+def check_budgets(report, import_budget=IMPORT_BUDGET_S, startup_budget=STARTUP_BUDGET_S):
+    """
+    Compare import and snapshot startup times with their budgets
+
+    Startup is recommender import plus cold start of the snapshot and app runs (the app
+    run attaches the precomputed table too); it is not checked when no snapshot run was
+    benchmarked.
+
+    Returns:
+        List of budget checks, each a dictionary with name, seconds, budget and ok
+    """
+    checks = [{'name': f"import {module}", 'seconds': seconds, 'budget': import_budget}
+              for module, seconds in report['imports'].items()]
+    checks += [{'name': f"startup {result['n_cards']:,} cards ({result['mode']})", 'seconds': result['import_s'] + result['cold_start_s'],
+                'budget': startup_budget}
+               for result in report['results'] if result['mode'] in ('snapshot', 'app')]
+    for check in checks:
+        check['ok'] = check['seconds'] <= check['budget']
+        print(f"{'✅' if check['ok'] else '❌'} {check['name']}: {check['seconds']:.2f}s "
+              f"(budget {check['budget']:.2f}s)")
+    return checks
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=(10000,), work_dir=DEFAULT_WORK_DIR, n_queries=200, batch_size=64, top_k=100,
+                   snapshot=False, sparse_embeddings=True, approximate=False, seed=0):
+    """
+    Generate (or reuse) synthetic data for each size and benchmark it
+
+    Args:
+        sizes: Creature counts to benchmark
+        work_dir: Directory holding one synthetic tree per size
+        n_queries: Single-commander queries timed per size
+        batch_size: Commanders in the batch-throughput run
+        top_k: Recommendations per query
+        snapshot: Also benchmark loading from a snapshot, and the app's load path (snapshot
+            plus precomputed table with SERVING_PARAMS); both are built by a first, untimed run
+        sparse_embeddings: Build the system with sparse embeddings
+        approximate: Score only ANN candidates (the index build counts towards cold start)
+        seed: Random seed for data and query sampling
+
+    Returns:
+        Dictionary with run metadata and one result per (size, mode)
+    """
+    import pandas as pd
+    from mtg_precomputed import SERVING_PARAMS
+
+    results = []
+    for n_cards in sizes:
+        size_dir = os.path.abspath(os.path.join(work_dir, f"n{n_cards}"))
+        data_dir = os.path.join(size_dir, 'data', 'processed')
+        if not os.path.exists(os.path.join(data_dir, 'commander_patterns.pkl')):
+            generate_synthetic_data(data_dir, n_cards=n_cards, seed=seed)
+
+        options = dict(n_queries=n_queries, batch_size=batch_size, top_k=top_k, seed=seed, data_dir=data_dir,
+                       sparse_embeddings=sparse_embeddings, approximate=approximate)
+        modes = [('sources', options)]
+        if snapshot:
+            snapshot_options = dict(options, snapshot_dir=os.path.join(size_dir, 'snapshot'))
+            # Snapshots always have sparse embeddings, as in the app
+            app_options = dict(snapshot_options, **SERVING_PARAMS, sparse_embeddings=True,
+                               precomputed_table=os.path.join(size_dir, 'precomputed.duckdb'))
+            run_worker(size_dir, dict(app_options, n_queries=1, batch_size=1))
+            modes += [('snapshot', snapshot_options), ('app', app_options)]
+
+        for mode, mode_options in modes:
+            result = dict(run_worker(size_dir, mode_options), mode=mode)
+            results.append(result)
+            print(f"⏱️ {n_cards:,} cards ({mode}): cold start {result['cold_start_s']:.2f}s, "
+                  f"p50 {result['query_p50_ms']:.2f} ms, p99 {result['query_p99_ms']:.2f} ms, "
+                  f"batch {result['batch_throughput_qps']:.0f} q/s, peak RSS {result['peak_rss_mb']:.0f} MB, "
+                  f"startup loaded {', '.join(result['startup_modules']) or 'no heavy modules'}")
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'n_queries': n_queries,
+            'batch_size': batch_size,
+            'top_k': top_k,
+            'sparse_embeddings': sparse_embeddings,
+            'approximate': approximate
+        },
+        'imports': measure_imports(),
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the recommendation engine on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000], help='Creature counts (10k to 1M)')
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help='Where synthetic data is generated')
+    parser.add_argument('--queries', type=int, default=200, help='Timed single-commander queries per size')
+    parser.add_argument('--batch-size', type=int, default=64, help='Commanders in the batch throughput run')
+    parser.add_argument('--top-k', type=int, default=100)
+    parser.add_argument('--snapshot', action='store_true', help='Also benchmark snapshot loading')
+    parser.add_argument('--dense', action='store_true', help='Use dense embeddings')
+    parser.add_argument('--approximate', action='store_true', help='Score only ANN candidates')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='JSON results file')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_S,
+                        help='Seconds allowed for importing each app module')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET_S,
+                        help='Seconds allowed for recommender import plus snapshot load')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(**json.loads(args.worker))))
+        return
+
+    report = run_benchmarks(args.sizes, work_dir=args.work_dir, n_queries=args.queries,
+                            batch_size=args.batch_size, top_k=args.top_k, snapshot=args.snapshot,
+                            sparse_embeddings=not args.dense, approximate=args.approximate, seed=args.seed)
+    report['budgets'] = check_budgets(report, args.import_budget, args.startup_budget)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Benchmark results written to {args.output}")
+    if not all(check['ok'] for check in report['budgets']):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
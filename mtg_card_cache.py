@@ -0,0 +1,254 @@
+# mtg_card_cache.py
+# Persistent per-card Scryfall metadata cache (SQLite), shared across workers and restarts
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# $MTG_CARD_CACHE, else data/card_cache.sqlite next to this module (independent of the working directory)
+DEFAULT_CACHE_PATH = os.environ.get('MTG_CARD_CACHE',
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'card_cache.sqlite'))
+PRICE_TTL = 24 * 3600        # Prices move daily
+IMAGE_TTL = 30 * 24 * 3600   # Image and Scryfall URLs are effectively static
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    name TEXT PRIMARY KEY,
+    found INTEGER NOT NULL,
+    image_url TEXT,
+    scryfall_url TEXT,
+    price_usd TEXT,
+    image_fetched_at REAL NOT NULL,
+    price_fetched_at REAL NOT NULL
+)
+"""
+
+
+def extract_card_data(data):
+    """Card data dictionary used by the app from a Scryfall card object"""
+    image_uris = data.get('image_uris') or {}
+    if not image_uris and data.get('card_faces'):
+        # Double-faced cards keep their images on the faces
+        image_uris = data['card_faces'][0].get('image_uris') or {}
+    return {
+        'image_url': image_uris.get('large') or image_uris.get('normal') or image_uris.get('small'),
+        'price_usd': (data.get('prices') or {}).get('usd'),
+        'scryfall_url': data.get('scryfall_uri', '')
+    }
+
+
+class CardMetadataCache:
+    """
+    Per-card cache of image URL, price and Scryfall URL
+
+    Rows are keyed on card name, so lists that share cards share cache entries.
+    Prices and images have separate TTLs. Expired entries are still served
+    (stale-while-revalidate) while a background thread refreshes them. SQLite in
+    WAL mode lets several worker processes read and write the same file.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, price_ttl=PRICE_TTL, image_ttl=IMAGE_TTL):
+        self.path = path
+        self.price_ttl = price_ttl
+        self.image_ttl = image_ttl
+        self._local = threading.local()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as con:
+            con.execute(SCHEMA)
+
+    def _connection(self):
+        # sqlite3 connections are not shared across threads; keep one per thread
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    def get_many(self, card_names, now=None):
+        """
+        Look up cached card data
+
+        Returns:
+            Tuple of (results, stale, missing): results maps name to card data (None for
+            cards Scryfall does not know), stale lists cached names past a TTL (still in
+            results), missing lists names with no cache entry
+        """
+        now = time.time() if now is None else now
+        names = list(dict.fromkeys(card_names))
+        rows = {}
+        con = self._connection()
+        for start in range(0, len(names), 500):
+            batch = names[start:start + 500]
+            placeholders = ', '.join('?' * len(batch))
+            for row in con.execute(f"SELECT name, found, image_url, scryfall_url, price_usd, image_fetched_at, "
+                                   f"price_fetched_at FROM cards WHERE name IN ({placeholders})", batch):
+                rows[row[0]] = row
+
+        results, stale, missing = {}, [], []
+        for name in names:
+            row = rows.get(name)
+            if row is None:
+                missing.append(name)
+                continue
+            _, found, image_url, scryfall_url, price_usd, image_fetched_at, price_fetched_at = row
+            results[name] = {'image_url': image_url, 'price_usd': price_usd,
+                             'scryfall_url': scryfall_url} if found else None
+            if now - price_fetched_at > self.price_ttl or now - image_fetched_at > self.image_ttl:
+                stale.append(name)
+        return results, stale, missing
+
+    def get_prices(self, card_names=None):
+        """
+        Cached USD prices as floats (cards without a known price are omitted)
+
+        Args:
+            card_names: Names to look up (default: every cached card)
+        """
+        con = self._connection()
+        query = "SELECT name, price_usd FROM cards WHERE found = 1 AND price_usd IS NOT NULL"
+        if card_names is None:
+            rows = con.execute(query).fetchall()
+        else:
+            names = list(dict.fromkeys(card_names))
+            rows = []
+            for start in range(0, len(names), 500):
+                batch = names[start:start + 500]
+                rows.extend(con.execute(f"{query} AND name IN ({', '.join('?' * len(batch))})", batch))
+        prices = {}
+        for name, price in rows:
+            try:
+                prices[name] = float(price)
+            except ValueError:
+                pass
+        return prices
+
+    def price_version(self):
+        """Changes whenever card data is written (entry count and latest price fetch time)"""
+        count, latest = self._connection().execute("SELECT count(*), max(price_fetched_at) FROM cards").fetchone()
+        return f"{count}.{latest or 0}"
+
+    def put_many(self, card_data, now=None):
+        """Store fetched card data (name -> card data dict, or None if not found)"""
+        now = time.time() if now is None else now
+        rows = [
+            (name, 1, data.get('image_url'), data.get('scryfall_url'), data.get('price_usd'), now, now)
+            if data else (name, 0, None, None, None, now, now)
+            for name, data in card_data.items()
+        ]
+        con = self._connection()
+        with con:
+            con.executemany("INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def get_or_fetch(self, card_names, fetch):
+        """
+        Cached card data for card_names, fetching only what is not cached
+
+        Args:
+            card_names: Card names to look up
+            fetch: Callable taking a list of names and returning {name: card data}, with None
+                for cards Scryfall does not know and failed lookups left out
+
+        Returns:
+            Dictionary mapping each name to its card data (or None)
+        """
+        results, stale, missing = self.get_many(card_names)
+        if missing:
+            # Names absent from the fetch result failed (e.g. network error) and are not cached
+            fetched = fetch(missing)
+            self.put_many({name: fetched[name] for name in missing if name in fetched})
+            results.update({name: fetched.get(name) for name in missing})
+        if stale:
+            self.revalidate(stale, fetch)
+        return results
+
+    def iter_or_fetch(self, card_names, fetch_iter):
+        """
+        Cached card data for card_names, then fetched card data as each lookup finishes
+
+        Args:
+            card_names: Card names to look up
+            fetch_iter: Callable taking a list of names and yielding (name, card data) pairs
+                as lookups finish (e.g. ScryfallClient.iter_cards), skipping failed lookups
+
+        Yields:
+            (name, card data or None) pairs: every cached name first, then missing names in
+            completion order. Names whose lookup failed are yielded last with None.
+        """
+        results, stale, missing = self.get_many(card_names)
+        yield from results.items()
+        if stale:
+            self.revalidate(stale, lambda names: dict(fetch_iter(names)))
+        pending = set(missing)
+        for name, data in fetch_iter(missing) if missing else ():
+            if name in pending:
+                pending.discard(name)
+                self.put_many({name: data})
+                yield name, data
+        # Failed lookups are not cached
+        for name in missing:
+            if name in pending:
+                yield name, None
+
+    def revalidate(self, card_names, fetch):
+        """Refresh stale entries in a background thread (at most one refresh per name at a time)"""
+        with self._lock:
+            names = [name for name in card_names if name not in self._refreshing]
+            self._refreshing.update(names)
+        if not names:
+            return None
+
+        def refresh():
+            try:
+                fetched = fetch(names)
+                # Failed lookups are absent from the result, so their stale entries are kept
+                self.put_many(fetched)
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.difference_update(names)
+
+        thread = threading.Thread(target=refresh, name='card-cache-revalidate', daemon=True)
+        thread.start()
+        return thread
+
+    def prewarm_from_bulk_data(self, bulk_path, now=None):
+        """
+        Load card data from a Scryfall bulk-data JSON file (e.g. oracle-cards.json)
+
+        Double-faced cards are also stored under each face name. For repeated names
+        (default-cards has one entry per printing) the first printing with a USD price wins.
+
+        Returns:
+            Number of card names stored
+        """
+        with open(bulk_path, 'rb') as f:
+            cards = json.load(f)
+
+        card_data = {}
+        for card in cards:
+            data = extract_card_data(card)
+            names = [card.get('name', '')]
+            if ' // ' in names[0]:
+                names.extend(names[0].split(' // '))
+            for name in filter(None, names):
+                current = card_data.get(name)
+                if current is None or (not current['price_usd'] and data['price_usd']):
+                    card_data[name] = data
+
+        self.put_many(card_data, now=now)
+        print(f"🗂️ Pre-warmed card cache with {len(card_data):,} cards from {bulk_path}")
+        return len(card_data)
+
+
+if __name__ == "__main__":
+    CardMetadataCache(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_CACHE_PATH).prewarm_from_bulk_data(sys.argv[1])
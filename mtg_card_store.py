@@ -0,0 +1,284 @@
+# mtg_card_store.py
+# Parse-once columnar card attributes for the MTG Commander Recommendation System
+
+import ast
+import json
+import os
+import numpy as np
+
+# Numeric columns persisted as .npy files by CardStore.save
+ARRAY_COLUMNS = ('power', 'toughness', 'oracle_length', 'color_mask', 'keyword_bits', 'type_bits')
+# String columns persisted as StringTables by CardStore.save
+STRING_COLUMNS = ('names', 'oracle_text')
+
+# WUBRG color identity bits
+COLOR_BITS = {'W': 1, 'U': 2, 'B': 4, 'R': 8, 'G': 16}
+
+
+def color_mask(colors):
+    """Encode an iterable of color symbols as a 5-bit WUBRG mask"""
+    mask = 0
+    for color in colors:
+        mask |= COLOR_BITS.get(color, 0)
+    return mask
+
+
+def small_numbers(values):
+    """Store power/toughness as int8 when that is lossless, else as float32 (e.g. NaN or half points)"""
+    values = np.asarray(values, dtype=float)
+    if np.all(np.isfinite(values)) and np.all(values == np.round(values)) and np.all(np.abs(values) <= 127):
+        return values.astype(np.int8)
+    return values.astype(np.float32)
+
+
+class StringTable:
+    """
+    Immutable list of strings held as one UTF-8 buffer plus offsets
+
+    Unlike an object array, the table is two flat numpy arrays: it can be memory-mapped
+    from a snapshot and is never written to by reference counting, so pages stay shared
+    between forked workers. Strings are decoded on access.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        """One string for an integer index, a list of strings for an array of indices"""
+        if isinstance(index, (int, np.integer)):
+            return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+        data, offsets = self.data, self.offsets
+        return [data[offsets[i]:offsets[i + 1]].tobytes().decode('utf-8') for i in np.asarray(index).tolist()]
+
+    def __iter__(self):
+        buffer = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield buffer[start:end].decode('utf-8')
+
+    def extend(self, strings):
+        """New table with strings appended"""
+        added = StringTable.from_strings(strings)
+        return StringTable(np.concatenate([self.data, added.data]),
+                           np.concatenate([self.offsets, added.offsets[1:] + self.offsets[-1]]))
+
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+    def save(self, directory, name):
+        np.save(os.path.join(directory, f"{name}_data.npy"), self.data)
+        np.save(os.path.join(directory, f"{name}_offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, directory, name, mmap_mode='r'):
+        return cls(np.load(os.path.join(directory, f"{name}_data.npy"), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, f"{name}_offsets.npy"), mmap_mode=mmap_mode))
+
+
+def parse_keywords(keywords):
+    """Parse a stringified keyword list (e.g. "['Flying', 'Haste']")"""
+    if isinstance(keywords, str) and keywords:
+        return ast.literal_eval(keywords)
+    return []
+
+
+def parse_secondary_types(types):
+    """Split a secondary type line (e.g. "Elf Druid") into tokens"""
+    return str(types).split() if types else []
+
+
+def build_bitsets(token_lists, vocab=None):
+    """
+    Encode per-card token lists as packed uint64 bitsets
+
+    Args:
+        token_lists: One iterable of string tokens per card
+        vocab: Optional existing token -> code mapping to extend
+
+    Returns:
+        Tuple of (bitsets array of shape (n_cards, n_words), vocab dict)
+    """
+    vocab = dict(vocab or {})
+    codes = []
+    for tokens in token_lists:
+        row_codes = []
+        for token in tokens:
+            code = vocab.get(token)
+            if code is None:
+                code = vocab[token] = len(vocab)
+            row_codes.append(code)
+        codes.append(row_codes)
+
+    n_words = max(1, (len(vocab) + 63) // 64)
+    bitsets = np.zeros((len(codes), n_words), dtype=np.uint64)
+    rows = np.repeat(np.arange(len(codes)), [len(c) for c in codes])
+    flat = np.fromiter((code for row_codes in codes for code in row_codes), dtype=np.int64, count=len(rows))
+    if len(flat):
+        bits = np.left_shift(np.uint64(1), (flat % 64).astype(np.uint64))
+        np.bitwise_or.at(bitsets, (rows, flat // 64), bits)
+    return bitsets, vocab
+
+
+class CardStore:
+    """
+    Columnar card attributes parsed once at load time
+
+    Columns (one entry per row of creatures_df):
+    - names / oracle_text: StringTables of card names and cleaned oracle text
+    - power / toughness: int8 arrays (float32 if any value is not a small integer)
+    - oracle_length: int32 array (length of the stringified oracle text, 0 if empty)
+    - color_mask: uint8 WUBRG bitmask
+    - keyword_bits / type_bits: packed uint64 bitsets over keyword_vocab / type_vocab
+    """
+
+    def __init__(self, names, oracle_text, power, toughness, oracle_length, color_mask,
+                 keyword_bits, keyword_vocab, type_bits, type_vocab):
+        self.names = names
+        self.oracle_text = oracle_text
+        self.power = power
+        self.toughness = toughness
+        self.oracle_length = oracle_length
+        self.color_mask = color_mask
+        self.keyword_bits = keyword_bits
+        self.keyword_vocab = keyword_vocab
+        self.type_bits = type_bits
+        self.type_vocab = type_vocab
+
+    @staticmethod
+    def _scalar_columns(creatures_df):
+        return {
+            'names': StringTable.from_strings(creatures_df['name'].astype(str)),
+            'oracle_text': StringTable.from_strings(creatures_df['oracle_text_clean'].fillna('').astype(str)),
+            'power': small_numbers(creatures_df['power_clean']),
+            'toughness': small_numbers(creatures_df['toughness_clean']),
+            'oracle_length': np.array([len(str(text)) if text else 0 for text in creatures_df['oracle_text_clean']],
+                                      dtype=np.int32),
+            'color_mask': np.array([color_mask(ast.literal_eval(c)) for c in creatures_df['color_identity_parsed']],
+                                   dtype=np.uint8)
+        }
+
+    @classmethod
+    def from_dataframe(cls, creatures_df):
+        """Normalise the stringified creatures_processed.csv columns into arrays"""
+        keyword_bits, keyword_vocab = build_bitsets(parse_keywords(k) for k in creatures_df['keywords_parsed'])
+        type_bits, type_vocab = build_bitsets(parse_secondary_types(t) for t in creatures_df['secondary_type'])
+        return cls(
+            keyword_bits=keyword_bits,
+            keyword_vocab=keyword_vocab,
+            type_bits=type_bits,
+            type_vocab=type_vocab,
+            **cls._scalar_columns(creatures_df)
+        )
+
+    def extend(self, creatures_df):
+        """
+        New store with the rows of creatures_df appended
+
+        New keywords and types extend the vocabularies; existing bitsets are widened with
+        zero words if the vocabulary outgrows them.
+        """
+        keyword_bits, keyword_vocab = build_bitsets((parse_keywords(k) for k in creatures_df['keywords_parsed']),
+                                                    self.keyword_vocab)
+        type_bits, type_vocab = build_bitsets((parse_secondary_types(t) for t in creatures_df['secondary_type']),
+                                              self.type_vocab)
+        added = {
+            'power': creatures_df['power_clean'],
+            'toughness': creatures_df['toughness_clean'],
+            'oracle_length': np.array([len(str(text)) if text else 0 for text in creatures_df['oracle_text_clean']],
+                                      dtype=np.int32),
+            'color_mask': np.array([color_mask(ast.literal_eval(c)) for c in creatures_df['color_identity_parsed']],
+                                   dtype=np.uint8)
+        }
+
+        def widen(bits, n_words):
+            return np.pad(bits, ((0, 0), (0, n_words - bits.shape[1])))
+
+        n_keyword_words = max(self.keyword_bits.shape[1], keyword_bits.shape[1])
+        n_type_words = max(self.type_bits.shape[1], type_bits.shape[1])
+        return CardStore(
+            names=self.names.extend(creatures_df['name'].astype(str)),
+            oracle_text=self.oracle_text.extend(creatures_df['oracle_text_clean'].fillna('').astype(str)),
+            power=small_numbers(np.concatenate([self.power, added['power']])),
+            toughness=small_numbers(np.concatenate([self.toughness, added['toughness']])),
+            oracle_length=np.concatenate([self.oracle_length, added['oracle_length']]),
+            color_mask=np.concatenate([self.color_mask, added['color_mask']]),
+            keyword_bits=np.vstack([widen(self.keyword_bits, n_keyword_words), widen(keyword_bits, n_keyword_words)]),
+            keyword_vocab=keyword_vocab,
+            type_bits=np.vstack([widen(self.type_bits, n_type_words), widen(type_bits, n_type_words)]),
+            type_vocab=type_vocab
+        )
+
+    def save(self, directory):
+        """Write numeric columns and string tables as .npy files and vocabularies as JSON"""
+        os.makedirs(directory, exist_ok=True)
+        for column in ARRAY_COLUMNS:
+            np.save(os.path.join(directory, f"{column}.npy"), getattr(self, column))
+        for column in STRING_COLUMNS:
+            getattr(self, column).save(directory, column)
+        with open(os.path.join(directory, 'vocab.json'), 'w') as f:
+            json.dump({'keyword_vocab': self.keyword_vocab, 'type_vocab': self.type_vocab}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Load a store written by save(); arrays are memory-mapped by default"""
+        arrays = {column: np.load(os.path.join(directory, f"{column}.npy"), mmap_mode=mmap_mode)
+                  for column in ARRAY_COLUMNS}
+        strings = {column: StringTable.load(directory, column, mmap_mode=mmap_mode) for column in STRING_COLUMNS}
+        with open(os.path.join(directory, 'vocab.json')) as f:
+            vocab = json.load(f)
+        return cls(**strings, **arrays, **vocab)
+
+    def __len__(self):
+        return len(self.names)
+
+    def nbytes(self):
+        """Memory held by the store's arrays, in bytes"""
+        return (sum(getattr(self, column).nbytes for column in ARRAY_COLUMNS)
+                + sum(getattr(self, column).nbytes() for column in STRING_COLUMNS))
+
+    @staticmethod
+    def _query_bits(tokens, vocab, n_words):
+        query = np.zeros(n_words, dtype=np.uint64)
+        for token in tokens:
+            code = vocab.get(token)
+            if code is not None:
+                query[code // 64] |= np.uint64(1) << np.uint64(code % 64)
+        return query
+
+    def keyword_query(self, keywords):
+        """Bitset selecting any of the given keywords"""
+        return self._query_bits(keywords, self.keyword_vocab, self.keyword_bits.shape[1])
+
+    def type_query(self, types):
+        """Bitset selecting any of the given secondary types"""
+        return self._query_bits(types, self.type_vocab, self.type_bits.shape[1])
+
+    def valid_color_identity(self, commander_mask, rows=None):
+        """Rows whose color identity is a subset of the commander's (colorless always valid)"""
+        masks = self.color_mask if rows is None else self.color_mask[rows]
+        return (masks & ~np.uint8(commander_mask)) == 0
+
+    def first_matching_type(self, rows, secondary_types):
+        """For each row, the first of secondary_types the card has (None if none match)"""
+        matched = [None] * len(rows)
+        unmatched = np.ones(len(rows), dtype=bool)
+        for secondary_type in secondary_types:
+            code = self.type_vocab.get(secondary_type)
+            if code is None:
+                continue
+            has_type = (self.type_bits[rows, code // 64] & (np.uint64(1) << np.uint64(code % 64))) != 0
+            for position in np.flatnonzero(has_type & unmatched).tolist():
+                matched[position] = secondary_type
+            unmatched &= ~has_type
+        return matched
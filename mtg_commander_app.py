@@ -1,15 +1,35 @@
 # MTG Commander Recommendation Web App - Clean and Optimized
 # Run with: streamlit run mtg_commander_app.py
 
+# The recommender, pandas and httpx are imported on first use, so a fresh Streamlit
+# worker renders the page without waiting for them
+
+import os
+import re
+import threading
 import streamlit as st
-import pandas as pd
-import requests
-import asyncio
-import httpx
-from mtg_recommendation_system import create_recommendation_system
+from mtg_card_cache import CardMetadataCache, DEFAULT_CACHE_PATH
+from mtg_metrics import MetricsRegistry, StageTimer
 import warnings
 warnings.filterwarnings('ignore')
 
+# Data paths default to data/ next to this file, so the app runs from any working directory
+# (source files: $MTG_DATA_DIR, see mtg_recommendation_system.DATA_DIR). These match
+# mtg_snapshot.DEFAULT_SNAPSHOT_DIR and mtg_precomputed.DEFAULT_TABLE_PATH, which are not
+# imported here to keep startup light
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.environ.get('MTG_SNAPSHOT_DIR', os.path.join(APP_DIR, 'data', 'snapshot'))
+
+# Built offline by mtg_precomputed.py with the same scoring parameters as below
+PRECOMPUTED_TABLE = os.environ.get('MTG_PRECOMPUTED_TABLE', os.path.join(APP_DIR, 'data', 'precomputed.duckdb'))
+
+# Top of the Max Price slider; the top setting means no price limit
+MAX_PRICE_LIMIT = 500.0
+
+# Persistent card cache location ($MTG_CARD_CACHE or data/ next to this file) and Scryfall API
+# base URL (overridable for local testing)
+CARD_CACHE_PATH = DEFAULT_CACHE_PATH
+
 # Configure page
 st.set_page_config(
     page_title="MTG Commander Crafter",
@@ -18,89 +38,64 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-@st.cache_data(ttl=3600)
-def get_card_data(card_name):
-    try:
-        clean_name = card_name.strip().replace("'", "").replace(",", "").replace("//", "")
-        url = f"https://api.scryfall.com/cards/named?exact={clean_name}"
-        response = requests.get(url, timeout=8)
-        if response.status_code == 200:
-            data = response.json()
-        elif response.status_code == 404:
-            url = f"https://api.scryfall.com/cards/named?fuzzy={clean_name}"
-            response = requests.get(url, timeout=8)
-            if response.status_code != 200:
-                return None
-            data = response.json()
-        else:
-            return None
-        return {
-            'image_url': (data.get('image_uris', {}).get('large') or 
-                         data.get('image_uris', {}).get('normal') or 
-                         data.get('image_uris', {}).get('small')),
-            'price_usd': data.get('prices', {}).get('usd'),
-            'scryfall_url': data.get('scryfall_uri', '')
-        }
-    except Exception:
-        return None
+@st.cache_resource
+def get_scryfall_client():
+    from mtg_scryfall_client import ScryfallClient, SCRYFALL_API_URL
+    return ScryfallClient(os.environ.get('SCRYFALL_API_URL', SCRYFALL_API_URL))
 
-async def fetch_card_async(client, card_name):
-    clean_name = card_name.strip().replace("'", "").replace(",", "").replace("//", "")
-    url = f"https://api.scryfall.com/cards/named?exact={clean_name}"
-    try:
-        response = await client.get(url, timeout=8)
-        if response.status_code == 404:
-            url = f"https://api.scryfall.com/cards/named?fuzzy={clean_name}"
-            response = await client.get(url, timeout=8)
-        if response.status_code == 200:
-            data = response.json()
-            return card_name, {
-                'image_url': (data.get('image_uris', {}).get('large') or 
-                              data.get('image_uris', {}).get('normal') or 
-                              data.get('image_uris', {}).get('small')),
-                'price_usd': data.get('prices', {}).get('usd'),
-                'scryfall_url': data.get('scryfall_uri', '')
-            }
-    except Exception:
-        pass
-    return card_name, None
-
-async def get_all_card_data_async(card_names):
-    async with httpx.AsyncClient() as client:
-        tasks = [fetch_card_async(client, name) for name in card_names]
-        results = await asyncio.gather(*tasks)
-    return dict(results)
-
-@st.cache_data(ttl=1800)
-def get_batch_card_data(card_names):
-    return asyncio.run(get_all_card_data_async(card_names))
-
-def display_commander_card(commander_name, commander_info):
-    col1, col2 = st.columns([1, 2])
-    with col1:
-        commander_data = get_card_data(commander_name)
-        image_url = (commander_data.get('image_url') if commander_data else None) or "https://via.placeholder.com/400x560/2c3e50/ecf0f1?text=Commander"
-        caption_text = f"🎖️ {commander_name}"
-        if commander_data and commander_data.get('price_usd'):
-            try:
-                price = float(commander_data['price_usd'])
-                caption_text += f" - ${price:.2f}"
-            except:
-                pass
-        st.image(image_url, caption=caption_text, width=280, use_container_width=False)
-    with col2:
-        pass
-
-def display_recommendation_card(rec, rank, card_data):
+@st.cache_resource
+def get_metrics():
+    return MetricsRegistry()
+
+@st.cache_resource
+def get_card_cache():
+    return CardMetadataCache(CARD_CACHE_PATH)
+
+def iter_card_data(card_names):
+    """(name, card data) pairs: cached cards first, then each Scryfall lookup as it finishes"""
+    return get_card_cache().iter_or_fetch(card_names, get_scryfall_client().iter_cards)
+
+def prewarm_card_prices(system, cache, client):
+    """
+    Look up every catalog card missing from the card cache, then reload the system's prices once
+
+    Runs in a background thread started by load_recommendation_system, so pages render
+    meanwhile; until it finishes, creatures with no cached price count as unpriced and are
+    kept by the Max Price filter. A cache pre-warmed from Scryfall bulk data
+    (python mtg_card_cache.py oracle-cards.json) has nothing missing and sends no requests.
+    """
+    _, _, missing = cache.get_many(system.card_store.names)
+    if missing:
+        cache.get_or_fetch(missing, client.fetch_cards)
+        system.set_card_prices(cache.get_prices())
+
+def display_commander_card(commander_name, commander_info, commander_data):
+    """Commander image and price; rendered into the caller's (left-column) slot"""
+    image_url = (commander_data.get('image_url') if commander_data else None) or "https://via.placeholder.com/400x560/2c3e50/ecf0f1?text=Commander"
+    caption_text = f"🎖️ {commander_name}"
+    if commander_data and commander_data.get('price_usd'):
+        try:
+            price = float(commander_data['price_usd'])
+            caption_text += f" - ${price:.2f}"
+        except:
+            pass
+    st.image(image_url, caption=caption_text, width=280, use_container_width=False)
+
+def display_recommendation_card(rec, rank, card_data, loading=False, price_ceiling=None):
+    """Recommendation card; returns True if its price turned out to be over price_ceiling"""
     card_name = rec['creature_name']
     if len(card_name) > 14:
         card_name = card_name[:11] + "..."
     score_percentage = rec['final_score'] * 100
-    price_display = "N/A"
+    price_display = "…" if loading else "N/A"
+    over_budget = False
     if card_data and card_data.get('price_usd'):
         try:
             price = float(card_data['price_usd'])
             price_display = f"${price:.2f}"
+            over_budget = price_ceiling is not None and price > price_ceiling
+            if over_budget:
+                price_display += " ⚠️"
         except:
             price_display = "N/A"
     st.markdown(f"**#{rank}. {card_name}** | {price_display} | {score_percentage:.1f}%")
@@ -108,17 +103,47 @@ def display_recommendation_card(rec, rank, card_data):
     st.image(image_url, width=200, use_container_width=False)
     if card_data and card_data.get('scryfall_url'):
         st.markdown(f"[🔗 Scryfall]({card_data['scryfall_url']})")
+    return over_budget
+
+def parse_decklist(text):
+    """Card names from a pasted decklist, one per line (leading counts like "1x" are dropped)"""
+    names = (re.sub(r'^\d+x?\s+', '', line.strip()) for line in text.splitlines())
+    return [name for name in names if name]
+
+def deck_recommendations(system, commanders, deck, top_k, max_price, weights):
+    """Deck-aware recommendations; the session's deck state is extended as cards are added"""
+    key = (tuple(commanders), max_price)
+    state = st.session_state.get('deck_state')
+    if state is None or st.session_state.get('deck_key') != key or not set(state['deck']) <= set(deck):
+        state = system.get_deck_state(commanders, deck, max_price=max_price)
+        st.session_state.deck_state = state
+        st.session_state.deck_key = key
+    else:
+        system.add_to_deck(state, deck)
+    return system.recommend_for_deck(state, top_k, weights) if state is not None else []
 
 @st.cache_resource
 def load_recommendation_system():
     try:
-        return create_recommendation_system(    
+        from mtg_recommendation_system import create_recommendation_system
+        system = create_recommendation_system(    
             keyword_boost=0.1,
             type_boost=0.1,
             power_boost=0.05,
             toughness_boost=0.05,
             known_penalty=0.85,
-            short_text_penalty=0.80), None
+            short_text_penalty=0.80,
+            sparse_embeddings=True,
+            snapshot_dir=SNAPSHOT_DIR,
+            metrics=get_metrics())
+        if os.path.exists(PRECOMPUTED_TABLE):
+            system.attach_precomputed_table(PRECOMPUTED_TABLE)
+            # Open the table (importing duckdb and pandas) while loading rather than on the first request
+            system.precomputed.warm()
+        system.attach_price_source(get_card_cache())
+        threading.Thread(target=prewarm_card_prices, args=(system, get_card_cache(), get_scryfall_client()),
+                         name='card-price-prewarm', daemon=True).start()
+        return system, None
     except Exception as e:
         return None, f"❌ Error loading system: {str(e)}"
 
@@ -204,68 +229,114 @@ def main():
         st.session_state.get_recommendations = True
 
     st.sidebar.header("⚙️ Configuration")
-    commanders = sorted(system.features_df['commander'].unique())
+    commanders = system.get_commanders()
     selected_commander = st.sidebar.selectbox("Select a Commander:", commanders)
+    partner = st.sidebar.selectbox("Partner / Background (optional):",
+                                   ["None"] + [name for name in commanders if name != selected_commander])
+    deck = parse_decklist(st.sidebar.text_area("Current decklist (one card per line, optional):", ""))
     num_recommendations = st.sidebar.slider("Recommendations:", 5, 100, 25, 5)
-    max_price = st.sidebar.slider("Max Price ($):", 0.0, 500.0, 100.0, 5.0)
+    max_price = st.sidebar.slider("Max Price ($):", 0.0, MAX_PRICE_LIMIT, 100.0, 5.0,
+                                  help=f"${MAX_PRICE_LIMIT:.0f} means no limit")
+    # No ceiling at the top of the slider, so the precomputed table can serve the request
+    price_ceiling = None if max_price >= MAX_PRICE_LIMIT else max_price
+    show_timings = st.sidebar.checkbox("🛠️ Show timing breakdown", value=False)
+
+    # Re-ranks from cached similarity and boost indicators; no system rebuild needed
+    defaults = system.scoring_params()
+    with st.sidebar.expander("🎚️ Scoring Weights"):
+        weights = {
+            'keyword_boost': st.slider("Keyword boost", 0.0, 0.5, defaults['keyword_boost'], 0.01),
+            'type_boost': st.slider("Type boost", 0.0, 0.5, defaults['type_boost'], 0.01),
+            'power_boost': st.slider("Power boost", 0.0, 0.5, defaults['power_boost'], 0.01),
+            'toughness_boost': st.slider("Toughness boost", 0.0, 0.5, defaults['toughness_boost'], 0.01),
+            'known_penalty': st.slider("Known multiplier", 0.0, 1.0, defaults['known_penalty'], 0.05),
+            'short_text_penalty': st.slider("Short text multiplier", 0.0, 1.0, defaults['short_text_penalty'], 0.05)
+        }
 
     if st.session_state.get('get_recommendations', False):
         commander_info = system.get_commander_info(selected_commander)
+        # Cards are drawn as placeholders in rank order right after scoring; images and
+        # prices fill in as the card data arrives
         with st.container():
-            display_commander_card(selected_commander, commander_info)
+            col1, _ = st.columns([1, 2])
+            commander_slot = col1.empty()
+        with commander_slot.container():
+            display_commander_card(selected_commander, commander_info, None)
 
+        timer = StageTimer(get_metrics())
+        header = st.empty()
+        recommendations = []
+        slots = {}
         with st.spinner(f"Generating recommendations for {selected_commander}..."):
-            recommendations = system.get_recommendations(
-                selected_commander, 
-                top_k=num_recommendations,
-                include_known=True
-            )
-
-            if not recommendations:
-                st.warning("No recommendations found. Try adjusting your filters.")
-                return
-
-            card_names = [rec['creature_name'] for rec in recommendations[:num_recommendations]]
-            all_card_data = get_batch_card_data(card_names)
-
-            if max_price < 100:
-                filtered_recs = []
-                for rec in recommendations:
-                    if len(filtered_recs) >= num_recommendations:
-                        break
-                    card_data = all_card_data.get(rec['creature_name'])
-                    if card_data and card_data.get('price_usd'):
-                        try:
-                            if float(card_data['price_usd']) <= max_price:
-                                filtered_recs.append(rec)
-                        except (ValueError, TypeError):
-                            filtered_recs.append(rec)
-                    else:
-                        filtered_recs.append(rec)
-                recommendations = filtered_recs
-
-            st.markdown(f"### 🎯 Top {len(recommendations)} Recommendations")
-            for i in range(0, len(recommendations), 3):
-                cols = st.columns(3, gap="large")
-                for j in range(3):
-                    if i + j < len(recommendations):
-                        rec = recommendations[i + j]
-                        card_data = all_card_data.get(rec['creature_name'])
-                        rank = i + j + 1
-                        with cols[j]:
-                            with st.container():
-                                display_recommendation_card(rec, rank, card_data)
-
-            if st.button("📅 Export as CSV"):
-                # df = pd.DataFrame(recommendations)
-                df = pd.DataFrame([rec['creature_name'] for rec in recommendations], columns=['Creature Name'])
-                csv = df.to_csv(index=False)
-                st.download_button(
-                    "Download CSV",
-                    csv,
-                    f"{selected_commander.replace(' ', '_')}_recommendations.csv",
-                    "text/csv"
+            if partner != "None" or deck:
+                # Partner pairs and partial decklists blend several targets and skip chosen cards
+                commander_names = [selected_commander] + ([partner] if partner != "None" else [])
+                with timer.stage('deck'):
+                    stream = deck_recommendations(system, commander_names, deck, num_recommendations,
+                                                  price_ceiling, None if weights == defaults else weights)
+            else:
+                stream = system.iter_recommendations(
+                    selected_commander,
+                    top_k=num_recommendations,
+                    include_known=True,
+                    max_price=price_ceiling,
+                    weights=None if weights == defaults else weights,
+                    timer=timer
                 )
+            for rank, rec in enumerate(stream, start=1):
+                if rank % 3 == 1:
+                    cols = st.columns(3, gap="large")
+                with cols[(rank - 1) % 3]:
+                    slot = st.empty()
+                with slot.container():
+                    display_recommendation_card(rec, rank, None, loading=True)
+                slots.setdefault(rec['creature_name'], []).append((slot, rec, rank))
+                recommendations.append(rec)
+
+        if not recommendations:
+            st.warning("No recommendations found. Try adjusting your filters.")
+            return
+        header.markdown(f"### 🎯 Top {len(recommendations)} Recommendations")
+
+        # Cards render as their data streams in. Only cards scored before their price was known
+        # (while prewarm_card_prices is still running) can come back over the ceiling; they are
+        # flagged rather than re-ranked, and later requests filter them out
+        over_budget = set()
+        with timer.stage('card_fetch'):
+            for name, card_data in iter_card_data([selected_commander] + list(slots)):
+                if name == selected_commander:
+                    with commander_slot.container():
+                        display_commander_card(selected_commander, commander_info, card_data)
+                for slot, rec, rank in slots.get(name, ()):
+                    with slot.container():
+                        if display_recommendation_card(rec, rank, card_data, price_ceiling=price_ceiling):
+                            over_budget.add(name)
+        timings = timer.profile()
+
+        if over_budget:
+            st.caption(f"⚠️ {len(over_budget)} cards were priced over ${price_ceiling:.0f} only after ranking, "
+                       f"while card prices are still loading; they are left out of later results")
+
+        if show_timings:
+            import pandas as pd
+            with st.expander("🛠️ Timing breakdown", expanded=True):
+                st.dataframe(pd.DataFrame({'Stage': list(timings),
+                                           'Time (ms)': [seconds * 1e3 for seconds in timings.values()]}),
+                             hide_index=True)
+                st.caption("Cumulative metrics since the app started (Prometheus text format)")
+                st.code(get_metrics().to_prometheus(), language='text')
+
+        if st.button("📅 Export as CSV"):
+            import pandas as pd
+            # df = pd.DataFrame(recommendations)
+            df = pd.DataFrame([rec['creature_name'] for rec in recommendations], columns=['Creature Name'])
+            csv = df.to_csv(index=False)
+            st.download_button(
+                "Download CSV",
+                csv,
+                f"{selected_commander.replace(' ', '_')}_recommendations.csv",
+                "text/csv"
+            )
 
     st.markdown("---")
     st.markdown("""
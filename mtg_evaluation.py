@@ -0,0 +1,293 @@
+# mtg_evaluation.py
+# Offline hold-out evaluation and scoring-parameter sweeps for the MTG Commander Recommendation System
+#
+# Usage: python mtg_evaluation.py [--grid | --random N] [--top-k 100] [--workers N] [--output sweep.json]
+#
+# Part of each commander's training rows is masked; the system is scored on how well it
+# recovers the masked creatures. Sweep workers load the embedding snapshot memory-mapped,
+# so the matrix is shared through the page cache instead of being pickled to every process.
+
+import argparse
+import itertools
+import json
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from mtg_card_store import parse_keywords, parse_secondary_types
+from mtg_precomputed import SERVING_PARAMS
+from mtg_recommendation_system import DATA_DIR
+from mtg_snapshot import DEFAULT_SNAPSHOT_DIR, source_hash, snapshot_path, load_snapshot, build_snapshot
+
+# Default sweep space around the library and app settings
+GRID_SPACE = {
+    'keyword_boost': [0.0, 0.05, 0.1, 0.2],
+    'type_boost': [0.0, 0.05, 0.1, 0.2],
+    'power_boost': [0.0, 0.05, 0.1],
+    'toughness_boost': [0.0, 0.05, 0.1],
+    'known_penalty': [0.85],
+    'short_text_penalty': [0.8, 0.9, 1.0]
+}
+RANDOM_SPACE = {
+    'keyword_boost': (0.0, 0.3),
+    'type_boost': (0.0, 0.3),
+    'power_boost': (0.0, 0.15),
+    'toughness_boost': (0.0, 0.15),
+    'known_penalty': (0.85, 0.85),
+    'short_text_penalty': (0.7, 1.0)
+}
+
+
+def holdout_split(features_df, holdout_fraction=0.2, min_rows=2, seed=0):
+    """
+    Mask part of each commander's training rows
+
+    Commanders with fewer than min_rows rows keep all of them. Every other commander has
+    round(holdout_fraction * rows) of them held out (at least one, never all).
+
+    Returns:
+        Tuple of (training DataFrame with a fresh index, {commander: set of held-out creature names})
+    """
+    rng = np.random.default_rng(seed)
+    held_out_rows = []
+    heldout = {}
+    for commander_name, rows in features_df.groupby('commander', sort=False).indices.items():
+        if len(rows) < min_rows:
+            continue
+        n_held_out = min(len(rows) - 1, max(1, int(round(holdout_fraction * len(rows)))))
+        chosen = rng.choice(rows, n_held_out, replace=False)
+        held_out_rows.append(chosen)
+        heldout[commander_name] = set(features_df['recommended_creature'].to_numpy()[chosen])
+
+    mask = np.ones(len(features_df), dtype=bool)
+    if held_out_rows:
+        mask[np.concatenate(held_out_rows)] = False
+    train_df = features_df[mask].reset_index(drop=True)
+
+    # Creatures also recommended by a kept row are still known, so they cannot be "recovered"
+    kept = train_df.groupby('commander', sort=False)['recommended_creature'].agg(set).to_dict()
+    heldout = {name: names - kept.get(name, set()) for name, names in heldout.items()}
+    return train_df, {name: names for name, names in heldout.items() if names}
+
+
+def holdout_patterns(commander_patterns, creatures_df, train_df, heldout, consensus_fraction=0.8):
+    """
+    Commander patterns re-mined from the kept training rows
+
+    The stored patterns were mined from every training row, so they would leak the held-out
+    creatures (e.g. into the keyword/type boosts). Commanders in heldout get the keys their
+    stored entry already has recomputed from their kept rows with the rules that mined them:
+    row count, mean synergy, top-10 keywords and secondary types, and consensus keywords/types
+    shared by at least the entry's consensus_fraction (default consensus_fraction) of the rows.
+    Keys are never added, so the sweep scores the boosts the served model has. Keys that cannot
+    be derived from the training rows (e.g. price statistics) and other commanders are kept.
+
+    Returns:
+        New {commander: patterns} dictionary
+    """
+    cards = creatures_df.drop_duplicates('name').set_index('name')[['keywords_parsed', 'secondary_type']]
+    kept = train_df[train_df['commander'].isin(heldout)]
+    patterns = dict(commander_patterns)
+    for commander_name, rows in kept.groupby('commander', sort=False):
+        stored = commander_patterns.get(commander_name, {})
+        names = rows['recommended_creature']
+        found = cards.reindex(names)
+        keyword_counts = Counter(k for value in found['keywords_parsed'].dropna() for k in parse_keywords(value))
+        type_counts = Counter(t for value in found['secondary_type'].dropna() for t in parse_secondary_types(value))
+        threshold = stored.get('consensus_fraction', consensus_fraction) * len(names)
+        mined = {
+            'total_recommendations': len(names),
+            'keywords': keyword_counts.most_common(10),
+            'secondary_types': type_counts.most_common(10),
+            'consensus_keywords': [(k, n) for k, n in keyword_counts.most_common() if n >= threshold],
+            'consensus_types': [(t, n) for t, n in type_counts.most_common() if n >= threshold]
+        }
+        if 'synergy' in rows:
+            mined['avg_synergy'] = float(rows['synergy'].mean())
+        patterns[commander_name] = dict(stored, **{key: value for key, value in mined.items() if key in stored})
+    return patterns
+
+
+def ranking_metrics(ranked_names, relevant, k):
+    """recall@k, NDCG@k and reciprocal rank (within k) of one ranked list with binary relevance"""
+    hits = [name in relevant for name in ranked_names[:k]]
+    dcg = sum(1 / np.log2(rank + 2) for rank, hit in enumerate(hits) if hit)
+    ideal = sum(1 / np.log2(rank + 2) for rank in range(min(len(relevant), k)))
+    first_hit = hits.index(True) if True in hits else None
+    return {
+        'recall': sum(hits) / len(relevant),
+        'ndcg': float(dcg / ideal) if ideal else 0.0,
+        'mrr': 1 / (first_hit + 1) if first_hit is not None else 0.0
+    }
+
+
+def _summarise(totals, count, top_k):
+    return {
+        f'recall@{top_k}': totals['recall'] / count if count else 0.0,
+        f'ndcg@{top_k}': totals['ndcg'] / count if count else 0.0,
+        'mrr': totals['mrr'] / count if count else 0.0,
+        'n_commanders': count
+    }
+
+
+def evaluate(system, heldout, top_k=100, include_known=False, chunk_size=16):
+    """
+    Hold-out metrics of get_recommendations for a system trained on the masked rows
+
+    Args:
+        system: Recommendation system whose training data and patterns exclude the held-out rows
+            (set_training_data with holdout_split and holdout_patterns)
+        heldout: {commander: set of held-out creature names} from holdout_split
+        top_k: Cutoff k for recall@k and NDCG@k
+        include_known: Whether kept training rows may be recommended (default: excluded)
+        chunk_size: Commanders per scoring block
+
+    Returns:
+        Dictionary with mean recall@k, NDCG@k, MRR and the number of commanders scored
+    """
+    results = system.get_recommendations_batch(list(heldout), top_k=top_k, include_known=include_known,
+                                               chunk_size=chunk_size)
+    totals, count = {'recall': 0.0, 'ndcg': 0.0, 'mrr': 0.0}, 0
+    for commander_name, recommendations in results.items():
+        if not recommendations:
+            continue
+        metrics = ranking_metrics([rec['creature_name'] for rec in recommendations], heldout[commander_name], top_k)
+        for name, value in metrics.items():
+            totals[name] += value
+        count += 1
+    return _summarise(totals, count, top_k)
+
+
+def grid_space(space=None):
+    """Every combination of a {parameter: [values]} grid"""
+    space = space or GRID_SPACE
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_space(n_samples, space=None, seed=0):
+    """n_samples parameter sets drawn uniformly from {parameter: (low, high)}"""
+    space = space or RANDOM_SPACE
+    rng = np.random.default_rng(seed)
+    return [{name: round(float(rng.uniform(low, high)), 4) for name, (low, high) in space.items()}
+            for _ in range(n_samples)]
+
+
+# Per-process state for sweep workers, set by _init_worker
+_worker = {}
+
+
+def _init_worker(path, train_df, train_patterns, heldout, top_k, include_known):
+    # Commanders are visited once each, so one cached scoring state is enough
+    system = load_snapshot(path, max_scoring_states=1)
+    system.set_training_data(train_df, train_patterns)
+    _worker.update(system=system, heldout=heldout, top_k=top_k, include_known=include_known)
+
+
+def _sweep_chunk(commander_names, param_sets):
+    """Metric sums of every parameter set over a chunk of commanders (run in a worker)"""
+    system, heldout = _worker['system'], _worker['heldout']
+    top_k, include_known = _worker['top_k'], _worker['include_known']
+    totals = [{'recall': 0.0, 'ndcg': 0.0, 'mrr': 0.0} for _ in param_sets]
+    count = 0
+    for commander_name in commander_names:
+        # Similarity and indicators are computed once per commander, then re-weighted per parameter set
+        if system.get_scoring_state(commander_name, include_known) is None:
+            continue
+        count += 1
+        for params, total in zip(param_sets, totals):
+            recommendations = system.rescore(commander_name, params, top_k=top_k, include_known=include_known)
+            metrics = ranking_metrics([rec['creature_name'] for rec in recommendations],
+                                      heldout[commander_name], top_k)
+            for name, value in metrics.items():
+                total[name] += value
+    return totals, count
+
+
+def run_sweep(param_sets, data_dir=DATA_DIR, snapshot_dir=DEFAULT_SNAPSHOT_DIR, holdout_fraction=0.2,
+              top_k=100, include_known=False, max_workers=None, chunk_size=32, seed=0):
+    """
+    Evaluate many scoring-parameter sets on one hold-out split in parallel
+
+    The full-data snapshot is loaded memory-mapped by every worker; each worker takes a
+    chunk of commanders and scores it under every parameter set with rescore(), so the
+    similarity pass runs once per commander regardless of the sweep size.
+
+    Args:
+        param_sets: List of scoring-parameter dictionaries (see grid_space / random_space)
+        data_dir: Source data directory
+        snapshot_dir: Snapshot parent directory (a snapshot is built if missing)
+        holdout_fraction: Fraction of each commander's rows to mask
+        top_k: Cutoff k for recall@k and NDCG@k
+        include_known: Whether kept training rows may be recommended
+        max_workers: Worker processes (default: CPU count)
+        chunk_size: Commanders per task
+        seed: Seed for the hold-out split
+
+    Returns:
+        List of {'params', metrics...} dictionaries sorted by NDCG@k, best first
+    """
+    path = snapshot_path(snapshot_dir, source_hash(data_dir))
+    system = load_snapshot(path)
+    if system is None:
+        path = build_snapshot(data_dir, snapshot_dir)
+        system = load_snapshot(path)
+
+    train_df, heldout = holdout_split(system.features_df, holdout_fraction, seed=seed)
+    train_patterns = holdout_patterns(system.commander_patterns, system.creatures_df, train_df, heldout)
+    commanders = list(heldout)
+    chunks = [commanders[start:start + chunk_size] for start in range(0, len(commanders), chunk_size)]
+    print(f"🧪 Sweeping {len(param_sets):,} parameter sets over {len(commanders):,} commanders "
+          f"({len(chunks)} tasks, {len(train_df):,} training rows kept)")
+
+    start = time.perf_counter()
+    totals = [{'recall': 0.0, 'ndcg': 0.0, 'mrr': 0.0} for _ in param_sets]
+    count = 0
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(path, train_df, train_patterns, heldout, top_k, include_known)) as executor:
+        for chunk_totals, chunk_count in executor.map(_sweep_chunk, chunks, itertools.repeat(param_sets)):
+            count += chunk_count
+            for total, chunk_total in zip(totals, chunk_totals):
+                for name, value in chunk_total.items():
+                    total[name] += value
+
+    results = [dict(params=params, **_summarise(total, count, top_k)) for params, total in zip(param_sets, totals)]
+    results.sort(key=lambda result: result[f'ndcg@{top_k}'], reverse=True)
+    print(f"✅ Sweep finished in {time.perf_counter() - start:.1f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hold-out evaluation and scoring-parameter sweeps')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--snapshot-dir', default=DEFAULT_SNAPSHOT_DIR)
+    parser.add_argument('--grid', action='store_true', help='Sweep the default grid')
+    parser.add_argument('--random', type=int, default=0, help='Sweep N random parameter sets')
+    parser.add_argument('--holdout', type=float, default=0.2, help='Fraction of rows masked per commander')
+    parser.add_argument('--top-k', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Write results as JSON')
+    args = parser.parse_args()
+
+    # Always compare the library defaults with the parameters the app serves
+    library_defaults = dict(SERVING_PARAMS, short_text_penalty=0.90)
+    param_sets = [library_defaults, dict(SERVING_PARAMS)]
+    if args.grid:
+        param_sets += grid_space()
+    if args.random:
+        param_sets += random_space(args.random, seed=args.seed)
+
+    results = run_sweep(param_sets, data_dir=args.data_dir, snapshot_dir=args.snapshot_dir,
+                        holdout_fraction=args.holdout, top_k=args.top_k, max_workers=args.workers, seed=args.seed)
+    for result in results[:10]:
+        print(f"📈 ndcg@{args.top_k}={result[f'ndcg@{args.top_k}']:.4f} "
+              f"recall@{args.top_k}={result[f'recall@{args.top_k}']:.4f} mrr={result['mrr']:.4f} {result['params']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Sweep results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
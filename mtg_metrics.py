@@ -0,0 +1,170 @@
+# mtg_metrics.py
+# Stage-level timing instrumentation for the MTG Commander Recommendation System
+#
+# Stages: load, embed, result_cache, target, similarity, filter_boost, topk, card_fetch
+# (plus precomputed for answers served from the precomputed table)
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+STAGES = ('load', 'embed', 'result_cache', 'target', 'similarity', 'filter_boost', 'topk', 'card_fetch')
+STAGE_METRIC = 'mtg_stage_seconds'
+REQUEST_METRIC = 'mtg_requests_total'
+COMMANDER_METRIC = 'mtg_commanders_scored_total'
+RESULT_CACHE_METRIC = 'mtg_result_cache_lookups_total'
+
+# Histogram bucket upper bounds in seconds (Prometheus default buckets plus sub-millisecond ones)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    STAGE_METRIC: 'Time spent per recommendation pipeline stage',
+    REQUEST_METRIC: 'Recommendation requests served',
+    COMMANDER_METRIC: 'Commanders scored by the vectorized engine',
+    RESULT_CACHE_METRIC: 'Query result cache lookups by result (hit or miss)'
+}
+
+
+class NullSink:
+    """Default sink: drops every measurement"""
+
+    def increment(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+
+NULL_SINK = NullSink()
+
+
+class MetricsRegistry:
+    """
+    In-process sink keeping counters and histograms
+
+    Thread-safe. Export with to_prometheus() (text exposition format) or to_json().
+    Any object with the same increment/observe methods can be used as a sink instead
+    (e.g. an adapter for statsd or prometheus_client).
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_json(self):
+        """Counters and histograms as a JSON-serialisable dictionary"""
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = []
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                cumulative, running = {}, 0
+                for bound, count in zip(self.buckets, histogram['counts']):
+                    running += count
+                    cumulative[str(bound)] = running
+                cumulative['+Inf'] = histogram['count']
+                histograms.append({'name': name, 'labels': dict(labels), 'count': histogram['count'],
+                                   'sum': histogram['sum'], 'buckets': cumulative})
+        return {'counters': counters, 'histograms': histograms}
+
+    def to_json_text(self):
+        return json.dumps(self.to_json(), indent=2)
+
+    def to_prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        def label_text(labels, extra=None):
+            items = list(labels.items()) + ([extra] if extra else [])
+            if not items:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+        data = self.to_json()
+        lines = []
+        for kind, entries in (('counter', data['counters']), ('histogram', data['histograms'])):
+            seen = set()
+            for entry in entries:
+                name, labels = entry['name'], entry['labels']
+                if name not in seen:
+                    seen.add(name)
+                    if name in METRIC_HELP:
+                        lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                if kind == 'counter':
+                    lines.append(f"{name}{label_text(labels)} {entry['value']}")
+                    continue
+                for bound, count in entry['buckets'].items():
+                    lines.append(f"{name}_bucket{label_text(labels, ('le', bound))} {count}")
+                lines.append(f"{name}_sum{label_text(labels)} {entry['sum']}")
+                lines.append(f"{name}_count{label_text(labels)} {entry['count']}")
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """
+    Per-request stage timer
+
+    Each stage() block adds its wall time to the breakdown (seconds per stage) and
+    reports it to the sink as an observation of mtg_stage_seconds{stage=...}.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink or NULL_SINK
+        self.breakdown = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """Record time spent in a stage measured elsewhere"""
+        self.breakdown[name] = self.breakdown.get(name, 0.0) + seconds
+        self.sink.observe(STAGE_METRIC, seconds, stage=name)
+
+    def merge(self, breakdown):
+        """Add a breakdown already reported to the sink (e.g. from profile=True) without re-reporting it"""
+        for name, seconds in breakdown.items():
+            if name != 'total':
+                self.breakdown[name] = self.breakdown.get(name, 0.0) + seconds
+
+    def profile(self):
+        """Breakdown in seconds per stage (pipeline order) plus the total since the timer started"""
+        ordered = {name: self.breakdown[name] for name in STAGES if name in self.breakdown}
+        ordered.update({name: seconds for name, seconds in self.breakdown.items() if name not in ordered})
+        ordered['total'] = time.perf_counter() - self._start
+        return ordered
@@ -0,0 +1,307 @@
+# mtg_precomputed.py
+# Precomputed all-commanders recommendation table (DuckDB) with incremental refresh
+#
+# Usage: python mtg_precomputed.py [table_path] [snapshot_dir] [top_n]
+# table_path defaults to $MTG_PRECOMPUTED_TABLE or data/precomputed.duckdb next to this module,
+# where the app looks for it regardless of the working directory.
+# Scoring parameters must match the ones the app serves with (see SERVING_PARAMS).
+
+# duckdb and pandas are imported on first use, so attaching a table (or importing
+# SERVING_PARAMS) does not slow down app startup
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import scipy.sparse as sp
+
+TABLE_VERSION = 1
+DEFAULT_TABLE_PATH = os.environ.get('MTG_PRECOMPUTED_TABLE',
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'precomputed.duckdb'))
+
+# Scoring parameters used by mtg_commander_app.load_recommendation_system
+SERVING_PARAMS = dict(keyword_boost=0.1, type_boost=0.1, power_boost=0.05,
+                      toughness_boost=0.05, known_penalty=0.85, short_text_penalty=0.80)
+
+RECOMMENDATION_COLUMNS = ('creature_name', 'base_similarity', 'final_score', 'boosts', 'penalties',
+                          'is_known', 'power_toughness', 'oracle_length')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key VARCHAR PRIMARY KEY, value VARCHAR);
+CREATE TABLE IF NOT EXISTS commanders (commander VARCHAR PRIMARY KEY, fingerprint VARCHAR);
+CREATE TABLE IF NOT EXISTS recommendations (
+    commander VARCHAR,
+    rank INTEGER,
+    creature_name VARCHAR,
+    base_similarity DOUBLE,
+    final_score DOUBLE,
+    boosts VARCHAR[],
+    penalties VARCHAR[],
+    is_known BOOLEAN,
+    power_toughness VARCHAR,
+    oracle_length INTEGER
+);
+"""
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+    return digest.hexdigest()
+
+
+def scoring_key(scoring_params, top_n):
+    """Key identifying the scoring parameters and depth a table was built with"""
+    return _digest(TABLE_VERSION, json.dumps(scoring_params, sort_keys=True), top_n)
+
+
+def catalog_fingerprint(system):
+    """Fingerprint of the creature table and embeddings; a change invalidates every commander"""
+    import pandas as pd
+    embeddings = system.creature_embeddings
+    if sp.issparse(embeddings):
+        arrays = (embeddings.data, embeddings.indices, embeddings.indptr)
+    else:
+        arrays = (embeddings,)
+    creature_hash = pd.util.hash_pandas_object(system.creatures_df, index=False).to_numpy()
+    return _digest(creature_hash.tobytes(), *(np.ascontiguousarray(a).tobytes() for a in arrays))
+
+
+def commander_fingerprints(features_df, commander_patterns):
+    """Per-commander fingerprint of its training rows and its commander_patterns entry"""
+    import pandas as pd
+    fingerprints = {}
+    for commander_name, rows in features_df.groupby('commander', sort=False):
+        row_hash = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+        patterns = json.dumps(commander_patterns.get(commander_name, {}), sort_keys=True, default=str)
+        fingerprints[commander_name] = _digest(row_hash.tobytes(), patterns)
+    return fingerprints
+
+
+def data_key(system):
+    """
+    Key identifying the data a system serves
+
+    A system loaded from source files or a snapshot is identified by the source hash plus the
+    snapshot deltas applied on top. Systems changed in other ways (or built without a known
+    source hash) fall back to fingerprints of the creature catalog and training rows.
+    """
+    if system.source_hash is not None and system.data_version == len(system.applied_deltas):
+        return _digest('source', system.source_hash, *sorted(system.applied_deltas))
+    fingerprints = commander_fingerprints(system.features_df, system.commander_patterns)
+    return _digest('content', catalog_fingerprint(system), json.dumps(fingerprints, sort_keys=True))
+
+
+def refresh_precomputed_table(system, path, top_n=100, chunk_size=16):
+    """
+    Materialise the top-N recommendations of every commander into a DuckDB table
+
+    Only commanders whose training rows or patterns changed since the last run are
+    recomputed; a change in scoring parameters, top_n or the creature catalog forces a
+    full rebuild. The table is updated in a copy that atomically replaces the original,
+    so readers keep a consistent view.
+
+    Args:
+        system: MTGCommanderRecommendationSystem configured with the serving parameters
+        path: DuckDB file to create or update
+        top_n: Recommendations stored per commander (include_known=True)
+        chunk_size: Commanders per scoring block
+
+    Returns:
+        Dictionary with counts of recomputed, removed and unchanged commanders
+    """
+    import duckdb
+    import pandas as pd
+
+    key = scoring_key(system.scoring_params(), top_n)
+    catalog = catalog_fingerprint(system)
+    fingerprints = commander_fingerprints(system.features_df, system.commander_patterns)
+    table_data_key = data_key(system)
+
+    staging = f"{path}.staging"
+    if os.path.exists(staging):
+        os.remove(staging)
+    if os.path.exists(path):
+        shutil.copyfile(path, staging)
+
+    con = duckdb.connect(staging)
+    try:
+        con.execute(SCHEMA)
+        meta = dict(con.execute("SELECT key, value FROM meta").fetchall())
+        if meta.get('scoring_key') != key or meta.get('catalog') != catalog:
+            con.execute("DELETE FROM recommendations")
+            con.execute("DELETE FROM commanders")
+            stored = {}
+        else:
+            stored = dict(con.execute("SELECT commander, fingerprint FROM commanders").fetchall())
+
+        changed = [name for name, fingerprint in fingerprints.items() if stored.get(name) != fingerprint]
+        removed = [name for name in stored if name not in fingerprints]
+        print(f"🔄 Precomputing {len(changed):,} commanders "
+              f"({len(fingerprints) - len(changed):,} unchanged, {len(removed):,} removed)")
+
+        results = system.get_recommendations_batch(changed, top_k=top_n, include_known=True,
+                                                   chunk_size=chunk_size)
+        rows = [
+            {'commander': commander_name, 'rank': rank,
+             **{column: rec[column] for column in RECOMMENDATION_COLUMNS}}
+            for commander_name, recommendations in results.items()
+            for rank, rec in enumerate(recommendations, start=1)
+        ]
+        new_rows = pd.DataFrame(rows, columns=['commander', 'rank', *RECOMMENDATION_COLUMNS])
+        new_commanders = pd.DataFrame({'commander': changed,
+                                       'fingerprint': [fingerprints[name] for name in changed]})
+        stale = pd.DataFrame({'commander': changed + removed})
+
+        con.execute("BEGIN TRANSACTION")
+        if len(stale):
+            con.execute("DELETE FROM recommendations WHERE commander IN (SELECT commander FROM stale)")
+            con.execute("DELETE FROM commanders WHERE commander IN (SELECT commander FROM stale)")
+        if len(new_rows):
+            con.execute("INSERT INTO recommendations SELECT * FROM new_rows")
+        if len(new_commanders):
+            con.execute("INSERT INTO commanders SELECT * FROM new_commanders")
+        con.execute("DELETE FROM meta")
+        con.executemany("INSERT INTO meta VALUES (?, ?)",
+                        [('scoring_key', key), ('catalog', catalog), ('data_key', table_data_key),
+                         ('top_n', str(top_n))])
+        con.execute("COMMIT")
+        con.execute("CHECKPOINT")
+    finally:
+        con.close()
+
+    os.replace(staging, path)
+    print(f"💾 Precomputed table written to {path}")
+    return {'recomputed': len(changed), 'removed': len(removed), 'unchanged': len(fingerprints) - len(changed)}
+
+
+class PrecomputedRecommendations:
+    """
+    Read-only view of a precomputed recommendation table
+
+    The file is opened on first use and reopened when it is replaced by a refresh. DuckDB
+    point queries cost milliseconds, so each commander's full top-N list is fetched once and
+    kept in a small LRU (max_cached commanders). If expected_data_key is given, a table
+    built from other data (see data_key) never serves a lookup.
+    """
+
+    def __init__(self, path, max_cached=512, expected_data_key=None):
+        self.path = path
+        self.expected_data_key = expected_data_key
+        # Shared by Streamlit session threads: guards the connection and the LRU
+        self._lock = threading.RLock()
+        self.max_cached = max_cached
+        self._cached = OrderedDict()
+        self._validated_params = None
+        self._con = None
+        self._file_id = None
+        self.scoring_key = None
+        self.data_key = None
+        self.top_n = 0
+        self.commanders = frozenset()
+
+    def _connect(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        file_id = (stat.st_ino, stat.st_mtime_ns)
+        if self._con is None or file_id != self._file_id:
+            import duckdb
+            if self._con is not None:
+                self._con.close()
+            self._con = duckdb.connect(self.path, read_only=True)
+            self._file_id = file_id
+            self._cached.clear()
+            self._validated_params = None
+            meta = dict(self._con.execute("SELECT key, value FROM meta").fetchall())
+            self.scoring_key = meta.get('scoring_key')
+            self.data_key = meta.get('data_key')
+            self.top_n = int(meta.get('top_n', 0))
+            self.commanders = frozenset(row[0] for row in self._con.execute("SELECT commander FROM commanders").fetchall())
+            if self.expected_data_key is not None and self.data_key != self.expected_data_key:
+                print(f"⚠️ Precomputed table {self.path} was built from other data; scoring live")
+        return self._con
+
+    def warm(self):
+        """
+        Open the table and run one point query now rather than on the first lookup
+
+        duckdb imports pandas the first time a query binds parameters, so both imports
+        (about 0.4 s) happen here instead of inside a request.
+        """
+        with self._lock:
+            con = self._connect()
+            if con is not None:
+                con.execute("SELECT rank FROM recommendations WHERE commander = ? LIMIT 1", ['']).fetchall()
+
+    def matches_data(self):
+        """Whether the table exists and was built from the expected data"""
+        with self._lock:
+            return self._connect() is not None and (self.expected_data_key is None
+                                                    or self.data_key == self.expected_data_key)
+
+    def lookup(self, commander_name, top_k, scoring_params):
+        """
+        Stored recommendations for a commander (include_known=True)
+
+        Returns:
+            List of recommendation dictionaries, or None if the table cannot serve this request
+        """
+        with self._lock:
+            rows = self._stored_rows(commander_name, scoring_params)
+            if rows is None or top_k > self.top_n:
+                return None
+            return [dict(zip(RECOMMENDATION_COLUMNS, row)) for row in rows[:top_k]]
+
+    def lookup_all(self, commander_name, scoring_params):
+        """
+        Every stored recommendation for a commander, down to the table's depth (top_n)
+
+        Returns:
+            List of recommendation dictionaries, or None if the table cannot serve this commander
+        """
+        with self._lock:
+            rows = self._stored_rows(commander_name, scoring_params)
+            if rows is None:
+                return None
+            return [dict(zip(RECOMMENDATION_COLUMNS, row)) for row in rows]
+
+    def _stored_rows(self, commander_name, scoring_params):
+        # Connects first, so top_n and commanders describe the current file; caller holds the lock
+        con = self._connect()
+        if con is None or not self.matches_data():
+            return None
+        if scoring_params != self._validated_params:
+            if self.scoring_key != scoring_key(scoring_params, self.top_n):
+                return None
+            self._validated_params = dict(scoring_params)
+        if commander_name not in self.commanders:
+            return None
+
+        rows = self._cached.get(commander_name)
+        if rows is None:
+            rows = con.execute(
+                f"SELECT {', '.join(RECOMMENDATION_COLUMNS)} FROM recommendations "
+                "WHERE commander = ? ORDER BY rank", [commander_name]
+            ).fetchall()
+            self._cached[commander_name] = rows
+            if len(self._cached) > self.max_cached:
+                self._cached.popitem(last=False)
+        else:
+            self._cached.move_to_end(commander_name)
+        return rows
+
+if __name__ == "__main__":
+    from mtg_recommendation_system import create_recommendation_system
+
+    table_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TABLE_PATH
+    snapshot_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    top_n = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    system = create_recommendation_system(sparse_embeddings=True, snapshot_dir=snapshot_dir, **SERVING_PARAMS)
+    refresh_precomputed_table(system, table_path, top_n=top_n)
@@ -1,14 +1,36 @@
 # mtg_recommendation_system.py
 # Standalone module for the MTG Commander Recommendation System
 
-import pandas as pd
+# pandas, scikit-learn (through the pickled vectorizer) and the ANN index are imported
+# only when needed: scoring a loaded snapshot uses numpy and scipy.sparse alone
 import numpy as np
+import scipy.sparse as sp
+import os
 import pickle
-import ast
-from sklearn.metrics.pairwise import cosine_similarity
+import threading
+import time
+from collections import OrderedDict
+from mtg_card_store import CardStore
+from mtg_metrics import NULL_SINK, REQUEST_METRIC, COMMANDER_METRIC, RESULT_CACHE_METRIC, StageTimer
+from mtg_snapshot import source_hash, snapshot_path, load_snapshot, write_snapshot, append_delta, apply_deltas
 import warnings
 warnings.filterwarnings('ignore')
 
+
+def normalize_rows(matrix):
+    """L2-normalise the rows of a CSR matrix in place (empty rows stay empty)"""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    matrix.data /= np.repeat(norms, np.diff(matrix.indptr))
+    return matrix
+
+
+# Source data directory: $MTG_DATA_DIR, else data/processed next to this module
+DATA_DIR = os.environ.get('MTG_DATA_DIR',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'processed'))
+# Weight of a deck's mean embedding in a deck target, relative to all its commanders together
+DECK_WEIGHT = 0.5
+
 class MTGCommanderRecommendationSystem:
     """
     MTG Commander recommendation system using oracle text similarity + pattern boosting
@@ -21,17 +43,38 @@ class MTGCommanderRecommendationSystem:
     - Known recommendation penalty (configurable, default -15%)
     - Short oracle text penalty (configurable, default -10% for <40 characters)
     - Color identity validation
+    - Vectorized NumPy scoring with argpartition top-K selection
+    - Batch scoring of many commanders with one sparse matrix product per chunk
+    - Optional precomputed recommendation table (DuckDB) for the common request
+    - Price-aware retrieval: max_price filtering before top-K selection
+    - Columnar card store: WUBRG color bitmasks, keyword/type bitsets (parsed once)
+    - Optional sparse (CSR) embeddings scored with a single sparse mat-vec
+    - Optional approximate candidate generation (TruncatedSVD + IVF index) for large card pools
+    - Optional stage timing through a pluggable metrics sink (profile=True returns a breakdown)
+    - Live re-weighting: cached per-commander similarity and boost indicators, rescored with one dot product
+    - Incremental ingestion of new cards and training examples (persisted as snapshot deltas)
+    - LRU cache of query results; a cached top-K also answers smaller top_k requests
+    - Generator API (iter_recommendations) for progressive rendering in rank order
+    - Compact runtime state: string tables, small-int P/T and bitmasks; no pandas on the query path
+    - Deck-aware scoring for partner/background pairs and partial decklists, updated incrementally
     
     All scoring parameters are configurable via initialization parameters.
     """
     
     def __init__(self, tfidf, commander_patterns, creatures_df, features_df,
                  keyword_boost=0.1, type_boost=0.1, power_boost=0.05, 
-                 toughness_boost=0.05, known_penalty=0.85, short_text_penalty=0.90):
-        self.tfidf = tfidf
+                 toughness_boost=0.05, known_penalty=0.85, short_text_penalty=0.90,
+                 sparse_embeddings=False, creature_embeddings=None, card_store=None, indexes=None,
+                 approximate=False, ann_candidates=2000, metrics=None, max_scoring_states=64,
+                 max_cached_results=256, frame_loader=None):
+        self._tfidf = tfidf
         self.commander_patterns = commander_patterns
-        self.creatures_df = creatures_df
-        self.features_df = features_df
+        # DataFrames (and the vectorizer) are only needed to build the system and to ingest
+        # new data; snapshot-backed systems load them on first access through frame_loader
+        self.frame_loader = frame_loader
+        self._frames = {kind: frame for kind, frame in (('creatures', creatures_df), ('features', features_df))
+                        if frame is not None}
+        self._pending_rows = {}
         
         # Store configurable scoring parameters
         self.keyword_boost = keyword_boost
@@ -40,57 +83,882 @@ class MTGCommanderRecommendationSystem:
         self.toughness_boost = toughness_boost
         self.known_penalty = known_penalty
         self.short_text_penalty = short_text_penalty
+        self.sparse_embeddings = sparse_embeddings
+        self.approximate = approximate
+        self.ann_candidates = ann_candidates
+        self.ann_index = None
+        self.metrics = metrics or NULL_SINK
+        self.max_scoring_states = max_scoring_states
+        self._scoring_states = OrderedDict()
+        # One system is shared by every Streamlit session thread; guards the LRU caches
+        self._cache_lock = threading.Lock()
+        self.max_cached_results = max_cached_results
+        self._result_cache = OrderedDict()
+        self.result_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.data_version = 0
+        self.precomputed = None
+        self.snapshot_path = None
+        self.source_hash = None
+        self.applied_deltas = set()
+        self.price_source = None
+        self.price_refresh_interval = 300
+        self._card_prices = None
+        self._prices_loaded_at = 0.0
+        self._embedding_norms = None
         
-        print("🧠 Precomputing creature embeddings...")
-        self._precompute_embeddings()
-        print(f"✅ System ready with {len(self.creatures_df):,} creatures")
+        # Prebuilt embeddings, card store and indexes (e.g. from a snapshot) skip the rebuild
+        self.card_store = card_store if card_store is not None else CardStore.from_dataframe(self.creatures_df)
+        if creature_embeddings is None:
+            print("🧠 Precomputing creature embeddings...")
+            with StageTimer(self.metrics).stage('embed'):
+                self._precompute_embeddings()
+        else:
+            self.creature_embeddings = creature_embeddings
+            self.sparse_embeddings = sp.issparse(creature_embeddings)
+        self._build_indexes(indexes)
+        print(f"✅ System ready with {len(self.card_store):,} creatures "
+              f"({'sparse' if self.sparse_embeddings else 'dense'} embeddings, "
+              f"{self.embedding_nbytes() / 1e6:.1f} MB)")
         print(f"📊 Scoring config: keyword={keyword_boost}, type={type_boost}, "
               f"power={power_boost}, toughness={toughness_boost}")
     
+    def _frame(self, kind):
+        frame = self._frames.get(kind)
+        if frame is None and self.frame_loader is not None:
+            import pandas as pd
+            frame = self.frame_loader(kind)
+            pending = self._pending_rows.pop(kind, [])
+            if pending:
+                frame = pd.concat([frame, *pending], ignore_index=True)
+            self._frames[kind] = frame
+        return frame
+    
+    def _append_rows(self, kind, rows):
+        """Append rows to a DataFrame, or queue them until a lazily loaded one is first used"""
+        if kind in self._frames:
+            import pandas as pd
+            self._frames[kind] = pd.concat([self._frames[kind], rows], ignore_index=True)
+        else:
+            self._pending_rows.setdefault(kind, []).append(rows)
+    
+    @property
+    def creatures_df(self):
+        """Creature DataFrame (creatures_processed.csv rows); not used when scoring"""
+        return self._frame('creatures')
+    
+    @property
+    def features_df(self):
+        """Training DataFrame (training_features.csv rows); not used when scoring"""
+        return self._frame('features')
+    
+    @property
+    def tfidf(self):
+        """Fitted TF-IDF vectorizer; only needed to embed new oracle text"""
+        if self._tfidf is None and self.frame_loader is not None:
+            self._tfidf = self.frame_loader('tfidf')
+        return self._tfidf
+    
+    def get_commanders(self):
+        """Sorted names of every commander with training data"""
+        return sorted(self._commander_rows)
+    
+    def scoring_params(self):
+        """Current scoring parameters as a dictionary"""
+        return {
+            'keyword_boost': self.keyword_boost,
+            'type_boost': self.type_boost,
+            'power_boost': self.power_boost,
+            'toughness_boost': self.toughness_boost,
+            'known_penalty': self.known_penalty,
+            'short_text_penalty': self.short_text_penalty
+        }
+    
+    def attach_precomputed_table(self, path):
+        """
+        Serve get_recommendations from a precomputed table (see mtg_precomputed) when possible
+        
+        The table is used only when its scoring parameters match this system's, top_k is
+        within its depth and include_known=True; otherwise scoring runs live. A table built
+        from other data than this system serves (see mtg_precomputed.data_key) never serves
+        a lookup. The file is opened on the first lookup, so attaching does not import duckdb;
+        call precomputed.warm() to open it up front.
+        """
+        from mtg_precomputed import PrecomputedRecommendations, data_key
+        self.precomputed = PrecomputedRecommendations(path, expected_data_key=data_key(self))
+    
+    def set_card_prices(self, prices):
+        """
+        Set per-creature USD prices used by max_price filtering
+        
+        Args:
+            prices: Dictionary mapping card name to price; creatures without an entry have an
+                unknown price and are never filtered out
+        """
+        self._card_prices = np.array([prices.get(name, np.nan) for name in self.card_store.names], dtype=float)
+        self._prices_loaded_at = time.time()
+    
+    def attach_price_source(self, price_source, refresh_interval=300):
+        """
+        Read prices from a card-metadata store (e.g. mtg_card_cache.CardMetadataCache)
+        
+        The source must provide get_prices() returning {name: price}; prices are re-read at
+        most every refresh_interval seconds.
+        """
+        self.price_source = price_source
+        self.price_refresh_interval = refresh_interval
+        self.set_card_prices(price_source.get_prices())
+    
+    def _price_version(self, max_price):
+        """Version of the prices a max_price ceiling filters on (None without one); stale prices are reloaded"""
+        if max_price is None:
+            return None
+        self._price_column()
+        return self._prices_loaded_at
+    
+    def _price_column(self):
+        """Current per-creature prices (NaN = unknown), refreshed from the price source if stale"""
+        if self.price_source is not None and time.time() - self._prices_loaded_at > self.price_refresh_interval:
+            self.set_card_prices(self.price_source.get_prices())
+        if self._card_prices is None:
+            return np.full(len(self.card_store), np.nan)
+        return self._card_prices
+    
     def _precompute_embeddings(self):
         """Precompute TF-IDF embeddings for all creatures"""
-        creature_texts = self.creatures_df['oracle_text_clean'].fillna('')
-        self.creature_embeddings = self.tfidf.transform(creature_texts).toarray()
+        embeddings = self.tfidf.transform(list(self.card_store.oracle_text))
+        if self.sparse_embeddings:
+            # Rows are L2-normalised so a dot product with the unit target is the cosine
+            self.creature_embeddings = normalize_rows(embeddings.tocsr())
+        else:
+            self.creature_embeddings = embeddings.toarray()
     
-    def _get_power_toughness_patterns(self, commander_recs):
-        """Analyze power/toughness patterns for boosting rules"""
-        patterns = {'high_power_boost': False, 'low_power_boost': False, 'high_toughness_boost': False}
+    def embedding_nbytes(self):
+        """Memory held by the creature embedding matrix, in bytes"""
+        embeddings = self.creature_embeddings
+        if self.sparse_embeddings:
+            return embeddings.data.nbytes + embeddings.indices.nbytes + embeddings.indptr.nbytes
+        return embeddings.nbytes
+    
+    def _target_embedding(self, rec_indices):
+        """Mean embedding of the given rows (unit length in sparse mode)"""
+        if self.sparse_embeddings:
+            target_embedding = np.asarray(self.creature_embeddings[rec_indices].mean(axis=0)).ravel()
+            norm = np.linalg.norm(target_embedding)
+            return target_embedding / norm if norm > 0 else target_embedding
+        return np.mean(self.creature_embeddings[rec_indices], axis=0)
+    
+    def _similarities(self, target_embedding):
+        """Cosine similarity of every creature to a target embedding"""
+        if self.sparse_embeddings:
+            return self.creature_embeddings @ target_embedding
+        return self._cosine_rows(self._unit_rows(target_embedding))[0]
+    
+    @staticmethod
+    def _unit_rows(vectors):
+        """Rows of a 2-D array scaled to unit length (zero rows stay zero)"""
+        vectors = np.atleast_2d(vectors)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors, dtype=float), where=norms > 0)
+    
+    def _cosine_rows(self, vectors):
+        """Cosine similarity numerator of every creature to each vector, divided by the creature norms only"""
+        dots = np.asarray(self.creature_embeddings @ np.atleast_2d(vectors).T).T
+        if self.sparse_embeddings:
+            # Rows are already unit length (or empty)
+            return dots
+        norms = self._row_norms()
+        return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+    
+    def _row_norms(self):
+        """L2 norm of every dense embedding row, computed once (recomputed after rows are appended)"""
+        if self._embedding_norms is None or len(self._embedding_norms) != self.creature_embeddings.shape[0]:
+            self._embedding_norms = np.linalg.norm(self.creature_embeddings, axis=1)
+        return self._embedding_norms
+    
+    def _compute_similarities(self, rec_indices):
+        """Cosine similarity of every creature to the mean of the given rows"""
+        return self._similarities(self._target_embedding(rec_indices))
+    
+    def build_ann_index(self, n_components=128, n_lists=None, n_probe=8):
+        """
+        Build the approximate candidate-generation index over the creature embeddings
         
-        if len(commander_recs) == 0:
-            return patterns
+        Args:
+            n_components: TruncatedSVD dimensions
+            n_lists: Number of IVF lists (default ~4 * sqrt(n_creatures))
+            n_probe: Lists scanned per query
+        
+        Returns:
+            The IVFIndex (also stored as self.ann_index)
+        """
+        from mtg_ann import IVFIndex
+        self.ann_index = IVFIndex.build(self.creature_embeddings, n_components=n_components,
+                                        n_lists=n_lists, n_probe=n_probe)
+        self.clear_result_cache()
+        return self.ann_index
+    
+    def report_ann_recall(self, commander_names=None, top_k=100, include_known=True):
+        """
+        Compare approximate against exact scoring
+        
+        Args:
+            commander_names: Commanders to evaluate (default: first 50 in training data)
+            top_k: Recommendations compared per commander
+            include_known: Whether known recommendations are included
+        
+        Returns:
+            Dictionary with mean recall@k and mean per-commander latency (seconds) per mode
+        """
+        if self.ann_index is None:
+            self.build_ann_index()
+        if commander_names is None:
+            commander_names = list(self._commander_rows)[:50]
+        commander_names = list(commander_names)
+        
+        timings, results = {}, {}
+        for approximate in (False, True):
+            start = time.perf_counter()
+            results[approximate] = {
+                name: self.get_recommendations_batch([name], top_k=top_k, include_known=include_known,
+                                                     approximate=approximate, use_cache=False)[name]
+                for name in commander_names
+            }
+            timings[approximate] = (time.perf_counter() - start) / max(len(commander_names), 1)
+        
+        recalls = []
+        for name in commander_names:
+            exact = {rec['creature_name'] for rec in results[False][name]}
+            if exact:
+                approximate = {rec['creature_name'] for rec in results[True][name]}
+                recalls.append(len(exact & approximate) / len(exact))
+        recall = float(np.mean(recalls)) if recalls else 1.0
+        
+        print(f"🎯 ANN recall@{top_k}: {recall:.3f} over {len(recalls)} commanders "
+              f"({self.ann_candidates:,} candidates, {self.ann_index.n_probe} probes)")
+        print(f"⏱️ Latency: exact {timings[False] * 1e3:.2f} ms vs approximate {timings[True] * 1e3:.2f} ms per commander")
+        return {'recall_at_k': recall, 'k': top_k, 'exact_latency_s': timings[False],
+                'approximate_latency_s': timings[True]}
+    
+    def report_embedding_savings(self, commander_names=None, repeats=3):
+        """
+        Compare dense vs sparse embeddings over the full creature table
+        
+        Args:
+            commander_names: Commanders whose targets are scored (default: first 20 in training data)
+            repeats: Timing repetitions per commander
+        
+        Returns:
+            Dictionary with memory (bytes) and mean similarity latency (seconds) per mode
+        """
+        if commander_names is None:
+            commander_names = list(self._commander_rows)[:20]
+        
+        targets = []
+        for commander_name in commander_names:
+            profile = self._get_commander_profile(commander_name)
+            if profile is not None and len(profile['rec_indices']) > 0:
+                targets.append(profile['rec_indices'])
+        
+        original_mode, original_embeddings = self.sparse_embeddings, self.creature_embeddings
+        report = {}
+        try:
+            for mode in (False, True):
+                self.sparse_embeddings = mode
+                self._precompute_embeddings()
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    for rows in targets:
+                        self._compute_similarities(rows)
+                elapsed = (time.perf_counter() - start) / max(repeats * len(targets), 1)
+                report['sparse' if mode else 'dense'] = {'nbytes': self.embedding_nbytes(), 'latency_s': elapsed}
+        finally:
+            self.sparse_embeddings, self.creature_embeddings = original_mode, original_embeddings
+        
+        dense, sparse = report['dense'], report['sparse']
+        print(f"📦 Embeddings for {len(self.card_store):,} creatures: "
+              f"dense {dense['nbytes'] / 1e6:.1f} MB vs sparse {sparse['nbytes'] / 1e6:.1f} MB "
+              f"({(1 - sparse['nbytes'] / dense['nbytes']) * 100:.0f}% saved)")
+        print(f"⏱️ Similarity latency: dense {dense['latency_s'] * 1e3:.2f} ms vs "
+              f"sparse {sparse['latency_s'] * 1e3:.2f} ms per query")
+        return report
+    
+    def _build_indexes(self, indexes=None):
+        """
+        Build (or adopt prebuilt) integer indexes
+        
+        - name_codes: name code of every creature row
+        - name_to_code: card name -> code (also covers recommended names with no creature row)
+        - code_rows: first creature row of every code (-1 if the name has no row)
+        - commander_rows: commander -> training rows
+        - recommended_codes: name code of every training row's recommended creature
+        """
+        if indexes is None:
+            import pandas as pd
+            name_codes, unique_names = pd.factorize(self.creatures_df['name'])
+            _, first_rows = np.unique(name_codes, return_index=True)
+            if len(first_rows) and name_codes[first_rows[0]] < 0:
+                first_rows = first_rows[1:]
+            indexes = {
+                'name_codes': name_codes,
+                'name_to_code': {name: code for code, name in enumerate(unique_names)},
+                'code_rows': first_rows,
+                'commander_rows': self.features_df.groupby('commander', sort=False).indices
+            }
+        
+        self._name_codes = indexes['name_codes']
+        self._name_to_code = indexes['name_to_code']
+        self._code_rows = indexes['code_rows']
+        self._commander_rows = indexes['commander_rows']
+        recommended_codes = indexes.get('recommended_codes')
+        if recommended_codes is None:
+            recommended_codes = self._encode_names(self.features_df['recommended_creature'])
+        self._recommended_codes = recommended_codes
+        self._commander_cache = {}
+    
+    def get_indexes(self):
+        """Name and commander indexes, in the form accepted by the indexes init parameter"""
+        return {
+            'name_codes': self._name_codes,
+            'name_to_code': self._name_to_code,
+            'code_rows': self._code_rows,
+            'commander_rows': self._commander_rows,
+            'recommended_codes': self._recommended_codes
+        }
+    
+    def _encode_names(self, names):
+        """Name codes for a sequence of names; unseen names get new codes without a creature row (-1 for NaN)"""
+        import pandas as pd
+        row_codes, unique_names = pd.factorize(pd.Series(names, dtype=object))
+        unique_codes = np.empty(len(unique_names) + 1, dtype=np.int64)
+        unique_codes[-1] = -1
+        n_codes = len(self._name_to_code)
+        for position, name in enumerate(unique_names):
+            code = self._name_to_code.get(name)
+            if code is None:
+                code = self._name_to_code[name] = len(self._name_to_code)
+            unique_codes[position] = code
+        if len(self._name_to_code) > n_codes:
+            self._code_rows = np.concatenate([self._code_rows, np.full(len(self._name_to_code) - n_codes, -1,
+                                                                       dtype=self._code_rows.dtype)])
+        return unique_codes[row_codes]
+    
+    def _creature_row(self, name):
+        """First creature row with this name, or None"""
+        code = self._name_to_code.get(name)
+        if code is None or self._code_rows[code] < 0:
+            return None
+        return int(self._code_rows[code])
+    
+    def set_training_data(self, features_df, commander_patterns=None):
+        """
+        Replace the training examples (e.g. with a hold-out split)
         
-        # Get P/T data for recommended creatures
-        pt_data = []
-        for _, rec in commander_recs.iterrows():
-            creature = self.creatures_df[self.creatures_df['name'] == rec['recommended_creature']]
-            if len(creature) > 0:
-                pt_data.append((creature.iloc[0]['power_clean'], creature.iloc[0]['toughness_clean']))
+        Creature embeddings and name indexes are kept; commander indexes and every
+        per-commander cache are rebuilt. A precomputed table is detached, since it was
+        built from the old training data.
         
-        if not pt_data:
+        Args:
+            features_df: New training rows
+            commander_patterns: Optional patterns mined from the new rows (default: keep the current ones)
+        """
+        self._frames['features'] = features_df
+        if commander_patterns is not None:
+            self.commander_patterns = commander_patterns
+        self._pending_rows.pop('features', None)
+        self._build_indexes(dict(self.get_indexes(), recommended_codes=None,
+                                 commander_rows=features_df.groupby('commander', sort=False).indices))
+        with self._cache_lock:
+            self._scoring_states.clear()
+        self.precomputed = None
+        self._data_changed()
+    
+    def _data_changed(self):
+        """Start a new data version; cached query results of older versions are dropped"""
+        self.data_version += 1
+        self.clear_result_cache()
+    
+    def _invalidate_commanders(self, commander_names):
+        """Drop cached profiles and scoring states of the given commanders"""
+        for commander_name in commander_names:
+            self._commander_cache.pop(commander_name, None)
+        with self._cache_lock:
+            for key in [key for key in self._scoring_states if key[0] in commander_names]:
+                del self._scoring_states[key]
+    
+    def add_cards(self, cards_df, persist=True):
+        """
+        Append new creatures without re-embedding the existing ones
+        
+        Only the new oracle texts are transformed (with the existing tfidf). Embeddings,
+        card store, name indexes, prices and the ANN index are extended in place. Commanders
+        whose training rows name one of the new cards get their cached target rebuilt;
+        every cached scoring state is dropped because the candidate set changed.
+        
+        Args:
+            cards_df: DataFrame with the creatures_processed.csv columns
+            persist: Append the cards to the loaded snapshot as a delta (if any)
+        
+        Returns:
+            Number of creatures added
+        """
+        if len(cards_df) == 0:
+            return 0
+        cards_df = cards_df.reset_index(drop=True)
+        first_row = len(self.card_store)
+        
+        embeddings = self.tfidf.transform(cards_df['oracle_text_clean'].fillna(''))
+        if self.sparse_embeddings:
+            embeddings = normalize_rows(embeddings.tocsr())
+            self.creature_embeddings = sp.vstack([self.creature_embeddings, embeddings], format='csr')
+        else:
+            embeddings = embeddings.toarray()
+            self.creature_embeddings = np.vstack([self.creature_embeddings, embeddings])
+        if self.ann_index is not None:
+            self.ann_index.add(embeddings, first_row)
+        
+        self._append_rows('creatures', cards_df)
+        self.card_store = self.card_store.extend(cards_df)
+        if self._card_prices is not None:
+            self._card_prices = np.concatenate([self._card_prices, np.full(len(cards_df), np.nan)])
+            self._prices_loaded_at = 0.0
+        
+        # Names without a creature row get their first new row; a repeated name keeps its first row
+        codes = self._encode_names(cards_df['name'])
+        self._name_codes = np.concatenate([self._name_codes, codes])
+        unique_codes, first_offsets = np.unique(codes, return_index=True)
+        gained = (unique_codes >= 0) & (self._code_rows[np.maximum(unique_codes, 0)] < 0)
+        gained_codes = unique_codes[gained]
+        self._code_rows = np.array(self._code_rows)
+        self._code_rows[gained_codes] = first_row + first_offsets[gained]
+        
+        # Commanders recommending one of the gained names, and gained names that are commanders
+        hit = np.isin(self._recommended_codes, gained_codes)
+        affected = {commander_name for commander_name, rows in self._commander_rows.items() if hit[rows].any()}
+        gained_set = set(gained_codes.tolist())
+        affected |= {name for name in cards_df['name'].tolist()
+                     if name in self._commander_rows and self._name_to_code[name] in gained_set}
+        self._invalidate_commanders(affected)
+        with self._cache_lock:
+            self._scoring_states.clear()
+        self.precomputed = None
+        self._data_changed()
+        
+        if persist and self.snapshot_path is not None:
+            self.applied_deltas.add(append_delta(self.snapshot_path, 'cards', cards_df))
+        print(f"➕ Added {len(cards_df):,} creatures ({len(affected):,} commanders refreshed)")
+        return len(cards_df)
+    
+    def add_training_examples(self, examples_df, commander_patterns=None, persist=True):
+        """
+        Append training rows (commander, recommended_creature, ...) without a rebuild
+        
+        Only commanders with new rows (or new patterns) have their cached target and
+        power/toughness patterns rebuilt.
+        
+        Args:
+            examples_df: DataFrame with the training_features.csv columns
+            commander_patterns: Optional {commander: patterns} entries to add or replace
+            persist: Append the rows to the loaded snapshot as a delta (if any)
+        
+        Returns:
+            Set of affected commander names
+        """
+        examples_df = examples_df.reset_index(drop=True)
+        first_row = len(self._recommended_codes)
+        self._append_rows('features', examples_df)
+        self._recommended_codes = np.concatenate([self._recommended_codes,
+                                                  self._encode_names(examples_df['recommended_creature'])])
+        for commander_name, rows in examples_df.groupby('commander', sort=False).indices.items():
+            existing = self._commander_rows.get(commander_name, np.empty(0, dtype=np.int64))
+            self._commander_rows[commander_name] = np.concatenate([existing, rows + first_row])
+        
+        affected = set(examples_df['commander'])
+        if commander_patterns:
+            self.commander_patterns.update(commander_patterns)
+            affected |= set(commander_patterns)
+        self._invalidate_commanders(affected)
+        self.precomputed = None
+        self._data_changed()
+        
+        if persist and self.snapshot_path is not None:
+            self.applied_deltas.add(append_delta(self.snapshot_path, 'training', examples_df, commander_patterns))
+        print(f"➕ Added {len(examples_df):,} training examples ({len(affected):,} commanders refreshed)")
+        return affected
+    
+    def apply_snapshot_deltas(self):
+        """
+        Pick up cards and training examples appended to the loaded snapshot by other processes
+        
+        Returns:
+            Number of deltas applied
+        """
+        if self.snapshot_path is None:
+            return 0
+        return apply_deltas(self, self.snapshot_path)
+    
+    def _get_commander_profile(self, commander_name):
+        """
+        Per-commander derived data, computed once and cached
+        
+        Returns:
+            Dictionary with training row count, rec indices, known name codes, P/T patterns,
+            consensus keywords/types (and their bitset queries) and the target embedding,
+            or None if the commander has no training data
+        """
+        profile = self._commander_cache.get(commander_name)
+        if profile is not None:
+            return profile
+        
+        training_rows = self._commander_rows.get(commander_name)
+        if training_rows is None or len(training_rows) == 0:
+            return None
+        
+        codes = self._recommended_codes[training_rows]
+        rows = self._code_rows[codes[codes >= 0]]
+        # One entry per training row found in the database; known codes are those with a row
+        rec_indices = rows[rows >= 0].astype(np.int64)
+        known_codes = np.unique(codes[codes >= 0][rows >= 0]).astype(np.int64)
+        
+        patterns = self.commander_patterns.get(commander_name, {})
+        consensus_keywords = [kw for kw, _ in patterns.get('consensus_keywords', [])]
+        consensus_types = [st for st, _ in patterns.get('consensus_types', [])]
+        
+        profile = {
+            'total_recommendations': len(training_rows),
+            'rec_indices': rec_indices,
+            'known_codes': known_codes,
+            'pt_patterns': self._get_power_toughness_patterns(rec_indices),
+            'consensus_keywords': consensus_keywords,
+            'consensus_types': consensus_types,
+            'keyword_query': self.card_store.keyword_query(consensus_keywords),
+            'type_query': self.card_store.type_query(consensus_types),
+            'target_embedding': self._target_embedding(rec_indices) if len(rec_indices) else None
+        }
+        self._commander_cache[commander_name] = profile
+        return profile
+    
+    def _get_power_toughness_patterns(self, rec_indices):
+        """Analyze power/toughness patterns for boosting rules"""
+        patterns = {'high_power_boost': False, 'low_power_boost': False, 'high_toughness_boost': False}
+        
+        # P/T data for recommended creatures (one entry per training row found in the database)
+        total = len(rec_indices)
+        if total == 0:
             return patterns
         
-        total = len(pt_data)
-        powers, toughnesses = zip(*pt_data)
+        powers = self.card_store.power[rec_indices]
+        toughnesses = self.card_store.toughness[rec_indices]
         
         # Apply pattern rules
-        if sum(1 for p in powers if p >= 4) / total >= 0.75:
+        if np.count_nonzero(powers >= 4) / total >= 0.75:
             patterns['high_power_boost'] = True
-        if sum(1 for p in powers if p <= 2) / total >= 0.75:
+        if np.count_nonzero(powers <= 2) / total >= 0.75:
             patterns['low_power_boost'] = True
-        if sum(1 for p, t in pt_data if t > p) / total >= 0.80:
+        if np.count_nonzero(toughnesses > powers) / total >= 0.80:
             patterns['high_toughness_boost'] = True
         
         return patterns
     
-    def _is_valid_color_identity(self, creature_colors, commander_colors):
-        """Validate MTG color identity rules"""
-        if not creature_colors:  # Colorless is always valid
-            return True
-        if not commander_colors:  # Colorless commander can only play colorless
-            return False
-        return set(creature_colors).issubset(set(commander_colors))
+    @staticmethod
+    def _top_k_indices(scores, top_k):
+        """Indices of the top_k finite scores, highest first, ties broken by row order (stable sort)"""
+        eligible = np.isfinite(scores)
+        n_eligible = int(np.count_nonzero(eligible))
+        top_k = min(top_k, n_eligible)
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if top_k < n_eligible:
+            # argpartition finds the cutoff; keep every tie at the cutoff so row order decides
+            cutoff = scores[np.argpartition(-scores, top_k - 1)[:top_k]].min()
+            candidates = np.flatnonzero(scores >= cutoff)
+        else:
+            candidates = np.flatnonzero(eligible)
+        order = np.lexsort((candidates, -scores[candidates]))
+        return candidates[order[:top_k]]
+    
+    def _resolve_commander(self, commander_name):
+        """Cached profile and database row for a commander, or None (with a warning) if unusable"""
+        profile = self._get_commander_profile(commander_name)
+        if profile is None:
+            print(f"⚠️ No training data found for {commander_name}")
+            return None
+        
+        commander_row = self._creature_row(commander_name)
+        if commander_row is None:
+            print(f"⚠️ Commander {commander_name} not found in database")
+            return None
+        
+        if profile['target_embedding'] is None:
+            print(f"⚠️ No valid recommendations found for {commander_name}")
+            return None
+        
+        return profile, commander_row
+    
+    def _block_similarities(self, profiles, columns=None):
+        """Similarity matrix of shape (len(profiles), n_creatures), or (len(profiles), len(columns))"""
+        embeddings = self.creature_embeddings if columns is None else self.creature_embeddings[columns]
+        targets = np.vstack([profile['target_embedding'] for profile in profiles])
+        if self.sparse_embeddings:
+            # One sparse x dense product for the whole block of targets
+            return np.asarray(embeddings @ targets.T).T
+        # Dense rows are not unit length: divide by the creature norms (targets are made unit)
+        norms = self._row_norms() if columns is None else self._row_norms()[columns]
+        dots = self._unit_rows(targets) @ embeddings.T
+        return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+    
+    def _ann_candidates(self, profiles, allowed):
+        """
+        Candidate columns for a block from the ANN index
+        
+        Returns:
+            Tuple of (columns: sorted union of every commander's candidates,
+            member: (n_commanders, n_columns) mask of each commander's own candidates)
+        """
+        if self.ann_index is None:
+            self.build_ann_index()
+        targets = np.vstack([profile['target_embedding'] for profile in profiles])
+        candidate_rows = self.ann_index.search(targets, self.ann_candidates, allowed=allowed)
+        columns = np.unique(np.concatenate(candidate_rows))
+        member = np.zeros((len(profiles), len(columns)), dtype=bool)
+        for block_row, rows in enumerate(candidate_rows):
+            member[block_row, np.searchsorted(columns, rows)] = True
+        return columns, member
     
-    def get_recommendations(self, commander_name, top_k=100, include_known=True):
+    def _score_block(self, names, profiles, commander_mask, top_k, include_known, timer, max_price=None,
+                     approximate=False):
+        """
+        Score a block of commanders sharing one color identity against the creature table
+        
+        Only creatures allowed by the shared color identity (and under max_price, if given)
+        are scored. Boost and penalty
+        indicators are (n_commanders, n_candidates) boolean matrices combined in the same
+        order as the scalar rules; ineligible creatures get a score of -inf. In approximate
+        mode only each commander's ANN candidates are scored.
+        
+        Returns:
+            List of recommendation lists, one per commander
+        """
+        candidates = self._candidate_mask(commander_mask, max_price)
+        with timer.stage('similarity'):
+            if approximate:
+                columns, ann_member = self._ann_candidates(profiles, candidates)
+                similarities = self._block_similarities(profiles, columns)
+            else:
+                columns = np.flatnonzero(candidates)
+                similarities = self._block_similarities(profiles)[:, columns]
+        
+        params = self.scoring_params()
+        with timer.stage('filter_boost'):
+            indicators = self._block_indicators(names, profiles, columns, include_known,
+                                                ann_member if approximate else None)
+            scores = self._weighted_scores(similarities, indicators, params)
+        
+        with timer.stage('topk'):
+            return self._explain_block(profiles, columns, top_k, similarities, scores, indicators, params)
+    
+    def _candidate_mask(self, commander_mask, max_price=None):
+        """Creatures allowed by a color identity and, if given, at or under max_price"""
+        candidates = self.card_store.valid_color_identity(commander_mask)
+        if max_price is not None:
+            # Unknown prices (NaN) compare False and stay eligible
+            candidates &= ~(self._price_column() > max_price)
+        return candidates
+    
+    def _block_indicators(self, names, profiles, columns, include_known, ann_member=None):
+        """
+        Eligibility, boost and penalty indicators for a block of commanders
+        
+        Returns:
+            Dictionary of (n_commanders, n_columns) boolean matrices (short_text is per column)
+        """
+        store = self.card_store
+        name_codes = self._name_codes[columns]
+        
+        # Known recommendations: per-commander lookup table over name codes
+        known_lookup = np.zeros((len(profiles), len(self._name_to_code) + 1), dtype=bool)
+        for block_row, profile in enumerate(profiles):
+            known_lookup[block_row, profile['known_codes']] = True
+        # Missing names are coded -1, which lands on the trailing False column
+        known = known_lookup[:, name_codes]
+        
+        # Eligibility: not the commander itself, optionally not known
+        commander_codes = np.array([self._name_to_code[name] for name in names])
+        eligible = name_codes[None, :] != commander_codes[:, None]
+        if not include_known:
+            eligible &= ~known
+        if ann_member is not None:
+            eligible &= ann_member
+        
+        # Keyword/type consensus: OR over bitset words of (card bits & commander query bits)
+        keyword_bits, type_bits = store.keyword_bits[columns], store.type_bits[columns]
+        keyword_queries = np.vstack([profile['keyword_query'] for profile in profiles])
+        type_queries = np.vstack([profile['type_query'] for profile in profiles])
+        keyword_hit = np.zeros_like(eligible)
+        for word in range(keyword_queries.shape[1]):
+            keyword_hit |= (keyword_bits[None, :, word] & keyword_queries[:, word, None]) != 0
+        type_hit = np.zeros_like(eligible)
+        for word in range(type_queries.shape[1]):
+            type_hit |= (type_bits[None, :, word] & type_queries[:, word, None]) != 0
+        
+        def pattern_flags(key):
+            return np.array([profile['pt_patterns'][key] for profile in profiles])[:, None]
+        
+        power, toughness = store.power[columns], store.toughness[columns]
+        high_power_hit = (power >= 4)[None, :] & pattern_flags('high_power_boost')
+        low_power_hit = (power <= 2)[None, :] & pattern_flags('low_power_boost')
+        high_toughness_hit = (toughness > power)[None, :] & pattern_flags('high_toughness_boost')
+        short_text = store.oracle_length[columns] < 40
+        
+        return {
+            'eligible': eligible,
+            'known': known,
+            'keyword_hit': keyword_hit,
+            'type_hit': type_hit,
+            'high_power_hit': high_power_hit,
+            'low_power_hit': low_power_hit,
+            'high_toughness_hit': high_toughness_hit,
+            'short_text': short_text
+        }
+    
+    @staticmethod
+    def _weighted_scores(similarities, indicators, params):
+        """Apply boosts and penalties in the order of the scalar rules; ineligible creatures get -inf"""
+        scores = similarities + np.where(indicators['keyword_hit'], params['keyword_boost'], 0.0)
+        scores += np.where(indicators['type_hit'], params['type_boost'], 0.0)
+        # High and low power can never both apply to one creature, so one pass adds either
+        scores += np.where(indicators['high_power_hit'] | indicators['low_power_hit'], params['power_boost'], 0.0)
+        scores += np.where(indicators['high_toughness_hit'], params['toughness_boost'], 0.0)
+        scores *= np.where(indicators['known'], params['known_penalty'], 1.0)
+        scores *= np.where(indicators['short_text'], params['short_text_penalty'], 1.0)[None, :]
+        scores[~indicators['eligible']] = -np.inf
+        return scores
+    
+    @staticmethod
+    def _reweight_inputs(indicators):
+        """
+        Weight-independent boost and penalty inputs for _reweight (first row of the indicators)
+        
+        Returns:
+            Dictionary with boosts, an (n, 4) matrix of additive boost indicators (keyword,
+            type, power, toughness), and penalty_codes (1 = known, 2 = short text, 3 = both)
+        """
+        return {
+            'boosts': np.column_stack([
+                indicators['keyword_hit'][0],
+                indicators['type_hit'][0],
+                indicators['high_power_hit'][0] | indicators['low_power_hit'][0],
+                indicators['high_toughness_hit'][0]
+            ]).astype(float),
+            'penalty_codes': indicators['known'][0] + 2 * indicators['short_text']
+        }
+    
+    @staticmethod
+    def _reweight(similarities, state, params):
+        """(similarity + boosts @ weights) * penalty for a state holding _reweight_inputs"""
+        additive = np.array([params['keyword_boost'], params['type_boost'],
+                             params['power_boost'], params['toughness_boost']])
+        multipliers = np.array([1.0, params['known_penalty'], params['short_text_penalty'],
+                                params['known_penalty'] * params['short_text_penalty']])
+        return (similarities + state['boosts'] @ additive) * multipliers[state['penalty_codes']]
+    
+    def _explain_block(self, profiles, columns, top_k, similarities, scores, indicators, params):
+        """Select the top K per commander and build explanations only for the returned rows"""
+        store = self.card_store
+        known, keyword_hit, short_text = indicators['known'], indicators['keyword_hit'], indicators['short_text']
+        high_power_hit, low_power_hit = indicators['high_power_hit'], indicators['low_power_hit']
+        high_toughness_hit = indicators['high_toughness_hit']
+        keyword_label = f"Keyword +{params['keyword_boost']:.2f}"
+        high_power_label = f"HighPower +{params['power_boost']:.2f}"
+        low_power_label = f"LowPower +{params['power_boost']:.2f}"
+        high_toughness_label = f"HighToughness +{params['toughness_boost']:.2f}"
+        known_label = f"Known -{(1 - params['known_penalty']) * 100:.0f}%"
+        short_text_label = f"ShortText -{(1 - params['short_text_penalty']) * 100:.0f}%"
+        
+        results = []
+        for block_row, profile in enumerate(profiles):
+            selected = self._top_k_indices(scores[block_row], top_k)
+            rows = columns[selected]
+            matched_types = store.first_matching_type(rows, profile['consensus_types'])
+            
+            recommendations = []
+            for (i, name, similarity, score, has_keyword, matched_type, high_power, low_power,
+                 high_toughness, is_known, is_short, power_clean, toughness_clean, oracle_length) in zip(
+                    rows.tolist(), store.names[rows], similarities[block_row, selected].tolist(),
+                    scores[block_row, selected].tolist(), keyword_hit[block_row, selected].tolist(),
+                    matched_types, high_power_hit[block_row, selected].tolist(),
+                    low_power_hit[block_row, selected].tolist(), high_toughness_hit[block_row, selected].tolist(),
+                    known[block_row, selected].tolist(), short_text[selected].tolist(),
+                    store.power[rows].tolist(), store.toughness[rows].tolist(), store.oracle_length[rows].tolist()):
+                boosts = []
+                if has_keyword:
+                    boosts.append(keyword_label)
+                if matched_type is not None:
+                    boosts.append(f"Type({matched_type}) +{params['type_boost']:.2f}")
+                if high_power:
+                    boosts.append(high_power_label)
+                if low_power:
+                    boosts.append(low_power_label)
+                if high_toughness:
+                    boosts.append(high_toughness_label)
+                
+                penalties = []
+                if is_known:
+                    penalties.append(known_label)
+                if is_short:
+                    penalties.append(short_text_label)
+                
+                recommendations.append({
+                    'creature_name': name,
+                    'base_similarity': similarity,
+                    'final_score': score,
+                    'boosts': boosts,
+                    'penalties': penalties,
+                    'is_known': is_known,
+                    'power_toughness': f"{power_clean:.0f}/{toughness_clean:.0f}",
+                    'oracle_length': oracle_length
+                })
+            results.append(recommendations)
+        return results
+    
+    def _result_key(self, commander_name, include_known, max_price, approximate):
+        price_version = self._prices_loaded_at if max_price is not None else None
+        return (commander_name, include_known, max_price, price_version, approximate,
+                tuple(self.scoring_params().values()), self.data_version)
+    
+    def _cached_result(self, key, top_k):
+        """Cached recommendations for a result key, sliced to top_k, or None"""
+        with self._cache_lock:
+            entry = self._result_cache.get(key)
+            # A list shorter than the top_k it was computed for holds every eligible creature
+            hit = entry is not None and (entry[0] >= top_k or len(entry[1]) < entry[0])
+            if hit:
+                self._result_cache.move_to_end(key)
+            self.result_cache_stats['hits' if hit else 'misses'] += 1
+        self.metrics.increment(RESULT_CACHE_METRIC, result='hit' if hit else 'miss')
+        return entry[1][:top_k] if hit else None
+    
+    def _store_result(self, key, top_k, recommendations):
+        if self.max_cached_results <= 0 or not recommendations:
+            return
+        with self._cache_lock:
+            self._result_cache[key] = (top_k, list(recommendations))
+            self._result_cache.move_to_end(key)
+            while len(self._result_cache) > self.max_cached_results:
+                self._result_cache.popitem(last=False)
+                self.result_cache_stats['evictions'] += 1
+    
+    def result_cache_info(self):
+        """Hit/miss/eviction counts, current size and hit rate of the query result cache"""
+        lookups = self.result_cache_stats['hits'] + self.result_cache_stats['misses']
+        return dict(self.result_cache_stats, size=len(self._result_cache), max_size=self.max_cached_results,
+                    hit_rate=self.result_cache_stats['hits'] / lookups if lookups else 0.0)
+    
+    def clear_result_cache(self):
+        with self._cache_lock:
+            self._result_cache.clear()
+    
+    def get_recommendations(self, commander_name, top_k=100, include_known=True, max_price=None,
+                            approximate=None, profile=False):
         """
         Get recommendations for a commander
         
@@ -98,140 +966,460 @@ class MTGCommanderRecommendationSystem:
             commander_name: Name of the commander
             top_k: Number of recommendations to return
             include_known: Whether to include known recommendations (with penalty)
+            max_price: Only return creatures priced at or below this (USD); cards with an
+                unknown price are kept. Filtering happens before top-K selection, so top_k
+                results are returned whenever enough eligible creatures exist. A precomputed
+                table is filtered the same way when enough of its rows qualify.
+            approximate: Score only ANN candidates instead of every creature
+                (default: the system's approximate setting)
+            profile: Also return the per-stage timing breakdown
         
         Returns:
-            List of recommendation dictionaries with scores and boost details
+            List of recommendation dictionaries with scores and boost details, or a tuple of
+            (recommendations, {stage: seconds}) when profile=True
         """
+        if self.precomputed is not None and include_known:
+            timer = StageTimer(self.metrics)
+            with timer.stage('precomputed'):
+                if max_price is None:
+                    recommendations = self.precomputed.lookup(commander_name, top_k, self.scoring_params())
+                else:
+                    recommendations = self._precomputed_under_price(commander_name, top_k, max_price)
+            if recommendations is not None:
+                self.metrics.increment(REQUEST_METRIC, source='precomputed')
+                return (recommendations, timer.profile()) if profile else recommendations
         
-        # Get training data for this commander
-        commander_recs = self.features_df[self.features_df['commander'] == commander_name]
-        if len(commander_recs) == 0:
-            print(f"⚠️ No training data found for {commander_name}")
-            return []
+        results = self.get_recommendations_batch([commander_name], top_k=top_k, include_known=include_known,
+                                                 max_price=max_price, approximate=approximate, profile=profile)
+        if profile:
+            results, breakdown = results
+            return results[commander_name], breakdown
+        return results[commander_name]
+    
+    def _precomputed_under_price(self, commander_name, top_k, max_price):
+        """
+        Stored recommendations at or under max_price, or None if too few stored rows qualify
         
-        # Get commander info
-        commander_info = self.creatures_df[self.creatures_df['name'] == commander_name]
-        if len(commander_info) == 0:
-            print(f"⚠️ Commander {commander_name} not found in database")
-            return []
+        Price filtering keeps the score order, so the first top_k qualifying stored rows are
+        the live top_k as long as that many exist; a stored list shorter than the table depth
+        already holds every eligible creature.
+        """
+        stored = self.precomputed.lookup_all(commander_name, self.scoring_params())
+        if stored is None:
+            return None
+        prices = self._price_column()
+        rows = [self._creature_row(rec['creature_name']) for rec in stored]
+        # Unknown prices (NaN) compare False and stay eligible
+        kept = [rec for rec, row in zip(stored, rows) if row is None or not prices[row] > max_price]
+        if len(kept) < top_k and len(stored) >= self.precomputed.top_n:
+            return None
+        return kept[:top_k]
+    
+    def get_recommendations_batch(self, commanders, top_k=100, include_known=True, chunk_size=16,
+                                  max_price=None, approximate=None, profile=False, use_cache=True):
+        """
+        Get recommendations for many commanders at once
         
-        commander_colors = ast.literal_eval(commander_info.iloc[0]['color_identity_parsed'])
+        Target vectors are stacked into one matrix and scored with a single sparse matrix
+        product per chunk; boosts and top-K run on (chunk, n_creatures) arrays. Output is
+        identical to calling get_recommendations for each commander. Commanders found in
+        the result cache are not scored again (cached recommendation dictionaries are shared
+        between calls and should be treated as read-only).
         
-        # Get consensus patterns
-        patterns = self.commander_patterns.get(commander_name, {})
-        consensus_keywords = [kw for kw, _ in patterns.get('consensus_keywords', [])]
-        consensus_types = [st for st, _ in patterns.get('consensus_types', [])]
-        pt_patterns = self._get_power_toughness_patterns(commander_recs)
+        Args:
+            commanders: Iterable of commander names
+            top_k: Number of recommendations per commander
+            include_known: Whether to include known recommendations (with penalty)
+            chunk_size: Commanders scored per block (bounds memory to ~chunk_size x n_creatures floats)
+            max_price: Optional USD price ceiling applied before top-K (unknown prices are kept)
+            approximate: Score only ANN candidates (default: the system's approximate setting)
+            profile: Also return the per-stage timing breakdown for the whole batch
+            use_cache: Read and fill the result cache (False always scores, e.g. for timings)
         
-        # Calculate target embedding (average of known recommendations)
-        rec_indices = []
-        for _, rec in commander_recs.iterrows():
-            idx = self.creatures_df[self.creatures_df['name'] == rec['recommended_creature']].index
-            if len(idx) > 0:
-                rec_indices.append(idx[0])
+        Returns:
+            Dictionary mapping commander name to its list of recommendation dictionaries, or a
+            tuple of (results, {stage: seconds}) when profile=True
+        """
+        if approximate is None:
+            approximate = self.approximate
+        timer = StageTimer(self.metrics)
+        results = {}
+        keys = {}
+        with timer.stage('result_cache'):
+            if max_price is not None:
+                self._price_column()
+            for commander_name in dict.fromkeys(commanders):
+                keys[commander_name] = self._result_key(commander_name, include_known, max_price, approximate)
+                results[commander_name] = self._cached_result(keys[commander_name], top_k) if use_cache else None
         
-        if not rec_indices:
-            print(f"⚠️ No valid recommendations found for {commander_name}")
+        color_groups = {}
+        with timer.stage('target'):
+            for commander_name, cached in results.items():
+                if cached is not None:
+                    continue
+                results[commander_name] = []
+                entry = self._resolve_commander(commander_name)
+                if entry is not None:
+                    commander_profile, commander_row = entry
+                    commander_mask = int(self.card_store.color_mask[commander_row])
+                    color_groups.setdefault(commander_mask, []).append((commander_name, commander_profile))
+        
+        # Commanders sharing a color identity share the candidate columns
+        for commander_mask, group in color_groups.items():
+            for start in range(0, len(group), max(1, chunk_size)):
+                chunk = group[start:start + chunk_size]
+                names = [name for name, _ in chunk]
+                block = self._score_block(names, [commander_profile for _, commander_profile in chunk],
+                                          commander_mask, top_k, include_known, timer, max_price, approximate)
+                for name, recommendations in zip(names, block):
+                    results[name] = recommendations
+                    if use_cache:
+                        self._store_result(keys[name], top_k, recommendations)
+        
+        self.metrics.increment(REQUEST_METRIC, source='engine')
+        self.metrics.increment(COMMANDER_METRIC, len(results))
+        return (results, timer.profile()) if profile else results
+    
+    def get_scoring_state(self, commander_name, include_known=True, max_price=None):
+        """
+        Weight-independent scoring inputs for a commander, cached in a small LRU
+        
+        Holds, for every eligible creature: the base similarity and the boost and penalty
+        inputs of _reweight_inputs.
+        
+        Returns:
+            State dictionary, or None if the commander cannot be scored
+        """
+        key = (commander_name, include_known, max_price, self._prices_loaded_at if max_price is not None else None)
+        with self._cache_lock:
+            state = self._scoring_states.get(key)
+            if state is not None:
+                self._scoring_states.move_to_end(key)
+                return state
+        
+        entry = self._resolve_commander(commander_name)
+        if entry is None:
+            return None
+        profile, commander_row = entry
+        columns = np.flatnonzero(self._candidate_mask(int(self.card_store.color_mask[commander_row]), max_price))
+        similarities = self._block_similarities([profile])[:, columns]
+        indicators = self._block_indicators([commander_name], [profile], columns, include_known)
+        
+        # Keep only eligible creatures; every other creature would score -inf for any weights
+        keep = np.flatnonzero(indicators['eligible'][0])
+        indicators = {name: (values[keep] if name == 'short_text' else values[:, keep])
+                      for name, values in indicators.items()}
+        state = {
+            'profile': profile,
+            'columns': columns[keep],
+            'similarities': similarities[:, keep],
+            'indicators': indicators,
+            **self._reweight_inputs(indicators)
+        }
+        with self._cache_lock:
+            self._scoring_states[key] = state
+            while len(self._scoring_states) > self.max_scoring_states:
+                self._scoring_states.popitem(last=False)
+        return state
+    
+    def rescore(self, commander_name, weights=None, top_k=100, include_known=True, max_price=None):
+        """
+        Re-rank a commander's recommendations under different scoring weights
+        
+        Similarity and indicators come from get_scoring_state, so only
+        (similarity + boosts @ w) * penalty is recomputed. Results match a system built
+        with the same weights up to floating-point rounding.
+        
+        Args:
+            commander_name: Name of the commander
+            weights: Dictionary overriding any of scoring_params() (e.g. {'keyword_boost': 0.2})
+            top_k: Number of recommendations to return
+            include_known: Whether to include known recommendations (with penalty)
+            max_price: Optional USD price ceiling (unknown prices are kept)
+        
+        Returns:
+            List of recommendation dictionaries with scores and boost details
+        """
+        params = self.scoring_params()
+        params.update(weights or {})
+        state = self.get_scoring_state(commander_name, include_known, max_price)
+        if state is None:
             return []
         
-        target_embedding = np.mean(self.creature_embeddings[rec_indices], axis=0)
+        scores = self._reweight(state['similarities'][0], state, params)
+        return self._explain_block([state['profile']], state['columns'], top_k, state['similarities'],
+                                   scores[None, :], state['indicators'], params)[0]
+    
+    def iter_recommendations(self, commander_name, top_k=100, include_known=True, max_price=None,
+                             weights=None, timer=None):
+        """
+        Yield recommendations one at a time in rank order
         
-        # Calculate similarities and apply boosts
-        similarities = cosine_similarity([target_embedding], self.creature_embeddings)[0]
-        recommendations = []
-        known_creatures = set(commander_recs['recommended_creature'])
+        Scoring runs when the first recommendation is requested, so callers can render each
+        card as it arrives instead of waiting for the whole list (and its card data).
         
-        for i, (similarity, creature) in enumerate(zip(similarities, self.creatures_df.itertuples())):
-            # Skip commander itself
-            if creature.name == commander_name:
-                continue
-            
-            # Skip known recommendations if not including them
-            is_known = creature.name in known_creatures
-            if not include_known and is_known:
-                continue
-            
-            # Validate color identity
-            creature_colors = ast.literal_eval(creature.color_identity_parsed)
-            if not self._is_valid_color_identity(creature_colors, commander_colors):
-                continue
-            
-            # Start with base similarity
-            score = similarity
-            boosts = []
-            
-            # Apply keyword consensus boost
-            creature_keywords = ast.literal_eval(creature.keywords_parsed) if creature.keywords_parsed else []
-            if any(kw in creature_keywords for kw in consensus_keywords):
-                score += self.keyword_boost
-                boosts.append(f"Keyword +{self.keyword_boost:.2f}")
-            
-            # Apply secondary type consensus boost
-            creature_types = str(creature.secondary_type).split() if creature.secondary_type else []
-            for consensus_type in consensus_types:
-                if consensus_type in creature_types:
-                    score += self.type_boost
-                    boosts.append(f"Type({consensus_type}) +{self.type_boost:.2f}")
-                    break
-            
-            # Apply power/toughness pattern boosts
-            if pt_patterns['high_power_boost'] and creature.power_clean >= 4:
-                score += self.power_boost
-                boosts.append(f"HighPower +{self.power_boost:.2f}")
-            if pt_patterns['low_power_boost'] and creature.power_clean <= 2:
-                score += self.power_boost
-                boosts.append(f"LowPower +{self.power_boost:.2f}")
-            if pt_patterns['high_toughness_boost'] and creature.toughness_clean > creature.power_clean:
-                score += self.toughness_boost
-                boosts.append(f"HighToughness +{self.toughness_boost:.2f}")
-            
-            # Apply penalties
-            penalties = []
-            if is_known:
-                score *= self.known_penalty
-                penalty_pct = (1 - self.known_penalty) * 100
-                penalties.append(f"Known -{penalty_pct:.0f}%")
-            
-            oracle_length = len(str(creature.oracle_text_clean)) if creature.oracle_text_clean else 0
-            if oracle_length < 40:
-                score *= self.short_text_penalty
-                penalty_pct = (1 - self.short_text_penalty) * 100
-                penalties.append(f"ShortText -{penalty_pct:.0f}%")
-            
-            recommendations.append({
-                'creature_name': creature.name,
-                'base_similarity': similarity,
-                'final_score': score,
-                'boosts': boosts,
-                'penalties': penalties,
-                'is_known': is_known,
-                'power_toughness': f"{creature.power_clean:.0f}/{creature.toughness_clean:.0f}",
-                'oracle_length': oracle_length
-            })
-        
-        # Sort by final score and return top K
-        recommendations.sort(key=lambda x: x['final_score'], reverse=True)
-        return recommendations[:top_k]
+        Args:
+            commander_name: Name of the commander
+            top_k: Number of recommendations to yield
+            include_known: Whether to include known recommendations (with penalty)
+            max_price: Optional USD price ceiling (unknown prices are kept)
+            weights: Optional scoring-weight overrides, scored with rescore()
+            timer: Optional StageTimer that receives the stage breakdown
+        
+        Yields:
+            Recommendation dictionaries, best first
+        """
+        if weights is None:
+            recommendations, breakdown = self.get_recommendations(commander_name, top_k=top_k,
+                                                                  include_known=include_known,
+                                                                  max_price=max_price, profile=True)
+            if timer is not None:
+                timer.merge(breakdown)
+        else:
+            timer = timer or StageTimer(self.metrics)
+            with timer.stage('rescore'):
+                recommendations = self.rescore(commander_name, weights, top_k=top_k, include_known=include_known,
+                                               max_price=max_price)
+        yield from recommendations
+    
+    def _pooled_profile(self, profiles):
+        """One profile pooling the known names, consensus keywords/types and P/T data of several commanders"""
+        keywords = list(dict.fromkeys(kw for profile in profiles for kw in profile['consensus_keywords']))
+        types = list(dict.fromkeys(st for profile in profiles for st in profile['consensus_types']))
+        empty = np.empty(0, dtype=np.int64)
+        rec_indices = np.concatenate([empty] + [profile['rec_indices'] for profile in profiles])
+        return {
+            'known_codes': np.unique(np.concatenate([empty] + [profile['known_codes'] for profile in profiles])),
+            'consensus_keywords': keywords,
+            'consensus_types': types,
+            'keyword_query': self.card_store.keyword_query(keywords),
+            'type_query': self.card_store.type_query(types),
+            'pt_patterns': self._get_power_toughness_patterns(rec_indices)
+        }
+    
+    def get_deck_state(self, commanders, deck=(), include_known=True, max_price=None,
+                       commander_weights=None, deck_weight=DECK_WEIGHT):
+        """
+        Scoring state for one or more commanders (e.g. a partner pair) and a partial decklist
+    
+        Color identity is the union of the commanders' masks. The target is a weighted blend
+        of each commander's unit target and the unit mean embedding of the deck's creatures;
+        boosts and penalties pool the commanders' consensus keywords/types, P/T patterns and
+        known recommendations. Commanders and deck cards are never recommended. Similarity
+        to each component is kept separately, so add_to_deck only scores the added cards.
+    
+        Args:
+            commanders: Commander names; names without training data only add their color identity
+            deck: Card names already in the deck
+            include_known: Whether to include known recommendations (with penalty)
+            max_price: Optional USD price ceiling (unknown prices are kept)
+            commander_weights: Relative weight of each commander's target (default: equal)
+            deck_weight: Weight of the deck's mean embedding relative to all commanders together
+    
+        Returns:
+            State dictionary for add_to_deck and recommend_for_deck, or None if no commander
+            is in the database or nothing gives a target
+        """
+        commanders = list(dict.fromkeys(commanders))
+        weights = np.ones(len(commanders)) if commander_weights is None else np.asarray(commander_weights, dtype=float)
+        deck = list(deck)
+        timer = StageTimer(self.metrics)
+    
+        with timer.stage('target'):
+            commander_mask = 0
+            found, profiles, targets, target_weights = [], [], [], []
+            for commander_name, weight in zip(commanders, weights):
+                commander_row = self._creature_row(commander_name)
+                if commander_row is None:
+                    print(f"⚠️ Commander {commander_name} not found in database")
+                    continue
+                found.append(commander_name)
+                commander_mask |= int(self.card_store.color_mask[commander_row])
+                profile = self._get_commander_profile(commander_name)
+                if profile is None or profile['target_embedding'] is None:
+                    continue
+                norm = np.linalg.norm(profile['target_embedding'])
+                profiles.append(profile)
+                targets.append(profile['target_embedding'] / norm if norm > 0 else profile['target_embedding'])
+                target_weights.append(weight)
+            if not found or (not profiles and not deck):
+                print(f"⚠️ Nothing to score for {' + '.join(commanders)}")
+                return None
+            pooled = self._pooled_profile(profiles)
+            targets = np.vstack(targets) if targets else np.zeros((0, self.creature_embeddings.shape[1]))
+            target_weights = np.array(target_weights, dtype=float)
+            if target_weights.sum() > 0:
+                target_weights /= target_weights.sum()
+    
+        with timer.stage('similarity'):
+            columns = np.flatnonzero(self._candidate_mask(commander_mask, max_price))
+            components = self._cosine_rows(targets)[:, columns] if len(targets) else np.zeros((0, len(columns)))
+    
+        with timer.stage('filter_boost'):
+            indicators = self._block_indicators(found[:1], [pooled], columns, include_known)
+            name_codes = self._name_codes[columns]
+            indicators['eligible'][0] &= ~np.isin(name_codes, [self._name_to_code[name] for name in found])
+    
+        state = {
+            'commanders': commanders,
+            'commander_weights': commander_weights,
+            'include_known': include_known,
+            'max_price': max_price,
+            'price_version': self._price_version(max_price),
+            'data_version': self.data_version,
+            'profile': pooled,
+            'columns': columns,
+            'name_codes': name_codes,
+            'targets': targets,
+            'target_weights': target_weights,
+            'components': components,
+            'deck': [],
+            'deck_codes': set(),
+            'deck_weight': deck_weight,
+            'deck_sum': np.zeros(self.creature_embeddings.shape[1]),
+            'deck_similarities': np.zeros(len(columns)),
+            'indicators': indicators,
+            **self._reweight_inputs(indicators)
+        }
+        self.add_to_deck(state, deck)
+        return state
+    
+    def add_to_deck(self, state, card_names):
+        """
+        Add cards to a deck state without rescoring it
+    
+        Only the added creatures are scored (one product with the sum of their embeddings);
+        commander similarities, boosts and penalties are reused. Added names are excluded from
+        recommendations; names that are not creatures in the database add nothing to the target.
+    
+        Returns:
+            Number of creatures added to the deck target
+        """
+        with StageTimer(self.metrics).stage('deck_update'):
+            new_names = [name for name in dict.fromkeys(card_names) if name not in state['deck']]
+            state['deck'].extend(new_names)
+            new_codes = {self._name_to_code.get(name) for name in new_names} - {None} - state['deck_codes']
+            if not new_codes:
+                return 0
+            state['deck_codes'] |= new_codes
+            new_codes = np.fromiter(new_codes, dtype=np.int64, count=len(new_codes))
+            state['indicators']['eligible'][0] &= ~np.isin(state['name_codes'], new_codes)
+    
+            rows = self._code_rows[new_codes]
+            rows = np.sort(rows[rows >= 0]).astype(np.int64)
+            if len(rows):
+                added = np.asarray(self.creature_embeddings[rows].sum(axis=0)).ravel()
+                state['deck_sum'] += added
+                state['deck_similarities'] += self._cosine_rows(added)[0, state['columns']]
+        return len(rows)
+    
+    def recommend_for_deck(self, state, top_k=100, weights=None):
+        """
+        Recommendations for a deck state
+    
+        The blended similarity is a weighted sum of the cached per-component similarities,
+        divided by the norm of the blended target, so this is O(candidates) plus top-K. A
+        state built before the system's data or (with a max_price) its prices changed is
+        rebuilt first.
+    
+        Args:
+            state: State from get_deck_state
+            top_k: Number of recommendations to return
+            weights: Dictionary overriding any of scoring_params()
+    
+        Returns:
+            List of recommendation dictionaries with scores and boost details
+        """
+        if (state['data_version'] != self.data_version
+                or state['price_version'] != self._price_version(state['max_price'])):
+            rebuilt = self.get_deck_state(state['commanders'], state['deck'], state['include_known'],
+                                          state['max_price'], state['commander_weights'], state['deck_weight'])
+            if rebuilt is None:
+                return []
+            state.update(rebuilt)
+    
+        params = self.scoring_params()
+        params.update(weights or {})
+        timer = StageTimer(self.metrics)
+        with timer.stage('similarity'):
+            target = state['target_weights'] @ state['targets']
+            similarities = state['target_weights'] @ state['components']
+            deck_norm = np.linalg.norm(state['deck_sum'])
+            if deck_norm > 0:
+                scale = state['deck_weight'] / deck_norm
+                target = target + scale * state['deck_sum']
+                similarities = similarities + scale * state['deck_similarities']
+            norm = np.linalg.norm(target)
+            similarities = similarities / norm if norm > 0 else np.zeros_like(similarities)
+    
+        with timer.stage('topk'):
+            scores = self._reweight(similarities, state, params)
+            scores[~state['indicators']['eligible'][0]] = -np.inf
+            recommendations = self._explain_block([state['profile']], state['columns'], top_k, similarities[None, :],
+                                                  scores[None, :], state['indicators'], params)[0]
+        self.metrics.increment(REQUEST_METRIC, source='deck')
+        return recommendations
+    
+    def get_deck_recommendations(self, commanders, deck=(), top_k=100, include_known=True, max_price=None,
+                                 commander_weights=None, deck_weight=DECK_WEIGHT):
+        """
+        One-off recommendations for one or more commanders and a partial decklist
+    
+        See get_deck_state; keep the state and use add_to_deck / recommend_for_deck to update
+        the results as cards are added.
+        """
+        state = self.get_deck_state(commanders, deck, include_known, max_price, commander_weights, deck_weight)
+        if state is None:
+            return []
+        return self.recommend_for_deck(state, top_k)
     
     def get_commander_info(self, commander_name):
         """Get analysis info for a commander"""
-        commander_recs = self.features_df[self.features_df['commander'] == commander_name]
-        if len(commander_recs) == 0:
+        profile = self._get_commander_profile(commander_name)
+        if profile is None:
             return None
         
         patterns = self.commander_patterns.get(commander_name, {})
-        pt_patterns = self._get_power_toughness_patterns(commander_recs)
         
         return {
-            'total_recommendations': len(commander_recs),
+            'total_recommendations': profile['total_recommendations'],
             'consensus_keywords': patterns.get('consensus_keywords', []),
             'consensus_types': patterns.get('consensus_types', []),
-            'power_toughness_patterns': pt_patterns
+            'power_toughness_patterns': dict(profile['pt_patterns'])
         }
 
+def load_system_from_sources(data_dir=DATA_DIR, **system_params):
+    """Load the CSV/pickle source files from data_dir and build a recommendation system"""
+    import pandas as pd
+    
+    with StageTimer(system_params.get('metrics')).stage('load'):
+        features_df = pd.read_csv(os.path.join(data_dir, 'training_features.csv'))
+        creatures_df = pd.read_csv(os.path.join(data_dir, 'creatures_processed.csv'))
+        
+        with open(os.path.join(data_dir, 'tfidf_vectorizer.pkl'), 'rb') as f:
+            tfidf = pickle.load(f)
+        
+        with open(os.path.join(data_dir, 'commander_patterns.pkl'), 'rb') as f:
+            commander_patterns = pickle.load(f)
+    
+    print(f"✅ Loaded {features_df.shape[0]:,} training examples")
+    print(f"✅ Loaded {creatures_df.shape[0]:,} creatures")
+    
+    system = MTGCommanderRecommendationSystem(
+        tfidf=tfidf,
+        commander_patterns=commander_patterns,
+        creatures_df=creatures_df,
+        features_df=features_df,
+        **system_params
+    )
+    system.source_hash = source_hash(data_dir)
+    return system
+
 def create_recommendation_system(keyword_boost=0.1, type_boost=0.1, 
                                 power_boost=0.05, toughness_boost=0.05,
-                                known_penalty=0.85, short_text_penalty=0.90):
+                                known_penalty=0.85, short_text_penalty=0.90,
+                                sparse_embeddings=False, snapshot_dir=None, approximate=False, metrics=None,
+                                data_dir=None):
     """
     Create and return a new recommendation system by loading all required data
     
@@ -242,35 +1430,41 @@ def create_recommendation_system(keyword_boost=0.1, type_boost=0.1,
         toughness_boost: Boost for toughness pattern matches (default: 0.05)
         known_penalty: Multiplier penalty for known recommendations (default: 0.85 = -15%)
         short_text_penalty: Multiplier penalty for short oracle text (default: 0.90 = -10%)
+        sparse_embeddings: Keep L2-normalised CSR embeddings instead of a dense matrix (default: False)
+        snapshot_dir: Load from (or build) a memory-mapped snapshot under this directory.
+            Snapshots are keyed on a content hash of the source files and always use sparse embeddings.
+        approximate: Score only ANN candidates by default (index built on first query) (default: False)
+        metrics: Sink for stage timings and counters, e.g. mtg_metrics.MetricsRegistry (default: no-op)
+        data_dir: Directory with the source files (default: DATA_DIR, i.e. $MTG_DATA_DIR or
+            data/processed next to this module, independent of the working directory)
     
     Returns:
         MTGCommanderRecommendationSystem: Configured recommendation system
     """
     print("🃏 Loading MTG Commander Recommendation System...")
+    data_dir = data_dir or DATA_DIR
     
-    # Load all required data
-    features_df = pd.read_csv('data/processed/training_features.csv')
-    creatures_df = pd.read_csv('data/processed/creatures_processed.csv')
-    
-    with open('data/processed/tfidf_vectorizer.pkl', 'rb') as f:
-        tfidf = pickle.load(f)
-    
-    with open('data/processed/commander_patterns.pkl', 'rb') as f:
-        commander_patterns = pickle.load(f)
-    
-    print(f"✅ Loaded {features_df.shape[0]:,} training examples")
-    print(f"✅ Loaded {creatures_df.shape[0]:,} creatures")
-    
-    # Create and return the system with custom parameters
-    return MTGCommanderRecommendationSystem(
-        tfidf=tfidf,
-        commander_patterns=commander_patterns,
-        creatures_df=creatures_df,
-        features_df=features_df,
+    scoring_params = dict(
         keyword_boost=keyword_boost,
         type_boost=type_boost,
         power_boost=power_boost,
         toughness_boost=toughness_boost,
         known_penalty=known_penalty,
         short_text_penalty=short_text_penalty
-    )
\ No newline at end of file
+    )
+    
+    if snapshot_dir is None:
+        return load_system_from_sources(data_dir, sparse_embeddings=sparse_embeddings,
+                                        approximate=approximate, metrics=metrics, **scoring_params)
+    
+    # Reuse the snapshot for the current source files, or build and publish one
+    content_hash = source_hash(data_dir)
+    system = load_snapshot(snapshot_path(snapshot_dir, content_hash), metrics=metrics, **scoring_params)
+    if system is None:
+        print("🔨 No snapshot for the current data, building one...")
+        system = load_system_from_sources(data_dir, sparse_embeddings=True, metrics=metrics, **scoring_params)
+        system.snapshot_path = write_snapshot(system, snapshot_dir, content_hash)
+        # Cards and training rows ingested into the snapshot this one replaced
+        system.apply_snapshot_deltas()
+    system.approximate = approximate
+    return system
@@ -0,0 +1,230 @@
+# mtg_scryfall_client.py
+# Shared, rate-limited, connection-pooled Scryfall client with request coalescing
+
+import asyncio
+import queue
+import random
+import threading
+import time
+import httpx
+from mtg_card_cache import extract_card_data
+
+SCRYFALL_API_URL = 'https://api.scryfall.com'
+COLLECTION_BATCH_SIZE = 75   # Scryfall's limit for /cards/collection identifiers
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_FAILED = object()
+_DONE = object()
+
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ScryfallClient:
+    """
+    One shared Scryfall client per process
+
+    - A background event loop owns a pooled httpx.AsyncClient, so synchronous callers
+      (Streamlit script threads, cache revalidation threads) share connections
+    - Requests are bounded by a concurrency limit and a token-bucket rate limit
+    - 429 and 5xx responses are retried with exponential backoff (honouring Retry-After)
+    - Lookups of a name already in flight wait on the existing request
+    - Names are fetched 75 at a time through /cards/collection; only names it does not
+      find fall back to /cards/named?fuzzy=
+    """
+
+    def __init__(self, base_url=SCRYFALL_API_URL, max_concurrency=6, requests_per_second=8.0,
+                 max_retries=4, backoff=0.5, timeout=8.0):
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._inflight = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='scryfall-client', daemon=True)
+        self._thread.start()
+        self._call(self._start())
+
+    async def _start(self):
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency),
+            headers={'User-Agent': 'CommanderCrafter/1.0', 'Accept': 'application/json'}
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._bucket = TokenBucket(self.requests_per_second)
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def close(self):
+        """Close the HTTP client and stop the background loop"""
+        if self._loop.is_running():
+            self._call(self._client.aclose())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def fetch_cards(self, card_names):
+        """
+        Fetch card data for many names (blocking, thread-safe)
+
+        Returns:
+            Dictionary mapping name to card data, None for cards Scryfall does not know;
+            names whose lookup failed after retries are left out
+        """
+        if not card_names:
+            return {}
+        return self._call(self.fetch_cards_async(card_names))
+
+    def iter_cards(self, card_names):
+        """
+        Fetch card data for many names, yielding (name, data) as each lookup finishes
+
+        Blocking generator, thread-safe. Names are requested in the given order, so the
+        first names tend to arrive first; names whose lookup failed after retries are skipped.
+        """
+        if not card_names:
+            return
+        results = queue.Queue()
+
+        async def produce():
+            try:
+                async for item in self.iter_cards_async(card_names):
+                    results.put(item)
+            finally:
+                results.put(_DONE)
+
+        asyncio.run_coroutine_threadsafe(produce(), self._loop)
+        while True:
+            item = results.get()
+            if item is _DONE:
+                return
+            yield item
+
+    def _claim(self, card_names):
+        """In-flight future per name; starts collection requests for names not already in flight"""
+        waiting = {}
+        to_fetch = []
+        for name in dict.fromkeys(card_names):
+            future = self._inflight.get(name)
+            if future is None:
+                future = self._inflight[name] = self._loop.create_future()
+                to_fetch.append(name)
+            waiting[name] = future
+
+        tasks = [asyncio.ensure_future(self._fetch_batch(to_fetch[start:start + COLLECTION_BATCH_SIZE]))
+                 for start in range(0, len(to_fetch), COLLECTION_BATCH_SIZE)]
+        return waiting, tasks
+
+    async def fetch_cards_async(self, card_names):
+        """Coroutine version of fetch_cards; must run on this client's loop"""
+        waiting, tasks = self._claim(card_names)
+        await asyncio.gather(*tasks)
+
+        results = {}
+        for name, future in waiting.items():
+            data = await future
+            if data is not _FAILED:
+                results[name] = data
+        return results
+
+    async def iter_cards_async(self, card_names):
+        """Async generator version of iter_cards; must run on this client's loop"""
+        waiting, tasks = self._claim(card_names)
+
+        async def named(name, future):
+            return name, await future
+
+        for finished in asyncio.as_completed([named(name, future) for name, future in waiting.items()]):
+            name, data = await finished
+            if data is not _FAILED:
+                yield name, data
+        await asyncio.gather(*tasks)
+
+    async def _fetch_batch(self, names):
+        futures = {name: self._inflight[name] for name in names}
+        try:
+            found, not_found = await self._fetch_collection(names)
+            for name, data in found.items():
+                futures[name].set_result(data)
+            fuzzy = await asyncio.gather(*(self._fetch_fuzzy(name) for name in not_found))
+            for name, data in zip(not_found, fuzzy):
+                futures[name].set_result(data)
+        except Exception:
+            pass
+        finally:
+            for name, future in futures.items():
+                if not future.done():
+                    future.set_result(_FAILED)
+                self._inflight.pop(name, None)
+
+    async def _fetch_collection(self, names):
+        """Look up to 75 names in one request; returns ({name: data}, [names not matched])"""
+        response = await self._request('POST', '/cards/collection',
+                                       json={'identifiers': [{'name': name} for name in names]})
+        by_name = {}
+        for card in response.json().get('data', []):
+            data = extract_card_data(card)
+            full_name = card.get('name', '')
+            for name in [full_name, *full_name.split(' // ')]:
+                by_name.setdefault(name.lower(), data)
+
+        found, not_found = {}, []
+        for name in names:
+            data = by_name.get(name.lower())
+            if data is None:
+                not_found.append(name)
+            else:
+                found[name] = data
+        return found, not_found
+
+    async def _fetch_fuzzy(self, name):
+        response = await self._request('GET', '/cards/named', params={'fuzzy': name}, allow_404=True)
+        if response.status_code == 404:
+            return None
+        return extract_card_data(response.json())
+
+    async def _request(self, method, path, allow_404=False, **kwargs):
+        """Rate-limited request with retry and exponential backoff on 429/5xx and transport errors"""
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            async with self._semaphore:
+                await self._bucket.acquire()
+                try:
+                    response = await self._client.request(method, path, **kwargs)
+                except httpx.TransportError:
+                    if attempt == self.max_retries:
+                        raise
+                    response = None
+            if response is not None:
+                if response.is_success or (allow_404 and response.status_code == 404):
+                    return response
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    response.raise_for_status()
+                retry_after = response.headers.get('Retry-After')
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+            await asyncio.sleep(delay)
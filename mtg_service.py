@@ -0,0 +1,407 @@
+# mtg_service.py
+# Headless HTTP/JSON service for the MTG Commander Recommendation System
+#
+# Usage: python mtg_service.py [--host 127.0.0.1] [--port 8000] [--workers N]
+#
+# Endpoints:
+#   GET /recommendations?commander=NAME[&top_k=100&include_known=true&max_price=USD]
+#       (the ETag covers the data version, scoring parameters and, with max_price, the price version)
+#   GET /commanders
+#   GET /commander_info?commander=NAME
+#   GET /metrics  (Prometheus text format)
+#
+# One memory-mapped snapshot is shared by the event-loop process and every scoring
+# worker. Concurrent /recommendations requests with the same options are collected for
+# a few milliseconds and scored together with get_recommendations_batch (one matrix
+# product per color-identity chunk), so the event loop never runs the scoring itself.
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from mtg_card_cache import CardMetadataCache
+from mtg_metrics import MetricsRegistry, StageTimer, REQUEST_METRIC
+from mtg_precomputed import SERVING_PARAMS
+from mtg_recommendation_system import DATA_DIR
+from mtg_snapshot import (DEFAULT_SNAPSHOT_DIR, source_hash, snapshot_path, load_snapshot, build_snapshot,
+                          list_deltas, read_delta)
+
+MAX_TOP_K = 500
+BATCH_WINDOW = 0.002       # Seconds to wait for more requests before scoring a batch
+MAX_BATCH = 32             # Commanders per scoring call
+CACHE_MAX_AGE = 300        # Cache-Control max-age for successful responses
+REFRESH_INTERVAL = 30      # Seconds between checks for new snapshot deltas
+
+
+# Per-process state for scoring workers, set by _init_worker
+_worker = {}
+
+
+def _init_worker(path, price_cache_path, scoring_params):
+    system = load_snapshot(path, **scoring_params)
+    if price_cache_path:
+        # Prices are reloaded only when the service sees a new price version (see _score_batch)
+        system.attach_price_source(CardMetadataCache(price_cache_path), refresh_interval=float('inf'))
+    _worker['system'] = system
+
+
+def _score_batch(commanders, top_k, include_known, max_price, price_version):
+    """Score a batch of commanders in a worker, picking up new snapshot deltas and prices first"""
+    system = _worker['system']
+    system.apply_snapshot_deltas()
+    if max_price is not None and system.price_source is not None and price_version != _worker.get('price_version'):
+        # Results then match the price version in the request's ETag
+        system.set_card_prices(system.price_source.get_prices())
+        _worker['price_version'] = price_version
+    return system.get_recommendations_batch(commanders, top_k=top_k, include_known=include_known,
+                                            max_price=max_price)
+
+
+def _commander_info(commander_name):
+    """Commander info from a worker's system, which has every snapshot delta applied"""
+    system = _worker['system']
+    system.apply_snapshot_deltas()
+    return system.get_commander_info(commander_name)
+
+
+class RecommendationBatcher:
+    """
+    Collects concurrent recommendation requests into batches
+
+    Requests are grouped by (top_k, include_known, max_price, price_version). A group is scored when it
+    reaches max_batch distinct commanders or window seconds after its first request,
+    whichever comes first. Identical concurrent requests share one result.
+    """
+
+    def __init__(self, executor, window=BATCH_WINDOW, max_batch=MAX_BATCH, metrics=None):
+        self.executor = executor
+        self.window = window
+        self.max_batch = max_batch
+        self.metrics = metrics
+        self._pending = {}
+
+    async def submit(self, commander_name, top_k, include_known, max_price, price_version=None):
+        loop = asyncio.get_running_loop()
+        key = (top_k, include_known, max_price, price_version)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = {}
+            loop.call_later(self.window, self._flush, key, batch)
+        future = loop.create_future()
+        batch.setdefault(commander_name, []).append(future)
+        if len(batch) >= self.max_batch:
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key, batch):
+        # The timer of a batch already flushed by size must not flush its successor
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        scoring = loop.run_in_executor(self.executor, _score_batch, list(batch), *key)
+        scoring.add_done_callback(lambda done: self._resolve(batch, done, start))
+
+    def _resolve(self, batch, done, start):
+        StageTimer(self.metrics).add('service_batch', time.perf_counter() - start)
+        error = done.exception()
+        results = None if error is not None else done.result()
+        for commander_name, futures in batch.items():
+            for future in futures:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(results.get(commander_name, []))
+
+
+class RecommendationService:
+    """
+    Shared state behind the HTTP endpoints
+
+    Args:
+        path: Snapshot directory (see mtg_snapshot.py)
+        workers: Scoring worker processes (default: CPU count)
+        price_cache_path: Card cache used by workers for max_price filtering (optional)
+        scoring_params: Scoring parameters (default: SERVING_PARAMS, the ones the app serves with)
+        window: Micro-batching window in seconds
+        max_batch: Commanders per scoring call
+        cache_max_age: Cache-Control max-age in seconds
+        refresh_interval: Seconds between checks for new snapshot deltas
+    """
+
+    def __init__(self, path, workers=None, price_cache_path=None, scoring_params=None, window=BATCH_WINDOW,
+                 max_batch=MAX_BATCH, cache_max_age=CACHE_MAX_AGE, refresh_interval=REFRESH_INTERVAL):
+        self.path = path
+        self.workers = workers
+        self.price_cache_path = price_cache_path
+        self.scoring_params = dict(SERVING_PARAMS if scoring_params is None else scoring_params)
+        self.window = window
+        self.max_batch = max_batch
+        self.cache_max_age = cache_max_age
+        self.refresh_interval = refresh_interval
+        self.metrics = MetricsRegistry()
+        self.system = None
+        self.price_source = None
+        self.price_version = None
+        self.executor = None
+        self.batcher = None
+        self.commanders = []
+        self._commander_set = set()
+        self._deltas = set()
+        self._applied_count = 0
+        self._refreshed_at = 0.0
+
+    @classmethod
+    def from_system(cls, system, **options):
+        """Service around an in-process system (scoring runs in a single worker thread, with its parameters)"""
+        service = cls(system.snapshot_path, scoring_params=system.scoring_params(), **options)
+        service.system = system
+        return service
+
+    def start(self):
+        if self.system is None:
+            self.system = load_snapshot(self.path, **self.scoring_params)
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                initargs=(self.path, self.price_cache_path, self.scoring_params))
+            if self.price_cache_path:
+                self.price_source = CardMetadataCache(self.price_cache_path)
+        else:
+            _worker['system'] = self.system
+            self.executor = ThreadPoolExecutor(max_workers=1)
+            self.price_source = self.system.price_source
+        self.batcher = RecommendationBatcher(self.executor, self.window, self.max_batch, self.metrics)
+        self._load_commanders()
+        if isinstance(self.executor, ProcessPoolExecutor):
+            self._add_deltas(*self._read_deltas(self._deltas))
+        self._load_price_version()
+        self._refreshed_at = time.monotonic()
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _load_commanders(self):
+        self.commanders = self.system.get_commanders()
+        self._commander_set = set(self.commanders)
+
+    def _read_deltas(self, seen):
+        """Snapshot deltas not in seen, and the commanders their training rows name (no delta is applied)"""
+        names = [name for name in list_deltas(self.path) if name not in seen]
+        commanders = set()
+        for name in names:
+            delta = read_delta(self.path, name)
+            if delta['kind'] == 'training':
+                commanders.update(delta['rows']['commander'])
+        return names, commanders
+
+    def _add_deltas(self, names, commanders):
+        self._deltas.update(names)
+        if commanders - self._commander_set:
+            self._commander_set |= commanders
+            self.commanders = sorted(self._commander_set)
+
+    def _load_price_version(self):
+        """Price version of the card cache (see CardMetadataCache.price_version); None without one"""
+        if self.price_source is not None:
+            self.price_version = self.price_source.price_version()
+
+    async def refresh(self):
+        """
+        Pick up new prices and snapshot deltas at most once per refresh_interval
+
+        The reads run in a thread, so requests in flight are not held up. Scoring workers
+        apply deltas themselves (see _score_batch); the parent's system is never changed
+        and only learns the commanders that training deltas add.
+        """
+        if time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        self._refreshed_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._load_price_version)
+        if self.system.snapshot_path is None:
+            return
+        if isinstance(self.executor, ProcessPoolExecutor):
+            self._add_deltas(*await loop.run_in_executor(None, self._read_deltas, set(self._deltas)))
+        elif len(self.system.applied_deltas) != self._applied_count:
+            # An in-process system is only modified by its scoring thread
+            self._applied_count = len(self.system.applied_deltas)
+            self._load_commanders()
+
+    def data_version(self):
+        """Identifies the served data: snapshot content hash plus the deltas applied on top"""
+        base = os.path.basename(self.system.snapshot_path) if self.system.snapshot_path else f"local-{id(self.system)}"
+        deltas = self._deltas if isinstance(self.executor, ProcessPoolExecutor) else self.system.applied_deltas
+        return f"{base}.{len(deltas)}"
+
+    def has_commander(self, commander_name):
+        return commander_name in self._commander_set
+
+
+def _cache_headers(service, etag):
+    return {'ETag': etag, 'Cache-Control': f'public, max-age={service.cache_max_age}'}
+
+
+def _json_response(service, payload, etag):
+    """JSON response with ETag and Cache-Control headers"""
+    return Response(json.dumps(payload), media_type='application/json', headers=_cache_headers(service, etag))
+
+
+def _not_modified(request, service, etag):
+    """304 response if the client's cached copy carries the current ETag, else None"""
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=_cache_headers(service, etag))
+    return None
+
+
+def _error(message, status):
+    return Response(json.dumps({'error': message}), status_code=status, media_type='application/json',
+                    headers={'Cache-Control': 'no-store'})
+
+
+def _request_etag(service, *parts):
+    """ETag derived from the data version and the given query parts, known before any scoring happens"""
+    text = '|'.join(str(part) for part in (service.data_version(),) + parts)
+    return f'"{hashlib.sha1(text.encode()).hexdigest()}"'
+
+
+def _parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"not a boolean: {value}")
+
+
+async def recommendations(request):
+    service = request.app.state.service
+    await service.refresh()
+    service.metrics.increment(REQUEST_METRIC, source='service', endpoint='recommendations')
+    query = request.query_params
+    commander_name = query.get('commander')
+    if not commander_name:
+        return _error('commander is required', 400)
+    try:
+        top_k = int(query.get('top_k', 100))
+        include_known = _parse_bool(query.get('include_known', 'true'))
+        max_price = float(query['max_price']) if query.get('max_price') else None
+    except ValueError as e:
+        return _error(f'invalid parameter: {e}', 400)
+    if not 1 <= top_k <= MAX_TOP_K:
+        return _error(f'top_k must be between 1 and {MAX_TOP_K}', 400)
+    # nan would compare False against every price and silently disable the filter
+    if max_price is not None and not (math.isfinite(max_price) and max_price >= 0):
+        return _error('max_price must be a finite, non-negative number', 400)
+    if not service.has_commander(commander_name):
+        return _error(f'unknown commander: {commander_name}', 404)
+
+    # Conditional requests for unchanged data are answered without scoring; price-filtered
+    # results also change with the prices
+    price_version = service.price_version if max_price is not None else None
+    etag = _request_etag(service, commander_name, top_k, include_known, max_price, price_version,
+                         sorted(service.scoring_params.items()))
+    not_modified = _not_modified(request, service, etag)
+    if not_modified is not None:
+        return not_modified
+
+    results = await service.batcher.submit(commander_name, top_k, include_known, max_price, price_version)
+    payload = {
+        'commander': commander_name,
+        'data_version': service.data_version(),
+        'recommendations': results
+    }
+    return _json_response(service, payload, etag)
+
+
+async def commanders(request):
+    service = request.app.state.service
+    await service.refresh()
+    service.metrics.increment(REQUEST_METRIC, source='service', endpoint='commanders')
+    etag = _request_etag(service, 'commanders')
+    return _not_modified(request, service, etag) or _json_response(service, {'commanders': service.commanders}, etag)
+
+
+async def commander_info(request):
+    service = request.app.state.service
+    await service.refresh()
+    service.metrics.increment(REQUEST_METRIC, source='service', endpoint='commander_info')
+    commander_name = request.query_params.get('commander')
+    if not commander_name:
+        return _error('commander is required', 400)
+    if not service.has_commander(commander_name):
+        return _error(f'unknown commander: {commander_name}', 404)
+    etag = _request_etag(service, 'commander_info', commander_name)
+    not_modified = _not_modified(request, service, etag)
+    if not_modified is not None:
+        return not_modified
+    info = await asyncio.get_running_loop().run_in_executor(service.executor, _commander_info, commander_name)
+    if info is None:
+        return _error(f'unknown commander: {commander_name}', 404)
+    return _json_response(service, dict(info, commander=commander_name), etag)
+
+
+async def metrics(request):
+    service = request.app.state.service
+    return Response(service.metrics.to_prometheus(), media_type='text/plain; version=0.0.4',
+                    headers={'Cache-Control': 'no-store'})
+
+
+def create_app(service):
+    """Starlette application serving a RecommendationService"""
+    @asynccontextmanager
+    async def lifespan(app):
+        service.start()
+        try:
+            yield
+        finally:
+            service.stop()
+
+    app = Starlette(
+        routes=[
+            Route('/recommendations', recommendations),
+            Route('/commanders', commanders),
+            Route('/commander_info', commander_info),
+            Route('/metrics', metrics)
+        ],
+        lifespan=lifespan
+    )
+    app.state.service = service
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='HTTP/JSON recommendation service')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--snapshot-dir', default=DEFAULT_SNAPSHOT_DIR)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help='Scoring worker processes')
+    parser.add_argument('--price-cache', default=None, help='Card cache used for max_price filtering')
+    parser.add_argument('--batch-window', type=float, default=BATCH_WINDOW)
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    args = parser.parse_args()
+
+    path = snapshot_path(args.snapshot_dir, source_hash(args.data_dir))
+    if not os.path.isdir(path):
+        path = build_snapshot(args.data_dir, args.snapshot_dir)
+
+    service = RecommendationService(path, workers=args.workers, price_cache_path=args.price_cache,
+                                    window=args.batch_window, max_batch=args.max_batch)
+    print(f"🚀 Serving {os.path.basename(path)} on http://{args.host}:{args.port}")
+    uvicorn.run(create_app(service), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
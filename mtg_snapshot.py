@@ -0,0 +1,358 @@
+# mtg_snapshot.py
+# Binary snapshot of the MTG Commander Recommendation System for fast cold start
+#
+# Layout of <snapshot_dir>/v<SNAPSHOT_VERSION>-<source hash prefix>/:
+#   manifest.json                     version, full source hash, matrix shape
+#   embeddings_{data,indices,indptr}.npy   L2-normalised CSR embedding matrix
+#   cards/*.npy, cards/vocab.json     CardStore columns (numeric arrays and string tables)
+#   {name_codes,code_rows,recommended_codes}.npy, indexes.pkl   name and commander indexes
+#   creatures.pkl, features.pkl       DataFrames (pandas pickle, read only when first used)
+#   tfidf_vectorizer.pkl              read only when new oracle text is embedded
+#   commander_patterns.pkl
+#   deltas/<time_ns>-<pid>-<kind>.pkl  append-only cards/training deltas (add_cards, add_training_examples)
+#
+# Usage: python mtg_snapshot.py [data_dir] [snapshot_dir]
+#
+# Defaults do not depend on the working directory: data_dir is mtg_recommendation_system.DATA_DIR
+# and snapshot_dir is $MTG_SNAPSHOT_DIR or data/snapshot next to this module, as in the app.
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import scipy.sparse as sp
+from mtg_card_store import CardStore
+from mtg_metrics import StageTimer
+
+SNAPSHOT_VERSION = 2
+SOURCE_FILES = ('training_features.csv', 'creatures_processed.csv',
+                'tfidf_vectorizer.pkl', 'commander_patterns.pkl')
+INDEX_ARRAYS = ('name_codes', 'code_rows', 'recommended_codes')
+DEFAULT_SNAPSHOT_DIR = os.environ.get('MTG_SNAPSHOT_DIR',
+                                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'snapshot'))
+# Objects a snapshot-backed system reads on first use (see SnapshotObjects)
+LAZY_FILES = {'creatures': 'creatures.pkl', 'features': 'features.pkl', 'tfidf': 'tfidf_vectorizer.pkl'}
+
+
+def source_hash(data_dir):
+    """Content hash of the source files a snapshot is built from"""
+    digest = hashlib.sha256()
+    for filename in SOURCE_FILES:
+        digest.update(filename.encode())
+        with open(os.path.join(data_dir, filename), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_path(snapshot_dir, content_hash):
+    """Versioned directory for a given source hash"""
+    return os.path.join(snapshot_dir, f"v{SNAPSHOT_VERSION}-{content_hash[:16]}")
+
+
+def write_snapshot(system, snapshot_dir, content_hash):
+    """
+    Write a built recommendation system to a versioned snapshot directory
+
+    The snapshot is written to a temporary directory and renamed into place, so
+    readers never see a partial snapshot. Older snapshot versions are removed; their
+    deltas are carried over (see carry_forward_deltas).
+
+    Args:
+        system: MTGCommanderRecommendationSystem (sparse embeddings required)
+        snapshot_dir: Parent directory for snapshots
+        content_hash: source_hash() of the data the system was built from
+
+    Returns:
+        Path of the written snapshot
+    """
+    if not sp.issparse(system.creature_embeddings):
+        raise ValueError("Snapshots require sparse_embeddings=True")
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    target = snapshot_path(snapshot_dir, content_hash)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=snapshot_dir)
+    try:
+        embeddings = system.creature_embeddings.tocsr()
+        np.save(os.path.join(staging, 'embeddings_data.npy'), embeddings.data)
+        np.save(os.path.join(staging, 'embeddings_indices.npy'), embeddings.indices)
+        np.save(os.path.join(staging, 'embeddings_indptr.npy'), embeddings.indptr)
+
+        system.card_store.save(os.path.join(staging, 'cards'))
+
+        indexes = system.get_indexes()
+        for key in INDEX_ARRAYS:
+            np.save(os.path.join(staging, f'{key}.npy'), np.asarray(indexes[key]))
+        with open(os.path.join(staging, 'indexes.pkl'), 'wb') as f:
+            pickle.dump({key: value for key, value in indexes.items() if key not in INDEX_ARRAYS}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+        system.creatures_df.to_pickle(os.path.join(staging, 'creatures.pkl'))
+        system.features_df.to_pickle(os.path.join(staging, 'features.pkl'))
+        with open(os.path.join(staging, 'tfidf_vectorizer.pkl'), 'wb') as f:
+            pickle.dump(system.tfidf, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(os.path.join(staging, 'commander_patterns.pkl'), 'wb') as f:
+            pickle.dump(system.commander_patterns, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+            json.dump({
+                'version': SNAPSHOT_VERSION,
+                'source_hash': content_hash,
+                'shape': list(embeddings.shape),
+                'n_training_rows': len(indexes['recommended_codes'])
+            }, f, indent=2)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    try:
+        os.rename(staging, target)
+    except OSError:
+        # Another worker already published a snapshot for the same source hash
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(target):
+            raise
+
+    # Drop snapshots built from older data or by older versions. Each is renamed first, so
+    # processes still holding its path cannot append to it, and its deltas are carried over
+    retired = []
+    for entry in sorted(os.listdir(snapshot_dir)):
+        path = os.path.join(snapshot_dir, entry)
+        if entry.startswith('.retired-'):
+            # Left behind by a rebuild that did not finish
+            retired.append(path)
+        elif entry.startswith('v') and path != target and os.path.isdir(path):
+            retired_path = os.path.join(snapshot_dir, f".retired-{entry}-{os.getpid()}")
+            try:
+                os.rename(path, retired_path)
+            except OSError:
+                continue
+            retired.append(retired_path)
+    carried = carry_forward_deltas(system, retired, target)
+    for path in retired:
+        shutil.rmtree(path, ignore_errors=True)
+
+    print(f"💾 Snapshot written to {target}" + (f" ({carried} deltas carried over)" if carried else ""))
+    return target
+
+
+def carry_forward_deltas(system, old_paths, target):
+    """
+    Copy the deltas of replaced snapshots into a new snapshot, in creation order
+
+    Rows the new snapshot's sources already contain (card names, commander and
+    recommended creature pairs) are dropped, so deltas folded into the source files are
+    not applied twice.
+
+    Args:
+        system: System the new snapshot was written from
+        old_paths: Snapshot directories being replaced
+        target: New snapshot directory
+
+    Returns:
+        Number of deltas written to target
+    """
+    deltas = sorted((name, path) for path in old_paths for name in list_deltas(path))
+    if not deltas:
+        return 0
+    known_cards = set(system.card_store.names)
+    features_df = system.features_df
+    known_pairs = set(zip(features_df['commander'], features_df['recommended_creature']))
+
+    carried = 0
+    for name, path in deltas:
+        try:
+            delta = read_delta(path, name)
+        except OSError:
+            # Carried over by a concurrent rebuild
+            continue
+        rows = delta['rows']
+        if delta['kind'] == 'cards':
+            rows = rows[~rows['name'].isin(known_cards)]
+            known_cards.update(rows['name'])
+        else:
+            pairs = list(zip(rows['commander'], rows['recommended_creature']))
+            rows = rows[[pair not in known_pairs for pair in pairs]]
+            known_pairs.update(pairs)
+        if len(rows) or delta['commander_patterns']:
+            _write_delta(target, name, dict(delta, rows=rows))
+            carried += 1
+    return carried
+
+
+def read_manifest(path):
+    """Manifest of a snapshot directory, or None if missing or from another version"""
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        return None
+    return manifest
+
+
+class SnapshotObjects:
+    """
+    Pickled DataFrames and vectorizer of a snapshot, read on first use
+
+    The files are opened up front, so they stay readable after a newer snapshot prunes
+    this one; reads use pread, so forked workers sharing the descriptors do not race.
+    """
+
+    def __init__(self, path):
+        self._fds = {kind: os.open(os.path.join(path, filename), os.O_RDONLY) for kind, filename in LAZY_FILES.items()}
+
+    def __call__(self, kind):
+        fd = self._fds[kind]
+        return pickle.loads(os.pread(fd, os.fstat(fd).st_size, 0))
+
+
+def load_snapshot(path, mmap_mode='r', **scoring_params):
+    """
+    Load a recommendation system from a snapshot directory
+
+    Embedding, card and index arrays are memory-mapped, so worker processes loading the
+    same snapshot share page-cache pages, and no oracle text is re-vectorised. The
+    DataFrames and the vectorizer are not loaded until something asks for them.
+
+    Args:
+        path: Snapshot directory (see snapshot_path)
+        mmap_mode: numpy memory-map mode for array files (None loads into memory)
+        **scoring_params: Scoring parameters (and metrics sink) passed to MTGCommanderRecommendationSystem
+
+    Returns:
+        MTGCommanderRecommendationSystem, or None if the snapshot is missing or incompatible
+    """
+    from mtg_recommendation_system import MTGCommanderRecommendationSystem
+
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+
+    def load_array(name):
+        return np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+
+    with StageTimer(scoring_params.get('metrics')).stage('load'):
+        embeddings = sp.csr_matrix(
+            (load_array('embeddings_data.npy'), load_array('embeddings_indices.npy'), load_array('embeddings_indptr.npy')),
+            shape=tuple(manifest['shape']), copy=False
+        )
+
+        with open(os.path.join(path, 'commander_patterns.pkl'), 'rb') as f:
+            commander_patterns = pickle.load(f)
+        with open(os.path.join(path, 'indexes.pkl'), 'rb') as f:
+            indexes = pickle.load(f)
+        for key in INDEX_ARRAYS:
+            indexes[key] = load_array(f'{key}.npy')
+
+        card_store = CardStore.load(os.path.join(path, 'cards'), mmap_mode=mmap_mode)
+
+    print(f"⚡ Loaded snapshot {os.path.basename(path)} "
+          f"({manifest['shape'][0]:,} creatures, {manifest['n_training_rows']:,} training examples)")
+    system = MTGCommanderRecommendationSystem(
+        tfidf=None,
+        commander_patterns=commander_patterns,
+        creatures_df=None,
+        features_df=None,
+        creature_embeddings=embeddings,
+        card_store=card_store,
+        indexes=indexes,
+        frame_loader=SnapshotObjects(path),
+        **scoring_params
+    )
+    system.snapshot_path = path
+    system.source_hash = manifest['source_hash']
+    apply_deltas(system, path)
+    return system
+
+
+def append_delta(path, kind, rows, commander_patterns=None):
+    """
+    Append a cards or training delta to a snapshot directory
+
+    Deltas are never rewritten: each one is a new file, renamed into place so readers
+    never see a partial write. Names sort in creation order.
+
+    Args:
+        path: Snapshot directory
+        kind: 'cards' (creatures_processed rows) or 'training' (training_features rows)
+        rows: DataFrame of new rows
+        commander_patterns: Optional {commander: patterns} entries (training deltas)
+
+    Returns:
+        File name of the delta
+    """
+    name = f"{time.time_ns():020d}-{os.getpid()}-{kind}.pkl"
+    _write_delta(path, name, {'kind': kind, 'rows': rows, 'commander_patterns': commander_patterns})
+    return name
+
+
+def _write_delta(path, name, delta):
+    directory = os.path.join(path, 'deltas')
+    staging = os.path.join(directory, f".{name}.tmp")
+    try:
+        # Not makedirs: a snapshot retired by a rebuild must not be recreated
+        os.mkdir(directory)
+    except FileExistsError:
+        pass
+    try:
+        with open(staging, 'wb') as f:
+            pickle.dump(delta, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(staging, os.path.join(directory, name))
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Snapshot {path} was replaced by a rebuild; reload the system before adding data") from None
+
+
+def list_deltas(path):
+    """File names of a snapshot's deltas in creation order"""
+    try:
+        return sorted(name for name in os.listdir(os.path.join(path, 'deltas')) if name.endswith('.pkl'))
+    except OSError:
+        return []
+
+
+def read_delta(path, name):
+    """Delta dictionary with kind, rows and commander_patterns"""
+    with open(os.path.join(path, 'deltas', name), 'rb') as f:
+        return pickle.load(f)
+
+
+def apply_deltas(system, path):
+    """
+    Apply snapshot deltas the system has not seen yet, in creation order
+
+    Returns:
+        Number of deltas applied
+    """
+    applied = 0
+    for name in list_deltas(path):
+        if name in system.applied_deltas:
+            continue
+        delta = read_delta(path, name)
+        if delta['kind'] == 'cards':
+            system.add_cards(delta['rows'], persist=False)
+        else:
+            system.add_training_examples(delta['rows'], delta['commander_patterns'], persist=False)
+        system.applied_deltas.add(name)
+        applied += 1
+    return applied
+
+
+def build_snapshot(data_dir=None, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    """Build the system from the source files in data_dir (default: DATA_DIR) and write a snapshot for it"""
+    from mtg_recommendation_system import DATA_DIR, load_system_from_sources
+
+    data_dir = data_dir or DATA_DIR
+    content_hash = source_hash(data_dir)
+    system = load_system_from_sources(data_dir, sparse_embeddings=True)
+    return write_snapshot(system, snapshot_dir, content_hash)
+
+
+if __name__ == "__main__":
+    build_snapshot(*sys.argv[1:3])
@@ -0,0 +1,358 @@
+# test_mtg_recommendation_system.py
+# The vectorized scoring engine must return what the original per-creature loop returned
+#
+# Run with: python -m pytest -q
+
+import ast
+import os
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+from mtg_benchmark import generate_synthetic_data
+from mtg_precomputed import refresh_precomputed_table
+from mtg_recommendation_system import create_recommendation_system
+
+N_CARDS = 3000
+N_COMMANDERS = 12
+TOP_K = 50
+# Cached row norms (dense) and L2-normalised rows (sparse) round differently from sklearn's cosine_similarity
+SCORE_TOLERANCE = 1e-12
+
+
+@pytest.fixture(scope='module')
+def data_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp('synthetic')
+    # Consensus lists make the keyword and type boosts fire, so every scoring rule is compared
+    generate_synthetic_data(str(path), n_cards=N_CARDS, seed=3, consensus_fraction=0.4)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def reference(data_dir):
+    return ScalarReference(data_dir)
+
+
+@pytest.fixture(scope='module', params=[False, True], ids=['dense', 'sparse'])
+def system(request, data_dir):
+    return create_recommendation_system(sparse_embeddings=request.param, data_dir=data_dir)
+
+
+class ScalarReference:
+    """The original get_recommendations loop, scoring one creature at a time"""
+
+    def __init__(self, data_dir, keyword_boost=0.1, type_boost=0.1, power_boost=0.05,
+                 toughness_boost=0.05, known_penalty=0.85, short_text_penalty=0.90):
+        self.features_df = pd.read_csv(f"{data_dir}/training_features.csv")
+        self.creatures_df = pd.read_csv(f"{data_dir}/creatures_processed.csv")
+        with open(f"{data_dir}/tfidf_vectorizer.pkl", 'rb') as f:
+            tfidf = pickle.load(f)
+        with open(f"{data_dir}/commander_patterns.pkl", 'rb') as f:
+            self.commander_patterns = pickle.load(f)
+        self.creature_embeddings = tfidf.transform(self.creatures_df['oracle_text_clean'].fillna('')).toarray()
+        self.keyword_boost = keyword_boost
+        self.type_boost = type_boost
+        self.power_boost = power_boost
+        self.toughness_boost = toughness_boost
+        self.known_penalty = known_penalty
+        self.short_text_penalty = short_text_penalty
+        self._results = {}
+
+    def _get_power_toughness_patterns(self, commander_recs):
+        patterns = {'high_power_boost': False, 'low_power_boost': False, 'high_toughness_boost': False}
+        pt_data = []
+        for _, rec in commander_recs.iterrows():
+            creature = self.creatures_df[self.creatures_df['name'] == rec['recommended_creature']]
+            if len(creature) > 0:
+                pt_data.append((creature.iloc[0]['power_clean'], creature.iloc[0]['toughness_clean']))
+        if not pt_data:
+            return patterns
+        total = len(pt_data)
+        powers, _ = zip(*pt_data)
+        if sum(1 for p in powers if p >= 4) / total >= 0.75:
+            patterns['high_power_boost'] = True
+        if sum(1 for p in powers if p <= 2) / total >= 0.75:
+            patterns['low_power_boost'] = True
+        if sum(1 for p, t in pt_data if t > p) / total >= 0.80:
+            patterns['high_toughness_boost'] = True
+        return patterns
+
+    @staticmethod
+    def _is_valid_color_identity(creature_colors, commander_colors):
+        if not creature_colors:
+            return True
+        if not commander_colors:
+            return False
+        return set(creature_colors).issubset(set(commander_colors))
+
+    def get_recommendations(self, commander_name, top_k=100, include_known=True):
+        key = (commander_name, include_known)
+        if key not in self._results:
+            self._results[key] = self._score(commander_name, include_known)
+        return self._results[key][:top_k]
+
+    def _score(self, commander_name, include_known):
+        commander_recs = self.features_df[self.features_df['commander'] == commander_name]
+        commander_info = self.creatures_df[self.creatures_df['name'] == commander_name]
+        if len(commander_recs) == 0 or len(commander_info) == 0:
+            return []
+        commander_colors = ast.literal_eval(commander_info.iloc[0]['color_identity_parsed'])
+
+        patterns = self.commander_patterns.get(commander_name, {})
+        consensus_keywords = [kw for kw, _ in patterns.get('consensus_keywords', [])]
+        consensus_types = [st for st, _ in patterns.get('consensus_types', [])]
+        pt_patterns = self._get_power_toughness_patterns(commander_recs)
+
+        rec_indices = []
+        for _, rec in commander_recs.iterrows():
+            idx = self.creatures_df[self.creatures_df['name'] == rec['recommended_creature']].index
+            if len(idx) > 0:
+                rec_indices.append(idx[0])
+        if not rec_indices:
+            return []
+
+        target_embedding = np.mean(self.creature_embeddings[rec_indices], axis=0)
+        similarities = cosine_similarity([target_embedding], self.creature_embeddings)[0]
+        known_creatures = set(commander_recs['recommended_creature'])
+        recommendations = []
+        for similarity, creature in zip(similarities, self.creatures_df.itertuples()):
+            if creature.name == commander_name:
+                continue
+            is_known = creature.name in known_creatures
+            if not include_known and is_known:
+                continue
+            if not self._is_valid_color_identity(ast.literal_eval(creature.color_identity_parsed),
+                                                 commander_colors):
+                continue
+
+            score = similarity
+            boosts = []
+            creature_keywords = ast.literal_eval(creature.keywords_parsed) if creature.keywords_parsed else []
+            if any(kw in creature_keywords for kw in consensus_keywords):
+                score += self.keyword_boost
+                boosts.append(f"Keyword +{self.keyword_boost:.2f}")
+            creature_types = str(creature.secondary_type).split() if creature.secondary_type else []
+            for consensus_type in consensus_types:
+                if consensus_type in creature_types:
+                    score += self.type_boost
+                    boosts.append(f"Type({consensus_type}) +{self.type_boost:.2f}")
+                    break
+            if pt_patterns['high_power_boost'] and creature.power_clean >= 4:
+                score += self.power_boost
+                boosts.append(f"HighPower +{self.power_boost:.2f}")
+            if pt_patterns['low_power_boost'] and creature.power_clean <= 2:
+                score += self.power_boost
+                boosts.append(f"LowPower +{self.power_boost:.2f}")
+            if pt_patterns['high_toughness_boost'] and creature.toughness_clean > creature.power_clean:
+                score += self.toughness_boost
+                boosts.append(f"HighToughness +{self.toughness_boost:.2f}")
+
+            penalties = []
+            if is_known:
+                score *= self.known_penalty
+                penalties.append(f"Known -{(1 - self.known_penalty) * 100:.0f}%")
+            oracle_length = len(str(creature.oracle_text_clean)) if creature.oracle_text_clean else 0
+            if oracle_length < 40:
+                score *= self.short_text_penalty
+                penalties.append(f"ShortText -{(1 - self.short_text_penalty) * 100:.0f}%")
+
+            recommendations.append({
+                'creature_name': creature.name,
+                'base_similarity': similarity,
+                'final_score': score,
+                'boosts': boosts,
+                'penalties': penalties,
+                'is_known': is_known,
+                'power_toughness': f"{creature.power_clean:.0f}/{creature.toughness_clean:.0f}",
+                'oracle_length': oracle_length
+            })
+        recommendations.sort(key=lambda x: x['final_score'], reverse=True)
+        return recommendations
+
+
+def assert_same_recommendations(actual, expected):
+    assert [rec['creature_name'] for rec in actual] == [rec['creature_name'] for rec in expected]
+    for got, want in zip(actual, expected):
+        assert got['final_score'] == pytest.approx(want['final_score'], rel=0, abs=SCORE_TOLERANCE)
+        assert got['base_similarity'] == pytest.approx(want['base_similarity'], rel=0, abs=SCORE_TOLERANCE)
+        for field in ('boosts', 'penalties', 'is_known', 'power_toughness', 'oracle_length'):
+            assert got[field] == want[field], field
+
+
+def commanders(system):
+    return system.get_commanders()[:N_COMMANDERS]
+
+
+def test_reference_exercises_every_rule(system, reference):
+    labels = {label.split(' ')[0].split('(')[0]
+              for name in commanders(system)
+              for rec in reference.get_recommendations(name, TOP_K)
+              for label in rec['boosts'] + rec['penalties']}
+    assert {'Keyword', 'Type', 'Known', 'ShortText'} <= labels
+
+
+@pytest.mark.parametrize('include_known', [True, False])
+def test_get_recommendations_matches_scalar_loop(system, reference, include_known):
+    system.clear_result_cache()
+    for name in commanders(system):
+        assert_same_recommendations(system.get_recommendations(name, top_k=TOP_K, include_known=include_known),
+                                    reference.get_recommendations(name, TOP_K, include_known))
+
+
+@pytest.mark.parametrize('include_known', [True, False])
+def test_get_recommendations_batch_matches_scalar_loop(system, reference, include_known):
+    results = system.get_recommendations_batch(commanders(system), top_k=TOP_K, include_known=include_known,
+                                               chunk_size=5, use_cache=False)
+    assert list(results) == commanders(system)
+    for name, recommendations in results.items():
+        assert_same_recommendations(recommendations, reference.get_recommendations(name, TOP_K, include_known))
+
+
+def split_prices(system, expensive=200.0, cheap=1.0):
+    """Every other creature priced over a $100 ceiling"""
+    return {name: expensive if row % 2 else cheap for row, name in enumerate(system.card_store.names)}
+
+
+def test_precomputed_table_with_max_price_on_first_lookup(data_dir, tmp_path):
+    table_path = str(tmp_path / 'precomputed.duckdb')
+    live = create_recommendation_system(sparse_embeddings=True, data_dir=data_dir)
+    refresh_precomputed_table(live, table_path, top_n=100)
+    live.set_card_prices(split_prices(live))
+
+    served = create_recommendation_system(sparse_embeddings=True, data_dir=data_dir)
+    served.attach_precomputed_table(table_path)
+    served.set_card_prices(split_prices(served))
+    # The table has not been opened yet: the first lookup must read its depth before filtering
+    for name in commanders(served):
+        recommendations, breakdown = served.get_recommendations(name, top_k=25, max_price=100, profile=True)
+        assert set(breakdown) == {'precomputed', 'total'}
+        assert_same_recommendations(recommendations, live.get_recommendations(name, top_k=25, max_price=100))
+        assert len(recommendations) == 25
+
+
+def test_rebuilt_snapshot_keeps_ingested_deltas(data_dir, tmp_path):
+    source_dir = str(tmp_path / 'processed')
+    snapshot_dir = str(tmp_path / 'snapshot')
+    shutil.copytree(data_dir, source_dir)
+    system = create_recommendation_system(sparse_embeddings=True, data_dir=source_dir, snapshot_dir=snapshot_dir)
+    commander_name = commanders(system)[0]
+    creatures = pd.read_csv(os.path.join(source_dir, 'creatures_processed.csv'))
+    new_cards = creatures.head(2).assign(name=['Ingested Card', 'Folded Card'])
+    system.add_cards(new_cards)
+    system.add_training_examples(pd.DataFrame({'commander': [commander_name] * 2,
+                                               'recommended_creature': ['Ingested Card', 'Folded Card'],
+                                               'synergy': [0.5, 0.5]}))
+    old_path = system.snapshot_path
+
+    # New source files that already contain one of the ingested cards
+    pd.concat([creatures, new_cards.tail(1)]).to_csv(os.path.join(source_dir, 'creatures_processed.csv'), index=False)
+    rebuilt = create_recommendation_system(sparse_embeddings=True, data_dir=source_dir, snapshot_dir=snapshot_dir)
+    assert rebuilt.snapshot_path != old_path and not os.path.exists(old_path)
+    names = list(rebuilt.card_store.names)
+    assert names.count('Ingested Card') == 1 and names.count('Folded Card') == 1
+    training = rebuilt.features_df
+    assert set(training.loc[training['commander'] == commander_name, 'recommended_creature']) >= {'Ingested Card',
+                                                                                                  'Folded Card'}
+
+    # A process still holding the replaced snapshot cannot write into it
+    with pytest.raises(FileNotFoundError):
+        system.add_cards(new_cards.head(1).assign(name='Late Card'))
+    assert not os.path.exists(old_path)
+
+
+@pytest.fixture
+def fresh_system(data_dir):
+    """A system the test may change (prices, cards, training rows)"""
+    return create_recommendation_system(sparse_embeddings=True, data_dir=data_dir)
+
+
+def test_max_price_filters_before_top_k(fresh_system):
+    prices = split_prices(fresh_system)
+    # Unknown prices are kept
+    del prices[fresh_system.card_store.names[1]]
+    fresh_system.set_card_prices(prices)
+    names = commanders(fresh_system)
+    batch = fresh_system.get_recommendations_batch(names, top_k=25, max_price=100, use_cache=False)
+    for name in names:
+        unfiltered = fresh_system.get_recommendations(name, top_k=len(fresh_system.card_store))
+        expected = [rec for rec in unfiltered if not prices.get(rec['creature_name'], 0) > 100][:25]
+        assert_same_recommendations(fresh_system.get_recommendations(name, top_k=25, max_price=100), expected)
+        assert_same_recommendations(batch[name], expected)
+
+
+def test_result_cache_hits_and_invalidation(fresh_system):
+    name = commanders(fresh_system)[0]
+    fresh_system.set_card_prices({})
+    first = fresh_system.get_recommendations(name, top_k=25, max_price=100)
+    assert fresh_system.get_recommendations(name, top_k=10, max_price=100) == first[:10]
+    assert fresh_system.result_cache_info()['hits'] == 1
+
+    # New prices change price-filtered results only
+    fresh_system.set_card_prices({first[0]['creature_name']: 200.0})
+    assert fresh_system.get_recommendations(name, top_k=25, max_price=100)[0] == first[1]
+    unfiltered = fresh_system.get_recommendations(name, top_k=25)
+    assert fresh_system.get_recommendations(name, top_k=25) == unfiltered
+    assert fresh_system.result_cache_info()['hits'] == 2
+
+    # New data drops every cached result
+    creatures = fresh_system.creatures_df
+    fresh_system.add_cards(creatures[creatures['name'] == first[0]['creature_name']].assign(name='Copied Card'))
+    copied = fresh_system.get_recommendations(name, top_k=25)
+    assert fresh_system.result_cache_info()['hits'] == 2
+    assert 'Copied Card' in [rec['creature_name'] for rec in copied]
+
+
+def test_rescore_matches_a_system_built_with_the_weights(data_dir, fresh_system):
+    weights = dict(fresh_system.scoring_params(), keyword_boost=0.3, known_penalty=0.5, short_text_penalty=0.7)
+    reweighted = create_recommendation_system(sparse_embeddings=True, data_dir=data_dir, **weights)
+    for name in commanders(fresh_system):
+        assert_same_recommendations(fresh_system.rescore(name, fresh_system.scoring_params(), top_k=TOP_K),
+                                    fresh_system.get_recommendations(name, top_k=TOP_K))
+        assert_same_recommendations(fresh_system.rescore(name, weights, top_k=TOP_K),
+                                    reweighted.get_recommendations(name, top_k=TOP_K))
+
+
+def test_ingested_data_matches_a_full_build(data_dir, tmp_path, fresh_system):
+    creatures = pd.read_csv(os.path.join(data_dir, 'creatures_processed.csv'))
+    training = pd.read_csv(os.path.join(data_dir, 'training_features.csv'))
+    names = commanders(fresh_system)
+    held_out_cards = creatures.tail(300)
+    held_out_rows = training['commander'].isin(names[:3])
+
+    partial_dir = str(tmp_path / 'partial')
+    shutil.copytree(data_dir, partial_dir)
+    creatures.head(len(creatures) - 300).to_csv(os.path.join(partial_dir, 'creatures_processed.csv'), index=False)
+    training[~held_out_rows].to_csv(os.path.join(partial_dir, 'training_features.csv'), index=False)
+    ingested = create_recommendation_system(sparse_embeddings=True, data_dir=partial_dir)
+    ingested.add_cards(held_out_cards)
+    ingested.add_training_examples(training[held_out_rows])
+
+    # Training rows are appended after the kept ones, which only reorders rows within a commander
+    assert ingested.get_commanders() == sorted(fresh_system.get_commanders())
+    for name in names:
+        assert_same_recommendations(ingested.get_recommendations(name, top_k=TOP_K),
+                                    fresh_system.get_recommendations(name, top_k=TOP_K))
+
+
+def test_deck_state(fresh_system):
+    name = commanders(fresh_system)[0]
+    # One commander and no deck scores like get_recommendations
+    assert_same_recommendations(fresh_system.get_deck_recommendations([name], top_k=TOP_K),
+                                fresh_system.get_recommendations(name, top_k=TOP_K))
+
+    # Adding cards one at a time matches building the state with the whole deck
+    deck = [rec['creature_name'] for rec in fresh_system.get_recommendations(name, top_k=5)]
+    state = fresh_system.get_deck_state([name], deck[:2])
+    fresh_system.add_to_deck(state, deck[2:])
+    incremental = fresh_system.recommend_for_deck(state, top_k=TOP_K)
+    assert_same_recommendations(incremental, fresh_system.get_deck_recommendations([name], deck, top_k=TOP_K))
+    assert not set(deck) & {rec['creature_name'] for rec in incremental}
+
+    # A price-filtered state is rebuilt when prices change
+    fresh_system.set_card_prices({})
+    state = fresh_system.get_deck_state([name], max_price=100)
+    top = fresh_system.recommend_for_deck(state, top_k=TOP_K)
+    fresh_system.set_card_prices({top[0]['creature_name']: 200.0})
+    assert_same_recommendations(fresh_system.recommend_for_deck(state, top_k=TOP_K - 1), top[1:])
@@ -0,0 +1,34 @@
+# test_mtg_service.py
+# HTTP request handling of the recommendation service
+#
+# Run with: python -m pytest -q
+
+import pytest
+from starlette.testclient import TestClient
+from mtg_benchmark import generate_synthetic_data
+from mtg_recommendation_system import create_recommendation_system
+from mtg_service import RecommendationService, create_app
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp('synthetic'))
+    generate_synthetic_data(data_dir, n_cards=600, seed=1)
+    system = create_recommendation_system(sparse_embeddings=True, data_dir=data_dir,
+                                          snapshot_dir=str(tmp_path_factory.mktemp('snapshot')))
+    system.set_card_prices({name: 1.0 for name in system.card_store.names})
+    with TestClient(create_app(RecommendationService.from_system(system, window=0))) as client:
+        client.commander_name = system.get_commanders()[0]
+        yield client
+
+
+@pytest.mark.parametrize('max_price', ['nan', 'inf', '-inf', '-1'])
+def test_max_price_must_be_finite_and_non_negative(client, max_price):
+    response = client.get('/recommendations', params={'commander': client.commander_name, 'max_price': max_price})
+    assert response.status_code == 400
+
+
+def test_max_price_filters(client):
+    params = {'commander': client.commander_name, 'top_k': 10}
+    assert len(client.get('/recommendations', params=dict(params, max_price='5')).json()['recommendations']) == 10
+    assert client.get('/recommendations', params=dict(params, max_price='0.5')).json()['recommendations'] == []